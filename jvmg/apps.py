@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class JvmgConfig(AppConfig):
     name = 'jvmg'
+
+    def ready(self):
+        from . import label_snapshot
+
+        # only the file is read, a worker without snapshot looks up labels per request
+        label_snapshot.load()
@@ -0,0 +1,68 @@
+"""
+Paginated back-links.
+
+Popular resources (tags, studios, ...) are the object of tens of thousands of
+triples. Instead of fetching all of them with `settings.QUERY`, the html view
+fetches `settings.QUERY_FORWARD`, counts the back-links per (graph, predicate)
+and only loads the first `settings.BACK_LINK_PAGE_SIZE` subjects for each of
+them. Later pages are loaded by the browser from `views.get_back_links`.
+
+Blank nodes linking to the resource have no URI to link to or to page by, they
+are left out of the counts and pages. They are fetched at once with
+`settings.QUERY_BACK_LINK_BLANK_NODES` instead, like `settings.QUERY` does, and
+shown as the blank nodes of their predicate.
+"""
+import json
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from rdflib import URIRef
+from SPARQLWrapper import JSON
+
+from . import sparql
+
+if TYPE_CHECKING:
+    from .selection import Selection
+
+# characters which are not allowed in IRIs and would break out of <...> in a sparql query
+INVALID_URI_CHARS = set('<>"{}|^`\\ \n\r\t')
+
+
+def is_valid_uri(uri: str) -> bool:
+    """checks an URI given by the user before it is put into a sparql query"""
+    if INVALID_URI_CHARS.intersection(uri):
+        return False
+    try:
+        URLValidator()(uri)
+    except ValidationError:
+        return False
+    return True
+
+
+def paginated(query: str) -> bool:
+    """back-links are only paginated for the default query, custom queries are used as they are"""
+    return bool(settings.BACK_LINK_PAGE_SIZE) and query == settings.QUERY
+
+
+async def fetch_counts(resource_uri: URIRef, selection: "Selection") -> dict[tuple[URIRef, URIRef], int]:
+    """returns the number of back-links of resource_uri for each (graph, predicate) in the graphs of selection"""
+    query = selection.apply(settings.QUERY_BACK_LINK_COUNTS.replace("$resource", resource_uri))
+    result = json.loads(await sparql.fetch(resource_uri, query, JSON))
+    return {
+        (URIRef(row["graph"]["value"]), URIRef(row["predicate"]["value"])): int(row["count"]["value"])
+        for row in result["results"]["bindings"]
+        if "graph" in row  # an aggregate over no back-links at all may return one empty row
+    }
+
+
+async def fetch_page(resource_uri: URIRef, graph: URIRef, predicate: URIRef, offset: int) -> bytes:
+    """returns one page of back-links (and their labels) of resource_uri in settings.HTML_RESULT_FORMAT"""
+    query = (settings.QUERY_BACK_LINK_PAGE
+             .replace("$resource", resource_uri)
+             .replace("$graph", graph)
+             .replace("$predicate", predicate)
+             .replace("$limit", str(settings.BACK_LINK_PAGE_SIZE))
+             .replace("$offset", str(offset)))
+    return await sparql.fetch(resource_uri, query, settings.HTML_RESULT_FORMAT)
@@ -0,0 +1,126 @@
+"""
+Lookup of many resources with one query.
+
+Bulk clients resolve hundreds of URIs at a time. Instead of one `settings.QUERY`
+per resource, `fetch` sends one query for up to `settings.BATCH_CHUNK_SIZE`
+resources (the chunks of a request concurrently). It is built from
+`settings.QUERY` (see `build_query`), so it can't drift from it. The merged
+N-Quads result is split into the lines of each resource: the triples with the
+resource as subject or object, the triples of its blank nodes and the labels of
+all nodes and graphs in them, like `settings.QUERY` returns them. A graph label
+found for another resource of the same query may be added to the graphs of a
+resource which `settings.QUERY` alone wouldn't label.
+"""
+import asyncio
+import json
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rdflib import ConjunctiveGraph
+
+from . import nquads, sparql
+from .labels import batches
+from .selection import EVERYTHING, Selection
+
+# the prologue and CONSTRUCT template (head) and the graph pattern of settings.QUERY
+QUERY_PARTS = re.compile(r"(?P<head>.*?)\bwhere\s*\{(?P<pattern>.*)\}\s*", re.DOTALL | re.IGNORECASE)
+
+
+@dataclass(frozen=True, slots=True)
+class Quad:
+    line: str
+    subject: str
+    predicate: str
+    object: Optional[str]  # None for literals
+    graph: Optional[str]  # None for the default graph
+
+
+def _node(iri: Optional[str], bnode: Optional[str]) -> Optional[str]:
+    if iri is not None:
+        return iri
+    if bnode is not None:
+        return "_:" + bnode
+    return None
+
+
+def build_query(resource_uris: list[str], selection: Selection = EVERYTHING) -> str:
+    """
+    settings.QUERY for many resources: its graph pattern once per resource (with $resource
+    replaced), joined with UNION under its CONSTRUCT template. $resource stays a constant in
+    each copy, a VALUES clause couldn't reach the FILTERs inside its GRAPH blocks.
+    """
+    match = QUERY_PARTS.fullmatch(settings.QUERY)
+    if match is None:
+        raise ImproperlyConfigured("the batch lookup needs a QUERY of the form CONSTRUCT { ... } WHERE { ... }")
+    patterns = "\n  UNION\n".join("  {" + match["pattern"].replace("$resource", uri) + "}" for uri in resource_uris)
+    return selection.apply(f"{match['head']}where {{\n{patterns}\n}}\n")
+
+
+def split(data: bytes, resource_uris: Iterable[str]) -> dict[str, list[str]]:
+    """splits a N-Quads result of build_query into the N-Quads lines of each resource, [] if it has none"""
+    resources = {str(uri): [] for uri in resource_uris}
+    label_uris = set(settings.LABEL_URIS + settings.GRAPH_LABEL_URIS)
+
+    by_subject: dict[str, list[Quad]] = {}
+    by_object: dict[str, list[Quad]] = {}
+    for number, line in enumerate(data.decode("utf-8").split("\n"), 1):
+        match = nquads.QUAD.fullmatch(line)
+        if match is None:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            raise nquads.ParseError(f"invalid N-Quads in line {number}: {line[:200]!r}")
+        (s_iri, s_bnode, p_iri, o_iri, o_bnode, _, _, _, g_iri, g_bnode) = match.groups()
+        quad = Quad(line.strip(), _node(s_iri, s_bnode), p_iri, _node(o_iri, o_bnode), _node(g_iri, g_bnode))
+        by_subject.setdefault(quad.subject, []).append(quad)
+        if quad.object in resources:
+            by_object.setdefault(quad.object, []).append(quad)
+
+    for uri, lines in resources.items():
+        # the labels in the default graph aren't triples of the resource itself
+        forward = [quad for quad in by_subject.get(uri, ()) if quad.graph is not None]
+        backward = [quad for quad in by_object.get(uri, ()) if quad.graph is not None]
+        if not forward and not backward:
+            continue
+        quads = dict.fromkeys(forward + backward)
+        # the nodes QUERY returns the labels of: in the default graph, in each graph
+        labelled = {quad.predicate for quad in quads}
+        labelled.update(quad.object for quad in forward)
+        labelled.update(quad.subject for quad in backward)
+        labelled_in_graph = {(quad.graph, quad.graph) for quad in quads}
+        for quad in forward:
+            if quad.object is not None and quad.object.startswith("_:"):
+                for blank in by_subject.get(quad.object, ()):
+                    if blank.graph == quad.graph:
+                        quads[blank] = None
+                        labelled_in_graph.update(((quad.graph, blank.predicate), (quad.graph, blank.object)))
+
+        for node in labelled | {node for _, node in labelled_in_graph}:
+            for quad in by_subject.get(node, ()):
+                if quad.predicate in label_uris and (quad.graph is None and node in labelled
+                                                     or (quad.graph, node) in labelled_in_graph):
+                    quads[quad] = None
+        lines.extend(dict.fromkeys(quad.line for quad in quads))
+    return resources
+
+
+async def fetch(resource_uris: list[str], selection: Selection = EVERYTHING) -> dict[str, list[str]]:
+    """returns the N-Quads lines of each resource, [] for resources without triples. graphs hidden by selection are left out"""
+    async def fetch_chunk(chunk: list[str]) -> dict[str, list[str]]:
+        query = build_query(chunk, selection)
+        return split(await sparql.query_endpoint(query, sparql.NQUADS, "batch"), chunk)
+
+    lines = {}
+    for chunk in await asyncio.gather(*(fetch_chunk(chunk)
+                                        for chunk in batches(resource_uris, settings.BATCH_CHUNK_SIZE))):
+        lines.update(chunk)
+    return lines
+
+
+def to_jsonld(lines: list[str]):
+    """converts the N-Quads lines of a resource to JSON-LD"""
+    graph = ConjunctiveGraph()
+    graph.parse(data="\n".join(lines), format="nquads")
+    return json.loads(graph.serialize(format="json-ld"))
@@ -0,0 +1,78 @@
+"""
+Circuit breaker around a sparql endpoint.
+
+When the endpoint is overloaded every query waits for its timeout, and the
+requests waiting for them pile up. After `settings.SPARQL_BREAKER_FAILURES`
+failed or slow queries in a row the circuit opens: queries go to the other
+endpoints, or fail right away with `EndpointUnavailable` if there is none
+(stale results are served instead, see stale.py). After `settings.SPARQL_BREAKER_RESET` seconds a single
+query is let through again, if it succeeds the circuit closes.
+
+Every endpoint has its own breaker (see endpoints.py), its state is kept per
+worker process and shared by all its event loops.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger("default")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class EndpointUnavailable(Exception):
+    """the query wasn't answered: the circuit is open, it timed out or the endpoint failed"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        # seconds until the endpoint is tried again
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int, reset: float):
+        self.name = name
+        self.max_failures = failures
+        self.reset = reset
+        self.state = CLOSED
+        self.failures = 0
+        # time the circuit was opened, or the trial query of a half open circuit was sent
+        self.since = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """returns whether a query may be sent now"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            # one trial query per reset interval, a trial which never reports back doesn't block forever
+            if time.monotonic() - self.since < self.reset:
+                return False
+            if self.state == OPEN:
+                logger.warning(f"circuit of {self.name} half open, sending a trial query")
+            self.state = HALF_OPEN
+            self.since = time.monotonic()
+            return True
+
+    def retry_after(self) -> float:
+        with self.lock:
+            if self.state == CLOSED:
+                return 0.0
+            return max(0.0, self.reset - (time.monotonic() - self.since))
+
+    def success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logger.warning(f"circuit of {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.max_failures):
+                logger.error(f"circuit of {self.name} open after {self.failures} failed queries")
+                self.state = OPEN
+                self.since = time.monotonic()
@@ -0,0 +1,88 @@
+"""
+Helpers around django's cache framework.
+
+All caches used by the frontend are configured in `settings.CACHES`, the
+helpers here only add what the framework itself doesn't offer: making
+concurrent misses for the same key wait for a single computation instead of
+all of them hitting the backend (sparql endpoint, elasticsearch, ...) at once.
+"""
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Optional
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from . import timing
+
+# computations which are currently running, by event loop and cache key
+_in_flight: dict[tuple[int, str], asyncio.Future] = {}
+
+
+def make_key(*parts: str) -> str:
+    """builds a fixed length cache key from arbitrary (possibly very long) strings like sparql queries."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def single_flight(key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    awaits compute() for key. only one request per worker computes a key at a time,
+    all other requests asking for the same key in the meantime wait for that result
+    (or its exception) and return it as well. requests are only deduplicated within
+    an event loop, under WSGI every request has its own (see clients.py).
+    """
+    in_flight_key = (id(asyncio.get_running_loop()), key)
+    future = _in_flight.get(in_flight_key)
+    if future is not None:
+        # shield: a cancelled waiter must not cancel the computation of the others
+        return await asyncio.shield(future)
+
+    future = _in_flight[in_flight_key] = asyncio.get_running_loop().create_future()
+    try:
+        value = await compute()
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # retrieve the exception, so asyncio doesn't complain if nobody was waiting
+        future.exception()
+        raise
+    finally:
+        del _in_flight[in_flight_key]
+
+
+async def get_or_compute(alias: Optional[str],
+                         key: str,
+                         compute: Callable[[], Awaitable[Any]],
+                         timeout=DEFAULT_TIMEOUT,
+                         max_bytes: Optional[int] = None) -> Any:
+    """
+    returns the value cached under key in the cache alias or computes (and stores) it.
+    concurrent misses for the same key are computed only once (see single_flight).
+    values larger than max_bytes are handed to the waiting requests but not stored.
+    if alias is None caching is disabled and compute() is awaited directly.
+    """
+    if alias is None:
+        return await compute()
+
+    cache = caches[alias]
+    value = await cache.aget(key)
+    if value is not None:
+        timing.count(f"cache_hit.{alias}")
+        return value
+    timing.count(f"cache_miss.{alias}")
+
+    async def compute_and_store():
+        value = await compute()
+        if max_bytes is None or len(value) <= max_bytes:
+            await cache.aset(key, value, timeout)
+        return value
+
+    return await single_flight(key, compute_and_store)
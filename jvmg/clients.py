@@ -0,0 +1,70 @@
+"""
+Shared http clients for the sparql endpoint and elasticsearch.
+
+Every worker keeps one connection pool per backend (and per sparql endpoint, see
+endpoints.py), so requests reuse open keep-alive connections instead of paying
+for a new TCP/HTTP setup each time.
+Async clients are bound to the event loop they were created in, so there is one
+set of clients per event loop: under ASGI that is exactly one per worker. Under
+WSGI (runserver) every request runs in an event loop of its own, its clients
+only live as long as the request and aren't shared with other requests. The
+clients of a loop are closed when it shuts down (asyncio.run cancels the tasks
+which are left, see `_close_on_shutdown`).
+"""
+import asyncio
+from weakref import WeakKeyDictionary
+
+import elasticsearch
+import httpx
+from django.conf import settings
+
+# the clients of each event loop: {"sparql": {endpoint: client}, "elasticsearch": client, "closer": task}
+_clients: "WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = WeakKeyDictionary()
+
+
+async def _close_on_shutdown(clients: dict):
+    """waits until it is cancelled by the shutdown of its event loop, then closes the clients of the loop"""
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # the task references its loop, the loop is freed once the entry is gone
+        _clients.pop(asyncio.get_running_loop(), None)
+        for client in clients["sparql"].values():
+            await client.aclose()
+        if clients["elasticsearch"] is not None:
+            await clients["elasticsearch"].close()
+
+
+def _loop_clients() -> dict:
+    """returns the clients of the running event loop"""
+    loop = asyncio.get_running_loop()
+    clients = _clients.get(loop)
+    if clients is None:
+        clients = _clients[loop] = {"sparql": {}, "elasticsearch": None}
+        clients["closer"] = loop.create_task(_close_on_shutdown(clients))
+    return clients
+
+
+def sparql_client(endpoint: str) -> httpx.AsyncClient:
+    """returns the http client (and connection pool) for the sparql endpoint"""
+    clients = _loop_clients()["sparql"]
+    client = clients.get(endpoint)
+    if client is None:
+        client = clients[endpoint] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=settings.SPARQL_POOL_SIZE,
+                                max_keepalive_connections=settings.SPARQL_POOL_SIZE),
+            timeout=httpx.Timeout(settings.SPARQL_TIMEOUT, connect=settings.SPARQL_CONNECT_TIMEOUT),
+        )
+    return client
+
+
+def elasticsearch_client() -> elasticsearch.AsyncElasticsearch:
+    """returns the elasticsearch client (and connection pool)"""
+    clients = _loop_clients()
+    if clients["elasticsearch"] is None:
+        clients["elasticsearch"] = elasticsearch.AsyncElasticsearch(
+            settings.ELASTICSEARCH,
+            connections_per_node=settings.ELASTICSEARCH_POOL_SIZE,
+            request_timeout=settings.ELASTICSEARCH_TIMEOUT,
+        )
+    return clients["elasticsearch"]
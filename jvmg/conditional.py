@@ -0,0 +1,87 @@
+"""
+Validators (ETag and Last-Modified) for resource pages and conditional GET.
+
+The ETag of a page is computed from the sparql results it is built from, before
+anything is parsed or rendered, so a client (or reverse proxy) which already has
+the current version gets a 304 without any template work. The html pages
+additionally depend on the templates, which are part of their ETag as well.
+Last-Modified is the time the current version of the dataset was detected by
+the overview snapshot (see overview_snapshot.py), if there is one. The token of
+that version is part of the ETag of html pages too, their labels are fetched
+separately (see labels.py) and aren't part of the sparql results.
+
+The endpoint doesn't return the statements of a result in a fixed order, so
+n-triples and n-quads results are hashed with their lines sorted (see
+`canonical`). The html pages are rendered in sorted order and keep strong
+ETags. The rdf data is sent as returned, its ETag is weak: another order is
+equivalent, but not the same bytes. Results in other formats are hashed as they
+are, putting them in order would mean parsing them, which the ETag is there to
+avoid. A new order of those only costs a full response.
+"""
+import hashlib
+import os
+from functools import cache
+from typing import Optional
+
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import overview_snapshot
+from .sparql import NQUADS, NTRIPLES
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates", "jvmg")
+
+
+@cache
+def template_version() -> str:
+    """checksum of the html templates, pages rendered by other templates get other ETags"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        with open(os.path.join(TEMPLATE_DIR, name), "rb") as f:
+            digest.update(name.encode("utf-8") + b"\0" + f.read() + b"\0")
+    return digest.hexdigest()
+
+
+def canonical(data: bytes, data_format: str) -> bytes:
+    """returns the lines of a n-triples or n-quads result sorted, results in other formats as they are"""
+    if data_format not in (NTRIPLES, NQUADS):
+        return data
+    return b"\n".join(sorted(line.strip() for line in data.splitlines() if line.strip()))
+
+
+def etag(*parts: bytes, weak: bool = False) -> str:
+    """returns a (quoted) ETag for a representation built from parts, a weak one for equivalent representations"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+    tag = quote_etag(digest.hexdigest()[:32])
+    return "W/" + tag if weak else tag
+
+
+def last_modified() -> Optional[int]:
+    """returns the time (unix timestamp) the dataset was last changed, if known"""
+    snapshot = overview_snapshot.load()
+    if snapshot is None:
+        return None
+    return int(snapshot["created"])
+
+
+def dataset_version() -> str:
+    """returns the token of the current version of the dataset, "" if it isn't known"""
+    snapshot = overview_snapshot.load()
+    if snapshot is None:
+        return ""
+    return snapshot["token"]
+
+
+def not_modified(request: HttpRequest, etag: str, last_modified: Optional[int]) -> Optional[HttpResponse]:
+    """returns the 304 (or 412) response if the client's version is still current, otherwise None"""
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response: HttpResponse, etag: str, last_modified: Optional[int]) -> HttpResponse:
+    response.headers["ETag"] = etag
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(last_modified)
+    return response
@@ -0,0 +1,96 @@
+"""
+Crosstab of an URI: which properties (and values) do the entities linking to it have?
+
+For hub URIs (popular tags, ...) the entities linking to them have hundreds of
+thousands of distinct (property, value) pairs. `settings.QUERY_CROSSTAB` only
+counts them, labels are fetched separately for the values which are actually
+shown (see labels.py): the `settings.CROSSTAB_TOP_K` most frequent values of each
+property. `settings.CROSSTAB_PROPERTIES` optionally restricts the crosstab to a
+fixed list of properties already inside the query. Results are cached per URI.
+"""
+import json
+from itertools import compress
+
+from django.conf import settings
+from rdflib import URIRef
+from SPARQLWrapper import JSON
+
+from . import labels, sparql
+from .cache import get_or_compute, make_key
+
+
+def build_query(resource_uri: str) -> str:
+    """fills in QUERY_CROSSTAB, $properties becomes a VALUES clause if there is an allowlist"""
+    if settings.CROSSTAB_PROPERTIES:
+        properties = "VALUES ?property { " + " ".join(f"<{p}>" for p in settings.CROSSTAB_PROPERTIES) + " }"
+    else:
+        properties = ""
+    return (settings.QUERY_CROSSTAB
+            .replace("$resource", resource_uri)
+            .replace("$properties", properties)
+            .replace("$limit", str(settings.CROSSTAB_MAX_ROWS)))
+
+
+def to_columns(bindings: list[dict]) -> dict[str, list]:
+    """
+    converts the json bindings of QUERY_CROSSTAB into one plain python list per
+    variable, top_k and compute pick rows from them by their row number
+    """
+    # an aggregate over no matches at all may return one empty row
+    bindings = [row for row in bindings if "property" in row]
+    return {
+        "property": [row["property"]["value"] for row in bindings],
+        "value": [row["value"]["value"] for row in bindings],
+        "is_uri": [row["value"]["type"] == "uri" for row in bindings],
+        "count": [int(row["count"]["value"]) for row in bindings],
+    }
+
+
+def top_k(columns: dict[str, list], k: int) -> list[int]:
+    """returns the row numbers of the k most frequent values per property, rows are sorted by count"""
+    order = sorted(range(len(columns["count"])), key=columns["count"].__getitem__, reverse=True)
+    taken = {}
+    rows = []
+    for row in order:
+        property = columns["property"][row]
+        if taken.get(property, 0) < k:
+            taken[property] = taken.get(property, 0) + 1
+            rows.append(row)
+    return rows
+
+
+async def compute(resource_uri: str) -> list[dict]:
+    """
+    returns the rows of the crosstab, sorted by count:
+    [{"count", "property", "property_label", "value", "value_label"}, ...]
+    property and value are not rewritten to WEB_BASE yet.
+    """
+    result = json.loads(await sparql.query_endpoint(build_query(resource_uri), JSON, "crosstab"))
+    columns = to_columns(result["results"]["bindings"])
+    rows = top_k(columns, settings.CROSSTAB_TOP_K)
+
+    properties = [columns["property"][row] for row in rows]
+    values = [columns["value"][row] for row in rows]
+    counts = [columns["count"][row] for row in rows]
+    is_uri = [columns["is_uri"][row] for row in rows]
+
+    # literals are their own label, only URIs are looked up. URIs whose labels are
+    # unavailable (see labels.fetch) are shown as they are
+    found = await labels.fetch([*properties, *compress(values, is_uri)])
+    property_labels = {p: labels.preferred(found.get(URIRef(p), {}), p) for p in set(properties)}
+    value_labels = {v: labels.preferred(found.get(URIRef(v), {}), v) for v in set(compress(values, is_uri))}
+
+    return [
+        {"count": count,
+         "property": property,
+         "property_label": property_labels[property],
+         "value": value,
+         "value_label": value_labels.get(value, value)}
+        for property, value, count in zip(properties, values, counts)
+    ]
+
+
+async def crosstab(resource_uri: str) -> list[dict]:
+    """returns the (cached) crosstab of resource_uri, see compute()"""
+    key = make_key("crosstab", resource_uri, settings.CROSSTAB_TOP_K, settings.CROSSTAB_PROPERTIES)
+    return await get_or_compute(settings.CROSSTAB_CACHE, key, lambda: compute(resource_uri))
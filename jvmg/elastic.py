@@ -0,0 +1,182 @@
+"""
+Queries of the search page against elasticsearch.
+
+The facets (number of hits per type and graph) of a search don't change while
+the user scrolls through its results, so they are computed once per (search,
+search_type, filters) and kept in `settings.SEARCH_FACET_CACHE`. The first page
+of a search returns hits and facets of a single elasticsearch request, later
+pages only fetch hits.
+
+Pages are either addressed by number (from/size, see `page`) or by an opaque
+cursor token (point in time and search_after, see `cursor_page`).
+"""
+import base64
+import json
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import timing
+from .cache import get_or_compute, make_key
+from .clients import elasticsearch_client
+
+# aggregations shown as checkboxes on the search page
+AGGREGATIONS = {"type": {"terms": {"field": "type", "size": 10000}},
+                "graph": {"terms": {"field": "graph", "size": 10000}}}
+
+# order of hits for paging with search_after, _shard_doc is the tiebreaker of points in time
+SORT = [{"_score": "desc"}, {"_shard_doc": "asc"}]
+
+HIGHLIGHT = {"fields": {"label": {"pre_tags": ["<mark>"], "post_tags": ["</mark>"]}}}
+
+
+def build_query(search: str, search_type: str, filters: dict[str, list[str]]) -> dict:
+    """returns the elasticsearch query for the search text, only matching documents with the checked facets"""
+    query = {"bool": {"must": [{search_type: {"label": search}}]}}
+    search_filter = [{"terms": {key: items}} for key, items in filters.items()]
+    if search_filter:
+        query["bool"]["filter"] = [{"bool": {"must": search_filter}}]
+    return query
+
+
+def facet_key(search: str, search_type: str, filters: dict[str, list[str]]) -> str:
+    """cache key of the facets, independent of the order of the filters"""
+    filters = {key: sorted(items) for key, items in filters.items()}
+    return make_key("facets", search, search_type, json.dumps(filters, sort_keys=True))
+
+
+def to_facets(aggregations: dict) -> dict[str, dict[str, int]]:
+    """converts elasticsearch's aggregation buckets to {facet: {key: doc_count}}"""
+    return {
+        name: {bucket["key"]: bucket["doc_count"] for bucket in aggregation["buckets"]}
+        for name, aggregation in aggregations.items()
+    }
+
+
+def to_hits(search_res: dict) -> list[dict]:
+    """returns the sources of the hits, with the highlighted fields replaced by their highlights"""
+    hits = []
+    for entry in search_res["hits"]["hits"]:
+        source = entry["_source"]
+        for key, highlight in entry.get("highlight", {}).items():
+            if key in source:
+                source[key] = highlight
+        hits.append(source)
+    return hits
+
+
+async def facets(search: str, search_type: str, filters: dict[str, list[str]]) -> dict:
+    """
+    returns the total number of hits and the facets of a search:
+    {"total": int, "facets": {facet: {key: doc_count}}}
+    """
+    async def compute():
+        with timing.span("elasticsearch"):
+            search_res = await elasticsearch_client().search(index=settings.SEARCH_INDEX,
+                                                             query=build_query(search, search_type, filters),
+                                                             aggregations=AGGREGATIONS,
+                                                             size=0)
+        return {"total": search_res["hits"]["total"]["value"],
+                "facets": to_facets(search_res["aggregations"])}
+
+    return await get_or_compute(settings.SEARCH_FACET_CACHE, facet_key(search, search_type, filters), compute)
+
+
+async def _search(search: str, search_type: str, filters: dict[str, list[str]], first_page: bool,
+                  **search_args) -> tuple[dict, dict]:
+    """
+    runs the search for one page of hits, returns elasticsearch's response and the
+    result {"total": int, "hits": [...]}. the result of the first page also contains
+    the facets, computed by the same request unless they are cached already.
+    """
+    key = facet_key(search, search_type, filters)
+    cached_facets = None
+    if first_page and settings.SEARCH_FACET_CACHE is not None:
+        cached_facets = await caches[settings.SEARCH_FACET_CACHE].aget(key)
+    with_aggregations = first_page and cached_facets is None
+
+    with timing.span("elasticsearch"):
+        search_res = await elasticsearch_client().search(query=build_query(search, search_type, filters),
+                                                         highlight=HIGHLIGHT,
+                                                         size=settings.ELASTICSEARCH_PAGE_SIZE,
+                                                         aggregations=AGGREGATIONS if with_aggregations else None,
+                                                         **search_args)
+
+    result = {"total": search_res["hits"]["total"]["value"], "hits": to_hits(search_res)}
+    if with_aggregations:
+        cached_facets = {"total": result["total"], "facets": to_facets(search_res["aggregations"])}
+        if settings.SEARCH_FACET_CACHE is not None:
+            await caches[settings.SEARCH_FACET_CACHE].aset(key, cached_facets)
+    if cached_facets is not None:
+        result["facets"] = cached_facets["facets"]
+    return search_res, result
+
+
+async def page(search: str, search_type: str, filters: dict[str, list[str]], page_number: int) -> dict:
+    """
+    returns page page_number of the hits, using from/size. deep pages get slower and
+    stop at elasticsearch's max_result_window, see cursor_page() for deep pagination.
+    """
+    _, result = await _search(search, search_type, filters, page_number == 0,
+                              index=settings.SEARCH_INDEX,
+                              from_=settings.ELASTICSEARCH_PAGE_SIZE * page_number)
+    return result
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(pit_id: str, search_after: list) -> str:
+    """returns the opaque cursor token handed to the browser"""
+    data = json.dumps({"pit": pit_id, "after": search_after}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[str, list]:
+    """returns (pit_id, search_after) of a cursor token, raises InvalidCursor if it is malformed"""
+    if not isinstance(cursor, str):
+        raise InvalidCursor(repr(cursor))
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        pit_id, search_after = data["pit"], data["after"]
+    except (ValueError, TypeError, KeyError, UnicodeError) as e:
+        raise InvalidCursor(cursor) from e
+    if not isinstance(pit_id, str) or not isinstance(search_after, list):
+        raise InvalidCursor(cursor)
+    return pit_id, search_after
+
+
+async def cursor_page(search: str, search_type: str, filters: dict[str, list[str]], cursor: Optional[str]) -> dict:
+    """
+    returns the page of hits after cursor ({"total": int, "hits": [...], "cursor": str or None}).
+    without a cursor the first page is returned. pages are read from a point in time
+    of the index with search_after, so every page costs the same as the first one.
+    the returned cursor points to the next page, it is None after the last page.
+    raises InvalidCursor for malformed cursors and elasticsearch.NotFoundError if
+    the point in time expired (see settings.SEARCH_PIT_KEEP_ALIVE).
+    """
+    es = elasticsearch_client()
+    if cursor is None:
+        with timing.span("elasticsearch"):
+            pit = await es.open_point_in_time(index=settings.SEARCH_INDEX, keep_alive=settings.SEARCH_PIT_KEEP_ALIVE)
+        pit_id, search_after = pit["id"], None
+    else:
+        pit_id, search_after = decode_cursor(cursor)
+
+    search_res, result = await _search(search, search_type, filters, cursor is None,
+                                       pit={"id": pit_id, "keep_alive": settings.SEARCH_PIT_KEEP_ALIVE},
+                                       sort=SORT,
+                                       search_after=search_after)
+
+    # the id of a point in time can change with every request
+    pit_id = search_res.get("pit_id", pit_id)
+    hits = search_res["hits"]["hits"]
+    if len(hits) < settings.ELASTICSEARCH_PAGE_SIZE:
+        result["cursor"] = None
+        with timing.span("elasticsearch"):
+            await es.close_point_in_time(id=pit_id)
+    else:
+        result["cursor"] = encode_cursor(pit_id, hits[-1]["sort"])
+    return result
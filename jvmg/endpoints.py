@@ -0,0 +1,155 @@
+"""
+Replicas of the sparql endpoint.
+
+Queries are spread over the endpoints in `settings.SPARQL_ENDPOINTS`. Each
+query goes to the endpoint with the fewest queries currently running
+(`settings.SPARQL_ROUTING = "least_outstanding"`), or with the lowest
+average latency weighted by its running queries (`"latency"`). Kinds of
+queries in `settings.SPARQL_PINNED` (e.g. crosstab, overview) only go to the
+endpoints they are pinned to, so expensive queries don't slow down pages.
+
+Every endpoint has its own circuit breaker (see breaker.py) and its own
+connection pool (see clients.py). A background thread per worker sends
+`settings.SPARQL_HEALTH_CHECK_QUERY` to every endpoint each
+`settings.SPARQL_HEALTH_CHECK_INTERVAL` seconds: endpoints which fail it are
+left out until they answer again. The health check doesn't touch the circuit
+breakers, an endpoint which answers it may still be too slow for real queries.
+Only the queries themselves close an open circuit (see sparql.guarded).
+"""
+import asyncio
+import logging
+import random
+import threading
+from time import perf_counter
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+
+from .breaker import CLOSED, CircuitBreaker, EndpointUnavailable
+from .clients import sparql_client
+
+logger = logging.getLogger("default")
+
+# weight of the latest query in the average latency of an endpoint
+LATENCY_SMOOTHING = 0.2
+
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        # short name for logs and metrics
+        self.name = urlsplit(url).netloc or url
+        self.breaker = CircuitBreaker(url, settings.SPARQL_BREAKER_FAILURES, settings.SPARQL_BREAKER_RESET)
+        self.healthy = True
+        # queries currently running and the average duration (in seconds) of the answered ones
+        self.outstanding = 0
+        self.latency = 0.0
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            self.outstanding += 1
+
+    def finish(self, duration: Optional[float] = None):
+        """duration is the time the endpoint took to answer, None if it didn't"""
+        with self.lock:
+            self.outstanding -= 1
+            if duration is not None:
+                self.latency = duration if not self.latency else (
+                    LATENCY_SMOOTHING * duration + (1 - LATENCY_SMOOTHING) * self.latency)
+
+    def load(self) -> float:
+        """the lower, the sooner the next query goes to this endpoint"""
+        if settings.SPARQL_ROUTING == "latency":
+            return (self.outstanding + 1) * self.latency
+        return self.outstanding
+
+
+_endpoints: dict[str, Endpoint] = {}
+_endpoints_lock = threading.Lock()
+
+
+def all_endpoints() -> list[Endpoint]:
+    urls = settings.SPARQL_ENDPOINTS
+    with _endpoints_lock:
+        for url in urls:
+            if url not in _endpoints:
+                _endpoints[url] = Endpoint(url)
+        return [_endpoints[url] for url in urls]
+
+
+def choose(kind: str, avoid: Optional[Endpoint] = None) -> Endpoint:
+    """
+    returns the endpoint the next query of this kind is sent to, see the module docstring.
+    avoid is only chosen if it is the only endpoint for this kind.
+    raises EndpointUnavailable if the circuits of all endpoints it may go to are open.
+    """
+    start_health_checks()
+    endpoints = all_endpoints()
+    pinned = settings.SPARQL_PINNED.get(kind)
+    if pinned:
+        endpoints = [endpoint for endpoint in endpoints if endpoint.url in pinned] or endpoints
+    if avoid is not None and len(endpoints) > 1:
+        endpoints = [endpoint for endpoint in endpoints if endpoint is not avoid]
+
+    # the healthy endpoints with closed circuits first, then any endpoint which lets a trial query through
+    ready = [endpoint for endpoint in endpoints if endpoint.healthy and endpoint.breaker.state == CLOSED]
+    if ready:
+        loads = [(endpoint.load(), endpoint) for endpoint in ready]
+        lowest = min(load for load, _ in loads)
+        return random.choice([endpoint for load, endpoint in loads if load == lowest])
+    for endpoint in sorted(endpoints, key=lambda endpoint: (not endpoint.healthy, endpoint.load())):
+        if endpoint.breaker.allow():
+            return endpoint
+    raise EndpointUnavailable(f"the circuits of all endpoints for {kind} queries are open",
+                              min(endpoint.breaker.retry_after() for endpoint in endpoints))
+
+
+async def check(endpoint: Endpoint):
+    """sends the health check query to endpoint and marks it as healthy or not"""
+    start = perf_counter()
+    try:
+        response = await sparql_client(endpoint.url).post(
+            endpoint.url,
+            data={"query": settings.SPARQL_HEALTH_CHECK_QUERY},
+            headers={"Accept": "application/sparql-results+json"},
+            timeout=settings.SPARQL_HEALTH_CHECK_TIMEOUT)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        if endpoint.healthy:
+            logger.error(f"health check of sparql endpoint {endpoint.url} failed: {e!r}")
+        endpoint.healthy = False
+        return
+
+    if not endpoint.healthy:
+        logger.warning(f"sparql endpoint {endpoint.url} is healthy again")
+    endpoint.healthy = True
+    with endpoint.lock:
+        if not endpoint.latency:
+            endpoint.latency = perf_counter() - start
+
+
+async def _check_forever():
+    while True:
+        await asyncio.gather(*(check(endpoint) for endpoint in all_endpoints()))
+        await asyncio.sleep(settings.SPARQL_HEALTH_CHECK_INTERVAL)
+
+
+_checker: Optional[threading.Thread] = None
+_checker_lock = threading.Lock()
+
+
+def start_health_checks():
+    """starts the health checks of this worker, if they aren't running already or are disabled"""
+    global _checker
+    if settings.SPARQL_HEALTH_CHECK_INTERVAL is None or _checker is not None:
+        return
+    with _checker_lock:
+        if _checker is None:
+            _checker = threading.Thread(target=asyncio.run,
+                                        args=(_check_forever(),),
+                                        name="sparql-health-checks",
+                                        daemon=True)
+            _checker.start()
@@ -0,0 +1,123 @@
+"""
+Fast renderer for the graph sections of resource pages.
+
+`graph.html` includes `predicate_link.html`, `object_link.html`,
+`blank_node.html` and `span.html` once for every predicate, object and label.
+On pages with tens of thousands of back-links those includes (template lookup
+and context push for each of them) take seconds. The functions here write the
+exact same markup as that include chain straight into a list of strings.
+
+Keep them in sync with the templates! `manage.py benchmark_renderer` checks that
+both produce the same html (and compares their speed). The renderer is used if
+`settings.FAST_GRAPH_RENDERER` is set.
+"""
+from html import escape
+from typing import Optional
+
+
+def span(out: list, item):
+    if item.language:
+        out.append(f'\n<span lang="{escape(item.language)}">{escape(item.text)}</span>\n\n')
+    else:
+        out.append(f"\n<span>{escape(item.text)}</span>\n\n")
+
+
+def object_link(out: list, object: Optional[object]):
+    uri = getattr(object, "uri", None)
+    labels = getattr(object, "labels", ())
+    if not uri:
+        out.append("\n")
+        for item in labels:
+            out.append("\n")
+            span(out, item)
+            out.append("\n")
+        out.append("\n\n")
+    else:
+        out.append(f'\n<a href="{escape(uri)}">\n  ')
+        for item in labels:
+            out.append("\n  ")
+            span(out, item)
+            out.append("\n  ")
+        out.append("\n  </a>\n\n")
+
+
+def predicate_link(out: list, predicate):
+    uri = escape(predicate.info.uri or "")
+    if predicate.is_back_link:
+        out.append(f'\nis <a href="{uri}">\n  ')
+        for item in predicate.info.labels:
+            out.append("\n    ")
+            span(out, item)
+            out.append("\n  ")
+        out.append("\n</a> of\n")
+    else:
+        out.append(f'\n<a href="{uri}">\n  ')
+        for item in predicate.info.labels:
+            out.append("\n  ")
+            span(out, item)
+            out.append("\n  ")
+        out.append("\n</a>\n")
+    out.append("\n\n")
+    if predicate.num_objects > 7:
+        out.append(f"\n<br>\n<span class=count>{predicate.num_objects}</span>\n")
+    out.append("\n")
+
+
+def blank_node(out: list, blank_node):
+    out.append('<table class="blank_node">\n  ')
+    for predicate, objects in blank_node.items:
+        out.append("\n  <tr>\n    <td>")
+        object_link(out, predicate)
+        out.append("</td>\n    ")
+        for object in objects:
+            out.append("\n    <td>")
+            object_link(out, object)
+            out.append("</td>\n    ")
+        out.append("\n  </tr>\n  ")
+    out.append("\n</table>\n\n")
+
+
+def graph_html(graph) -> str:
+    """renders a views.Graph like `{% include "jvmg/graph.html" with graph=graph %}`"""
+    out = ['<div class="graph">\n  <h2 class="graph">Graph: ']
+    object_link(out, graph.info)
+    out.append(f'<a class="graph_toggle" href="#" data-graph="{escape(graph.uri)}"></a></h2>\n'
+               '  <table>\n    <th>Property</th><th>Value</th>\n    ')
+
+    for predicate in graph.predicates:
+        out.append("\n    ")
+        if predicate.num_objects > 0:
+            out.append("\n    <tr>\n      <td>\n        ")
+            predicate_link(out, predicate)
+            out.append("\n      </td>\n      <td>\n        ")
+            if predicate.num_objects == 1:
+                out.append("\n          ")
+                object_link(out, predicate.objects[0] if predicate.objects else None)
+                out.append("\n        ")
+            else:
+                out.append("\n        <ul>\n          ")
+                for object in predicate.objects:
+                    out.append("\n          <li>\n            ")
+                    object_link(out, object)
+                    out.append("\n          </li>\n          ")
+                out.append("\n        </ul>\n        ")
+            out.append("\n        ")
+            if predicate.next_offset:
+                out.append(f'\n        <a href="#" class="more_back_links" data-graph="{escape(graph.uri)}"'
+                           f' data-predicate="{escape(predicate.uri)}" data-offset="{predicate.next_offset}">more</a>\n        ')
+            out.append("\n      </td>\n    </tr>\n    ")
+        out.append("\n\n    ")
+
+        if predicate.num_blank_nodes > 0:
+            out.append("\n    <tr>\n      <td>\n        ")
+            predicate_link(out, predicate)
+            out.append("\n      </td>\n      <td>\n        ")
+            for node in predicate.blank_nodes:
+                out.append("\n        ")
+                blank_node(out, node)
+                out.append("\n        ")
+            out.append("\n      </td>\n    </tr>\n    ")
+        out.append("\n  ")
+
+    out.append("\n  </table>\n</div>\n")
+    return "".join(out)
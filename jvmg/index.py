@@ -0,0 +1,128 @@
+"""
+Lookup tables for a sparql result.
+
+Building the html view of an URI needs the objects, subjects and labels of many
+nodes. Instead of scanning the rdflib graph with a triple pattern for each of
+them, `TripleIndex` walks over all quads of the result once and stores them in
+nested dicts, so every later lookup is a dict access. The quads come from a
+parsed rdflib graph (`TripleIndex.from_graph`) or straight from the N-Quads
+parser (see nquads.py).
+"""
+from typing import Iterable
+
+from django.conf import settings
+from rdflib import BNode, ConjunctiveGraph, Literal, URIRef
+from rdflib.term import Node
+
+
+def _add(index: dict, key: Node, predicate: Node, value: Node):
+    """appends value to index[key][predicate], creating the nested dict and list if needed"""
+    by_predicate = index.get(key)
+    if by_predicate is None:
+        index[key] = {predicate: [value]}
+        return
+    values = by_predicate.get(predicate)
+    if values is None:
+        by_predicate[predicate] = [value]
+    else:
+        values.append(value)
+
+
+class TripleIndex:
+    """
+    index over all quads of a sparql result:
+    - forward: context -> subject -> predicate -> objects
+    - backward: context -> object (URIs and blank nodes only) -> predicate -> subjects
+    - by_subject: blank node -> predicate -> objects (over all contexts, like ConjunctiveGraph.objects())
+    - labels: node -> label predicate -> labels (over all contexts)
+    - size: number of quads the index was built from (duplicates included)
+    """
+
+    def __init__(self, quads: Iterable[tuple[Node, Node, Node, Node]]):
+        """builds the index from (subject, predicate, object, context) quads, duplicates are ignored"""
+        self.forward: dict[Node, dict[Node, dict[Node, list[Node]]]] = {}
+        self.backward: dict[Node, dict[Node, dict[Node, list[Node]]]] = {}
+        self.by_subject: dict[Node, dict[Node, list[Node]]] = {}
+        self.labels: dict[Node, dict[URIRef, list[Literal]]] = {}
+
+        label_uris = {URIRef(label_uri) for label_uri in settings.LABEL_URIS + settings.GRAPH_LABEL_URIS}
+
+        context, forward, backward = None, None, None
+        size = 0
+        for subject, predicate, object, quad_context in quads:
+            size += 1
+            if quad_context is not context:
+                context = quad_context
+                forward = self.forward.setdefault(context, {})
+                backward = self.backward.setdefault(context, {})
+            _add(forward, subject, predicate, object)
+            if not isinstance(object, Literal):
+                _add(backward, object, predicate, subject)
+            if isinstance(subject, BNode):
+                _add(self.by_subject, subject, predicate, object)
+            if predicate in label_uris:
+                _add(self.labels, subject, predicate, object)
+        self.size = size
+
+        # a quad can be part of several results (and the same triple of several contexts),
+        # but every lookup must return it only once
+        indexes = [self.by_subject, self.labels, *self.forward.values(), *self.backward.values()]
+        for index in indexes:
+            for by_predicate in index.values():
+                for predicate, values in by_predicate.items():
+                    if len(values) > 1:
+                        by_predicate[predicate] = list(dict.fromkeys(values))
+
+    @classmethod
+    def from_graph(cls, sparql_result: ConjunctiveGraph) -> "TripleIndex":
+        """builds the index of a parsed sparql result"""
+        return cls(
+            (subject, predicate, object, context.identifier)
+            for context in sparql_result.contexts()
+            for subject, predicate, object in context.triples((None, None, None))
+        )
+
+    def contexts(self) -> Iterable[Node]:
+        """returns the identifiers of all contexts (graphs) of the result"""
+        return self.forward.keys()
+
+    def objects(self, context: Node, subject: Node, predicate: Node) -> list[Node]:
+        return self.forward.get(context, {}).get(subject, {}).get(predicate, [])
+
+    def subjects(self, context: Node, object: Node, predicate: Node) -> list[Node]:
+        return self.backward.get(context, {}).get(object, {}).get(predicate, [])
+
+    def predicates(self, context: Node, subject: Node) -> Iterable[Node]:
+        return self.forward.get(context, {}).get(subject, {}).keys()
+
+    def back_link_predicates(self, context: Node, object: Node) -> Iterable[Node]:
+        return self.backward.get(context, {}).get(object, {}).keys()
+
+    def labels_for(self, node: Node, label_uris: Iterable[URIRef]) -> list[Literal]:
+        """returns all non-empty literal labels of node for the given label predicates"""
+        labels_by_predicate = self.labels.get(node, {})
+        return [
+            label
+            for label_uri in label_uris
+            for label in labels_by_predicate.get(label_uri, ())
+            if isinstance(label, Literal) and len(label)
+        ]
+
+    def uris(self) -> set[URIRef]:
+        """returns all URIs of the result: graphs, subjects, predicates and objects"""
+        uris = set()
+        for context, by_subject in self.forward.items():
+            uris.add(context)
+            for subject, by_predicate in by_subject.items():
+                uris.add(subject)
+                for predicate, objects in by_predicate.items():
+                    uris.add(predicate)
+                    uris.update(objects)
+        return {uri for uri in uris if isinstance(uri, URIRef)}
+
+    def add_labels(self, labels: dict[URIRef, dict[URIRef, Iterable[Literal]]]):
+        """adds labels fetched separately (see labels.py) to the labels of the result"""
+        for node, by_predicate in labels.items():
+            for predicate, values in by_predicate.items():
+                known = self.labels.setdefault(node, {}).setdefault(predicate, [])
+                known.extend(value for value in values if value not in known)
@@ -0,0 +1,118 @@
+"""
+Labels of all predicates and graphs, loaded when a worker starts.
+
+Nearly every page shows the same few hundred predicates and graphs. Their labels
+(for `settings.LABEL_URIS` and `settings.GRAPH_LABEL_URIS`) are fetched once with
+`settings.QUERY_LABEL_SNAPSHOT` and written to the JSON file
+`settings.LABEL_SNAPSHOT`, which every worker loads into an immutable map when
+it starts (see apps.py), without querying the sparql endpoint. `Info` takes
+the labels of these URIs from the map, they aren't looked up per request.
+
+The snapshot is built by `manage.py build_label_snapshot` and rebuilt by the
+background refresher of the overview snapshot when the dataset changes.
+"""
+import json
+import logging
+import os
+import time
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional
+
+from django.conf import settings
+from rdflib import Literal, URIRef
+from SPARQLWrapper import JSON
+
+from . import labels, sparql
+
+logger = logging.getLogger("default")
+
+# uri -> label predicate -> labels, URIs without labels map to {}
+_labels: Mapping[URIRef, Mapping[URIRef, tuple[Literal, ...]]] = MappingProxyType({})
+_token: Optional[str] = None
+_mtime: Optional[float] = None
+
+
+def labels_for(uri: URIRef, label_uris: Iterable[URIRef]) -> Optional[list[Literal]]:
+    """returns the non-empty labels of uri for the given label predicates, None if uri isn't in the snapshot"""
+    labels_by_predicate = _labels.get(uri)
+    if labels_by_predicate is None:
+        return None
+    return [label for label_uri in label_uris for label in labels_by_predicate.get(label_uri, ()) if len(label)]
+
+
+def known(uri: URIRef) -> bool:
+    """whether all labels of uri are in the snapshot"""
+    return uri in _labels
+
+
+def to_json(labels_by_uri: dict[URIRef, labels.Labels]) -> dict:
+    return {
+        uri: {predicate: [[label, label.language, label.datatype] for label in values]
+              for predicate, values in by_predicate.items()}
+        for uri, by_predicate in labels_by_uri.items()
+    }
+
+
+def from_json(labels_by_uri: dict) -> Mapping[URIRef, Mapping[URIRef, tuple[Literal, ...]]]:
+    return MappingProxyType({
+        URIRef(uri): MappingProxyType({
+            URIRef(predicate): tuple(Literal(value, lang=lang, datatype=datatype) for value, lang, datatype in values)
+            for predicate, values in by_predicate.items()
+        })
+        for uri, by_predicate in labels_by_uri.items()
+    })
+
+
+def load() -> bool:
+    """loads the snapshot file if it changed since it was loaded, returns whether there is one"""
+    global _labels, _token, _mtime
+    try:
+        mtime = os.stat(settings.LABEL_SNAPSHOT).st_mtime
+    except FileNotFoundError:
+        return False
+    if mtime != _mtime:
+        with open(settings.LABEL_SNAPSHOT, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        _labels = from_json(snapshot["labels"])
+        _token = snapshot["token"]
+        _mtime = mtime
+        logger.info(f"label snapshot loaded: {len(_labels)} URIs (token {_token})")
+    return True
+
+
+def save(snapshot: dict):
+    """writes the snapshot, readers never see a partially written file"""
+    path = settings.LABEL_SNAPSHOT
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+async def build(token: str):
+    """runs QUERY_LABEL_SNAPSHOT, stores its result as new snapshot and loads it"""
+    start = time.time()
+    label_uris = settings.LABEL_URIS + settings.GRAPH_LABEL_URIS
+    query = settings.QUERY_LABEL_SNAPSHOT.replace("$predicates", " ".join(f"<{uri}>" for uri in label_uris))
+    result = json.loads(await sparql.query_endpoint(query, JSON, "label_snapshot"))
+
+    labels_by_uri: dict[URIRef, dict[URIRef, list[Literal]]] = {}
+    for row in result["results"]["bindings"]:
+        by_predicate = labels_by_uri.setdefault(URIRef(row["uri"]["value"]), {})
+        label = labels.to_literal(row["label"]) if "label" in row else None
+        if label is not None:
+            values = by_predicate.setdefault(URIRef(row["predicate"]["value"]), [])
+            if label not in values:
+                values.append(label)
+
+    save({"token": token, "created": start, "labels": to_json(labels_by_uri)})
+    load()
+    logger.info(f"label snapshot built in {time.time() - start:.3f}s: {len(labels_by_uri)} URIs (token {token})")
+
+
+async def refresh(token: str, force: bool = False) -> bool:
+    """rebuilds the snapshot if it was built for another dataset (or force is set), returns whether it was rebuilt"""
+    if not force and load() and _token == token:
+        return False
+    await build(token)
+    return True
@@ -0,0 +1,163 @@
+"""
+Batched label lookups.
+
+Instead of joining the labels into a query with OPTIONAL (which multiplies its
+result rows by the number of label variants), the labels of all URIs of a result
+are fetched afterwards with `settings.QUERY_LABELS`, each distinct URI only once
+and `settings.LABEL_BATCH_SIZE` URIs per query.
+
+Looked up labels are kept in a process-wide LRU cache (`settings.LABEL_CACHE_SIZE`
+URIs, for `settings.LABEL_CACHE_TIMEOUT` seconds), URIs without labels as well.
+Only the labels in the languages (and graphs) of a selection are fetched (see
+selection.py), they are cached apart from the labels in all languages.
+Predicates, types and graphs are part of most pages, so they are hardly ever
+fetched twice. If the sparql endpoint is unavailable, pages are shown without
+the labels which aren't cached.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from django.conf import settings
+from rdflib import Literal, URIRef
+from SPARQLWrapper import JSON
+
+from . import sparql, timing
+from .breaker import EndpointUnavailable
+from .selection import EVERYTHING, Selection
+
+logger = logging.getLogger("default")
+
+# labels of an URI: label predicate -> labels
+Labels = dict[URIRef, tuple[Literal, ...]]
+
+
+# an URI, the hidden graphs and the languages (None for all) its labels were fetched for
+Key = tuple[URIRef, frozenset[str], Optional[tuple[str, ...]]]
+
+
+class LabelCache:
+    """least recently used labels of URIs, shared by all requests of a worker"""
+
+    def __init__(self):
+        self.entries: OrderedDict[Key, tuple[float, Labels]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Key) -> Optional[Labels]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, labels = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return labels
+
+    def set_many(self, labels: dict[Key, Labels]):
+        expires = time.monotonic() + settings.LABEL_CACHE_TIMEOUT
+        with self.lock:
+            for key, uri_labels in labels.items():
+                self.entries[key] = (expires, uri_labels)
+                self.entries.move_to_end(key)
+            while len(self.entries) > settings.LABEL_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+cache = LabelCache()
+
+
+def batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def to_literal(binding: dict) -> Optional[Literal]:
+    """converts a json binding into a Literal, None if it isn't one"""
+    if binding["type"] not in ("literal", "typed-literal"):
+        return None
+    if "xml:lang" in binding:
+        return Literal(binding["value"], lang=binding["xml:lang"])
+    return Literal(binding["value"], datatype=binding.get("datatype"))
+
+
+async def fetch_batch(uris: list[URIRef], selection: Selection = EVERYTHING) -> dict[URIRef, Labels]:
+    """
+    returns the labels (for LABEL_URIS and GRAPH_LABEL_URIS) of uris in the languages
+    and graphs of selection, uris without labels are left out
+    """
+    label_uris = settings.LABEL_URIS + settings.GRAPH_LABEL_URIS
+    query = (selection.apply(settings.QUERY_LABELS)
+             .replace("$uris", " ".join(f"<{uri}>" for uri in uris))
+             .replace("$predicates", " ".join(f"<{label_uri}>" for label_uri in label_uris)))
+    result = json.loads(await sparql.query_endpoint(query, JSON, "labels"))
+    labels: dict[URIRef, dict[URIRef, list[Literal]]] = {}
+    for row in result["results"]["bindings"]:
+        label = to_literal(row["label"])
+        if label is not None:
+            by_predicate = labels.setdefault(URIRef(row["uri"]["value"]), {})
+            by_predicate.setdefault(URIRef(row["predicate"]["value"]), []).append(label)
+    return {
+        uri: {predicate: tuple(dict.fromkeys(values)) for predicate, values in by_predicate.items()}
+        for uri, by_predicate in labels.items()
+    }
+
+
+async def fetch(uris: Iterable[str], selection: Selection = EVERYTHING) -> dict[URIRef, Labels]:
+    """
+    returns the labels of uris (at least those in the languages of selection), {} for uris
+    without labels. cached labels are taken from the label cache, all others are fetched
+    concurrently in batches.
+    """
+    labels = {}
+    missing = []
+    for uri in dict.fromkeys(map(URIRef, uris)):
+        cached = cache.get((uri, selection.hidden_graphs, selection.languages))
+        if cached is None and selection.languages is not None:
+            # the labels in all languages contain the chosen ones
+            cached = cache.get((uri, selection.hidden_graphs, None))
+        if cached is None:
+            missing.append(uri)
+        else:
+            labels[uri] = cached
+
+    timing.count("cache_hit.labels", len(labels))
+    timing.count("cache_miss.labels", len(missing))
+
+    # the same uris always give the same queries, whatever order they were found in
+    missing.sort()
+    chunks = list(batches(missing, settings.LABEL_BATCH_SIZE))
+    with timing.span("labels"):
+        results = await asyncio.gather(*(fetch_batch(chunk, selection) for chunk in chunks), return_exceptions=True)
+    fetched = {}
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, EndpointUnavailable):
+            # not cached, they are looked up again by the next request
+            logger.warning(f"labels of {len(chunk)} uris unavailable: {result}")
+            timing.count("labels_unavailable", len(chunk))
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        fetched.update(dict.fromkeys(chunk, {}))
+        fetched.update(result)
+    cache.set_many({(uri, selection.hidden_graphs, selection.languages): uri_labels
+                    for uri, uri_labels in fetched.items()})
+    labels.update(fetched)
+    return labels
+
+
+def preferred(labels: Labels, default: str) -> str:
+    """picks the label (of LABEL_URIS) to show if only one can be shown: english or without language first"""
+    candidates = [label for label_uri in settings.LABEL_URIS for label in labels.get(URIRef(label_uri), ())]
+    if not candidates:
+        return default
+    return str(min(candidates, key=lambda label: (label.language not in ("en", None), label.language or "", str(label))))
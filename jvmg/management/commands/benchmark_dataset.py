@@ -0,0 +1,102 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from rdflib import Literal, URIRef
+
+BASE = "http://mediagraph.link/"
+LABEL = "<http://www.w3.org/2000/01/rdf-schema#label>"
+JVMG = BASE + "jvmg/ont/"
+RDF_TYPE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+PLATFORMS = ("pc", "ps2", "psp", "switch", "android", "ios")
+
+
+def uri(path: str) -> str:
+    return URIRef(BASE + path).n3()
+
+
+def literal(value, lang=None) -> str:
+    return Literal(value, lang=lang).n3()
+
+
+class Command(BaseCommand):
+    help = ("Writes a synthetic dataset (N-Quads) with the resources of BENCHMARK_SCENARIOS at realistic sizes: "
+            "visual novels with releases, characters and tags, a hub tag (tag/drama) with many back-links and a "
+            "cluster. Load it into an endpoint to record the fixtures of benchmark_views.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=60000, help="number of visual novels")
+        parser.add_argument("--hub-back-links", type=int, default=50000,
+                            help="number of visual novels tagged with the hub tag")
+        parser.add_argument("--tags", type=int, default=300, help="number of other tags, each item has four")
+        parser.add_argument("--characters", type=int, default=20000, help="number of characters")
+        parser.add_argument("--output", help="file to write to, standard output by default")
+
+    def handle(self, *args, items=60000, hub_back_links=50000, tags=300, characters=20000, output=None,
+               **options):
+        out = open(output, "w", encoding="utf-8") if output else sys.stdout
+        try:
+            self.write(out, items, min(hub_back_links, items), tags, characters)
+        finally:
+            if output:
+                out.close()
+
+    @staticmethod
+    def write(out, items: int, hub_back_links: int, tags: int, characters: int):
+        vndb, anidb, jvmg = uri("graph/vndb"), uri("graph/anidb"), uri("graph/jvmg")
+
+        def quad(subject: str, predicate: str, object: str, graph: str = ""):
+            out.write(f"{subject} {predicate} {object} {graph} .\n" if graph else f"{subject} {predicate} {object} .\n")
+
+        for graph, name in ((vndb, "vndb"), (anidb, "anidb"), (jvmg, "jvmg")):
+            quad(graph, f"<{JVMG}shortLabel>", literal(name))
+        for name in ("title", "developer", "release", "date", "platform", "tag", "appearsIn", "trait", "age",
+                     "inCluster"):
+            quad(uri("ont/" + name), LABEL, literal(name, "en"), vndb)
+        # the types of the overview
+        for order, (name, count) in enumerate((("vn", items), ("char", characters), ("tag", tags + 1)), 1):
+            quad(uri("ont/" + name), f"<{JVMG}order>", literal(order))
+            quad(uri("ont/" + name), f"<{JVMG}count>", literal(count))
+            quad(uri("ont/" + name), LABEL, literal(name, "en"), vndb)
+        for platform in PLATFORMS:
+            quad(uri("platform/" + platform), LABEL, literal(platform.upper()), vndb)
+        for studio in range(500):
+            quad(uri(f"studio/{studio}"), LABEL, literal(f"Studio {studio}"), vndb)
+        quad(uri("tag/drama"), LABEL, literal("drama", "en"), anidb)
+        quad(uri("tag/drama"), LABEL, literal("ドラマ", "ja"), anidb)
+        for tag in range(tags):
+            quad(uri(f"tag/{tag}"), LABEL, literal(f"tag {tag}", "en"), anidb)
+
+        for i in range(1, items + 1):
+            vn = uri(f"vn/{i}")
+            quad(vn, RDF_TYPE, uri("ont/vn"), vndb)
+            quad(vn, LABEL, literal(f"Visual novel {i}", "en"), vndb)
+            if i % 2:
+                quad(vn, LABEL, literal(f"ビジュアルノベル {i}", "ja"), vndb)
+            quad(vn, uri("ont/developer"), uri(f"studio/{i % 500}"), vndb)
+            for release in range(2):
+                node = f"_:r{i}x{release}"
+                quad(vn, uri("ont/release"), node, vndb)
+                quad(node, uri("ont/date"), literal(str(1995 + (i + release) % 30)), vndb)
+                quad(node, uri("ont/platform"), uri("platform/" + PLATFORMS[(i + release) % len(PLATFORMS)]), vndb)
+            if i <= hub_back_links:
+                quad(vn, uri("ont/tag"), uri("tag/drama"), anidb)
+            for tag in range(4):
+                quad(vn, uri("ont/tag"), uri(f"tag/{(i * 7 + tag * 31) % tags}"), anidb)
+
+        for i in range(1, characters + 1):
+            char = uri(f"char/{i}")
+            quad(char, RDF_TYPE, uri("ont/char"), vndb)
+            quad(char, LABEL, literal(f"Character {i}"), vndb)
+            # the first 40 characters appear in vn/1
+            quad(char, uri("ont/appearsIn"), uri(f"vn/{1 if i <= 40 else i % items + 1}"), vndb)
+            quad(char, uri("ont/age"), literal(12 + i % 40), vndb)
+            for trait in range(30 if i == 1 else 3):
+                quad(char, uri("ont/trait"), uri(f"trait/{(i + trait * 13) % 1000}"), vndb)
+        for trait in range(1000):
+            quad(uri(f"trait/{trait}"), LABEL, literal(f"trait {trait}", "en"), vndb)
+
+        cluster = uri("jvmg/cluster/1")
+        quad(cluster, LABEL, literal("Visual novel 1 cluster", "en"), jvmg)
+        for member in [uri(f"vn/{i}") for i in range(1, 31)] + [uri("tag/drama"), uri("char/1")]:
+            quad(cluster, f"<{JVMG}hasMember>", member, jvmg)
+        quad(uri("studio/1"), uri("ont/inCluster"), cluster, jvmg)
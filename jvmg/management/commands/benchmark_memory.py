@@ -0,0 +1,181 @@
+import gc
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, Union
+
+import rdflib
+from django.core.management.base import BaseCommand
+from rdflib import BNode, Literal, URIRef
+from rdflib.term import Node
+
+from jvmg import label_snapshot
+from jvmg.index import TripleIndex
+from jvmg.management.commands.benchmark_renderer import synthetic_result
+from jvmg.views import GRAPH_LABEL_URIS, LABEL_URIS, Graph, Infos, rewrite_url
+
+
+def traced() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+# the view models before they were frozen, slotted and free of rdflib objects, measured with --baseline.
+# they keep rdflib terms and references to the graphs of the result and to the index
+
+
+@dataclass(frozen=True, slots=True)
+class BaselineInfo:
+    uri: Optional[URIRef]
+    labels: tuple[Literal, ...]
+    sort_key: str
+
+
+class BaselineInfos:
+    __slots__ = ("index", "infos")
+
+    def __init__(self, index: TripleIndex):
+        self.index = index
+        self.infos: dict[Union[Node, Tuple[str, Node]], BaselineInfo] = {}
+
+    def __call__(self, item: Union[Node, rdflib.Graph]) -> BaselineInfo:
+        key = ("graph", item.identifier) if isinstance(item, rdflib.Graph) else item
+        info = self.infos.get(key)
+        if info is None:
+            info = self.infos[key] = self.create(item)
+        return info
+
+    def create(self, item: Union[Node, rdflib.Graph]) -> BaselineInfo:
+        if isinstance(item, BNode):
+            return BaselineInfo(uri=None, labels=(Literal(str(item)),), sort_key=str(item))
+        elif isinstance(item, Literal):
+            return BaselineInfo(uri=None, labels=(item,), sort_key=str(item))
+
+        if isinstance(item, rdflib.Graph):
+            uri, label_uris = item.identifier, GRAPH_LABEL_URIS
+        else:
+            uri, label_uris = item, LABEL_URIS
+        labels = label_snapshot.labels_for(uri, label_uris)
+        if labels is None:
+            labels = self.index.labels_for(uri, label_uris)
+        if labels:
+            labels.sort()
+        else:
+            labels = [Literal(uri)]
+        return BaselineInfo(uri=URIRef(rewrite_url(uri)), labels=tuple(labels), sort_key="".join(labels))
+
+
+@dataclass
+class BaselineBlankNode:
+    uri: BNode
+    infos: BaselineInfos
+    info: BaselineInfo = field(init=False)
+    items: list[Tuple[BaselineInfo, list[BaselineInfo]]] = field(init=False)
+    sort_key: tuple = field(init=False)
+
+    def __post_init__(self):
+        self.info = self.infos(self.uri)
+        self.items = []
+        for predicate, objects in self.infos.index.by_subject.get(self.uri, {}).items():
+            objects = sorted((self.infos(object) for object in objects), key=lambda item: item.sort_key)
+            self.items.append((self.infos(predicate), objects))
+        self.sort_key = tuple((predicate.sort_key, *(object.sort_key for object in objects))
+                              for predicate, objects in sorted(self.items, key=lambda item: item[0].sort_key))
+
+
+@dataclass
+class BaselinePredicate:
+    graph: rdflib.Graph
+    infos: BaselineInfos
+    uri: Node
+    resource_uri: URIRef
+    is_back_link: bool = False
+    objects: list[BaselineInfo] = field(init=False)
+    blank_nodes: list[BaselineBlankNode] = field(init=False)
+    labels: list[Literal] = field(init=False)
+    info: BaselineInfo = field(init=False)
+    num_objects: int = field(default=0)
+    num_blank_nodes: int = field(default=0)
+
+    def __post_init__(self):
+        self.info = self.infos(self.uri)
+        index = self.infos.index
+        if self.is_back_link:
+            nodes = index.subjects(self.graph.identifier, object=self.resource_uri, predicate=self.uri)
+        else:
+            nodes = index.objects(self.graph.identifier, subject=self.resource_uri, predicate=self.uri)
+        self.objects = []
+        self.blank_nodes = []
+        for node in nodes:
+            if isinstance(node, BNode):
+                self.blank_nodes.append(BaselineBlankNode(uri=node, infos=self.infos))
+            else:
+                self.objects.append(self.infos(node))
+        self.objects.sort(key=lambda item: item.sort_key)
+        self.blank_nodes.sort(key=lambda item: item.sort_key)
+        self.num_objects = len(self.objects)
+        self.num_blank_nodes = len(self.blank_nodes)
+
+
+@dataclass
+class BaselineGraph:
+    graph: rdflib.Graph
+    infos: BaselineInfos
+    resource_uri: URIRef
+    predicates: list[BaselinePredicate] = field(init=False)
+    info: BaselineInfo = field(init=False)
+
+    def __post_init__(self):
+        self.info = self.infos(self.graph)
+        index = self.infos.index
+        self.predicates = [
+            BaselinePredicate(graph=self.graph, infos=self.infos, uri=predicate, resource_uri=self.resource_uri)
+            for predicate in index.predicates(self.graph.identifier, subject=self.resource_uri)
+        ]
+        self.predicates.extend(
+            BaselinePredicate(graph=self.graph, infos=self.infos, uri=predicate, is_back_link=True,
+                              resource_uri=self.resource_uri)
+            for predicate in index.back_link_predicates(self.graph.identifier, object=self.resource_uri)
+        )
+        self.predicates.sort(key=lambda predicate: predicate.info.sort_key)
+
+
+class Command(BaseCommand):
+    help = ("Measures the memory (per quad of the sparql result) of parsing a result and building its view models. "
+            "--baseline measures the former dict-based view models instead.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--back-links", type=int, default=20000, help="number of back-links per graph")
+        parser.add_argument("--baseline", action="store_true",
+                            help="build the former view models, which keep the result alive, for comparison")
+
+    def handle(self, *args, back_links=20000, baseline=False, **options):
+        tracemalloc.start()
+        start = traced()
+        result, resource = synthetic_result(back_links)
+        quads = len(result)
+        parsed = traced()
+
+        index = TripleIndex.from_graph(result)
+        infos = BaselineInfos(index) if baseline else Infos(index)
+        del index
+        indexed = traced()
+
+        if baseline:
+            graphs = [BaselineGraph(graph, infos, resource) for graph in result.contexts()]
+        else:
+            graphs = [Graph.build(graph.identifier, infos, resource) for graph in result.contexts()]
+        built = traced()
+
+        # the view models don't reference the result (the baseline ones do), the rest is freed
+        del result, infos
+        kept = traced()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.stdout.write(f"{quads} quads, {len(graphs)} graph sections" + (" (baseline)" if baseline else ""))
+        for name, size in (("parsed result", parsed - start),
+                           ("index", indexed - parsed),
+                           ("view models", built - indexed),
+                           ("kept by view models", kept - start),
+                           ("peak", peak - start)):
+            self.stdout.write(f"{name}: {size / 1024 / 1024:.1f} MiB ({size / quads:.0f} bytes per quad)")
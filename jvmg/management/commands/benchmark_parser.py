@@ -0,0 +1,98 @@
+import asyncio
+import os
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from SPARQLWrapper import JSONLD
+
+from jvmg import sparql
+from jvmg.selection import EVERYTHING
+from jvmg.index import TripleIndex
+from jvmg.management.commands.benchmark_renderer import synthetic_result
+
+# fixture file extension -> result format
+EXTENSIONS = {".jsonld": JSONLD, ".nq": sparql.NQUADS}
+
+
+def count_quads(index: TripleIndex) -> int:
+    return sum(len(objects)
+               for by_subject in index.forward.values()
+               for by_predicate in by_subject.values()
+               for objects in by_predicate.values())
+
+
+class Command(BaseCommand):
+    help = ("Compares parsing sparql results of html pages as JSON-LD (rdflib) and as N-Quads (jvmg/nquads.py). "
+            "Uses the results recorded with --record, or a synthetic result if there are none.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fixtures", default=os.path.join(settings.BASE_DIR, "parser_fixtures"),
+                            help="directory of the recorded results")
+        parser.add_argument("--record", metavar="URI",
+                            help="fetch the results of the html page of URI in both formats into the fixtures directory")
+        parser.add_argument("--back-links", type=int, default=20000,
+                            help="number of back-links per graph of the synthetic result")
+        parser.add_argument("--repeat", type=int, default=3, help="number of runs, the fastest one is reported")
+
+    def handle(self, *args, fixtures, record=None, back_links=20000, repeat=3, **options):
+        if record is not None:
+            self.record(record, fixtures)
+            return
+
+        results = self.load(fixtures)
+        if results is None:
+            self.stdout.write(f"no results recorded in {fixtures}, using a synthetic result")
+            graph, _ = synthetic_result(back_links)
+            results = {JSONLD: [graph.serialize(format="json-ld", encoding="utf-8")],
+                       sparql.NQUADS: [graph.serialize(format="nquads", encoding="utf-8")]}
+
+        timings, quads = {}, {}
+        for data_format, data in results.items():
+            fastest, index = None, None
+            for _ in range(repeat):
+                start = perf_counter()
+                index = sparql.parse_index(data, data_format)
+                duration = perf_counter() - start
+                fastest = duration if fastest is None else min(fastest, duration)
+            size = sum(map(len, data)) / 1024 / 1024
+            timings[data_format] = fastest
+            quads[data_format] = count_quads(index)
+            self.stdout.write(f"{data_format}: {quads[data_format]} quads, {size:.2f} MiB, "
+                              f"{fastest:.3f}s ({fastest / size:.3f}s per MiB)")
+
+        if quads[JSONLD] != quads[sparql.NQUADS]:
+            raise CommandError("both formats must contain the same quads")
+        self.stdout.write(f"nquads is {timings[JSONLD] / timings[sparql.NQUADS]:.1f}x faster")
+
+    def record(self, resource_uri: str, fixtures: str):
+        queries = list(settings.QUERY_PLAN.values()) if settings.QUERY_PLAN else [settings.QUERY]
+        os.makedirs(fixtures, exist_ok=True)
+
+        async def fetch_all():
+            return await asyncio.gather(*(
+                sparql.query_endpoint(EVERYTHING.apply(query.replace("$resource", resource_uri)), data_format)
+                for data_format in EXTENSIONS.values()
+                for query in queries
+            ))
+
+        data = iter(asyncio.run(fetch_all()))
+        for extension in EXTENSIONS:
+            for number in range(len(queries)):
+                with open(os.path.join(fixtures, f"{number}{extension}"), "wb") as f:
+                    f.write(next(data))
+        self.stdout.write(f"results of {resource_uri} written to {fixtures}")
+
+    def load(self, fixtures: str):
+        """returns {format: [result, ...]} of the recorded results, None if there are none"""
+        if not os.path.isdir(fixtures):
+            return None
+        results = {data_format: [] for data_format in EXTENSIONS.values()}
+        for name in sorted(os.listdir(fixtures)):
+            data_format = EXTENSIONS.get(os.path.splitext(name)[1])
+            if data_format is not None:
+                with open(os.path.join(fixtures, name), "rb") as f:
+                    results[data_format].append(f.read())
+        if not all(results.values()):
+            return None
+        return results
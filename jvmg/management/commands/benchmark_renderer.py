@@ -0,0 +1,74 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from rdflib import BNode, ConjunctiveGraph, Literal, URIRef
+
+from jvmg import fast_render
+from jvmg.index import TripleIndex
+from jvmg.views import LABEL_URIS, GRAPH_LABEL_URIS, Graph, Infos
+
+BASE = "http://mediagraph.link/"
+
+
+def synthetic_result(back_links: int) -> tuple[ConjunctiveGraph, URIRef]:
+    """a resource with many labelled back-links, literals and blank nodes in two graphs"""
+    result = ConjunctiveGraph()
+    resource = URIRef(BASE + "tag/1")
+    label, graph_label = LABEL_URIS[0], GRAPH_LABEL_URIS[0]
+    for name in ("vndb", "anidb"):
+        graph_uri = URIRef(BASE + "graph/" + name)
+        graph = result.get_context(graph_uri)
+        result.add((graph_uri, graph_label, Literal(name), graph_uri))
+        graph.add((resource, URIRef(BASE + "ont/name"), Literal("<tag> & \"1\"", lang="en")))
+        graph.add((resource, URIRef(BASE + "ont/date"), Literal("2004")))
+        for i in range(3):
+            release = BNode()
+            graph.add((resource, URIRef(BASE + "ont/release"), release))
+            graph.add((release, URIRef(BASE + "ont/date"), Literal(f"200{i}")))
+            graph.add((release, URIRef(BASE + "ont/platform"), URIRef(BASE + "platform/pc")))
+        for i in range(back_links):
+            subject = URIRef(f"{BASE}{name}/vn/{i}")
+            graph.add((subject, URIRef(BASE + "ont/tag"), resource))
+            graph.add((subject, label, Literal(f"Visual novel {i}", lang="en")))
+            if i % 2:
+                graph.add((subject, label, Literal(f"ビジュアルノベル {i}", lang="ja")))
+    result.add((URIRef(BASE + "ont/tag"), label, Literal("tag", lang="en")))
+    result.add((URIRef(BASE + "platform/pc"), label, Literal("PC")))
+    return result, resource
+
+
+class Command(BaseCommand):
+    help = "Compares the fast graph renderer (jvmg/fast_render.py) with the graph.html include chain."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--back-links", type=int, default=20000, help="number of back-links per graph")
+        parser.add_argument("--repeat", type=int, default=3, help="number of runs, the fastest one is reported")
+
+    def handle(self, *args, back_links=20000, repeat=3, **options):
+        result, resource = synthetic_result(back_links)
+        infos = Infos(TripleIndex.from_graph(result))
+        graphs = [Graph.build(graph.identifier, infos, resource) for graph in result.contexts()]
+        # a paginated predicate, rendered with a "more" link
+        graphs.append(Graph.build(URIRef(BASE + "graph/vndb"), infos, resource,
+                                  back_link_counts={URIRef(BASE + "ont/tag"): back_links * 2}))
+
+        def run(render_graph):
+            fastest, html = None, None
+            for _ in range(repeat):
+                start = perf_counter()
+                html = [render_graph(graph) for graph in graphs]
+                duration = perf_counter() - start
+                fastest = duration if fastest is None else min(fastest, duration)
+            return fastest, html
+
+        template_time, template_html = run(lambda graph: render_to_string("jvmg/graph.html", {"graph": graph}))
+        fast_time, fast_html = run(fast_render.graph_html)
+
+        if fast_html != template_html:
+            raise CommandError("the fast renderer and graph.html produce different html")
+
+        size = sum(map(len, fast_html))
+        self.stdout.write(f"{len(graphs)} graph sections, {back_links} back-links per graph, {size} characters of html")
+        self.stdout.write(f"include chain: {template_time:.3f}s")
+        self.stdout.write(f"fast renderer: {fast_time:.3f}s ({template_time / fast_time:.1f}x faster)")
@@ -0,0 +1,373 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import statistics
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+
+from jvmg import label_snapshot, labels, overview_snapshot
+
+# request headers passed on to the real backends while recording
+FORWARDED_HEADERS = ("accept", "content-type", "authorization")
+# response headers which are recorded, the elasticsearch client checks the product header
+RECORDED_HEADERS = ("content-type", "x-elastic-product")
+PERCENTILES = (50, 90, 99)
+
+
+class Recording:
+    """the responses of a backend, keyed by request, stored (gzipped) in a directory of the fixtures"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # key -> (status, headers, body)
+        self.responses: dict[str, tuple[int, dict[str, str], bytes]] = {}
+        self.lock = threading.Lock()
+        index = os.path.join(directory, "responses.json")
+        if os.path.exists(index):
+            with open(index, encoding="utf-8") as f:
+                for key, (status, headers) in json.load(f).items():
+                    with gzip.open(os.path.join(directory, key + ".gz"), "rb") as body:
+                        self.responses[key] = (status, headers, body.read())
+
+    @staticmethod
+    def key(method: str, path: str, accept: str, body: bytes) -> str:
+        return hashlib.sha256("\0".join((method, path, accept, "")).encode("utf-8") + body).hexdigest()
+
+    def get(self, key: str) -> Optional[tuple[int, dict[str, str], bytes]]:
+        return self.responses.get(key)
+
+    def put(self, key: str, status: int, headers: dict[str, str], body: bytes):
+        with self.lock:
+            self.responses[key] = (status, headers, body)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for key, (_, _, body) in self.responses.items():
+            # without a timestamp, unchanged responses give unchanged files
+            with open(os.path.join(self.directory, key + ".gz"), "wb") as f:
+                f.write(gzip.compress(body, mtime=0))
+        with open(os.path.join(self.directory, "responses.json"), "w", encoding="utf-8") as f:
+            json.dump({key: [status, headers] for key, (status, headers, _) in self.responses.items()}, f, indent=1)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, with nagle every keep-alive response would wait for an ack
+    disable_nagle_algorithm = True
+
+    def handle_request(self):
+        server: StubServer = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        key = Recording.key(self.command, self.path, self.headers.get("Accept", ""), body)
+        response = server.recording.get(key)
+        if response is None and server.upstream is not None:
+            upstream = server.client.request(self.command, server.upstream + self.path, content=body, headers={
+                name: value for name, value in self.headers.items() if name.lower() in FORWARDED_HEADERS
+            })
+            response = (upstream.status_code,
+                        {name: upstream.headers[name] for name in RECORDED_HEADERS if name in upstream.headers},
+                        upstream.content)
+            server.recording.put(key, *response)
+        if response is None:
+            server.missing.append(f"{self.command} {self.path}")
+            response = (501, {"content-type": "text/plain"}, b"no recorded response")
+
+        status, headers, content = response
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    stands in for the sparql endpoint or elasticsearch on a local port: replays the
+    recorded responses, or (if upstream is set) records the responses of the real backend.
+    """
+    daemon_threads = True
+
+    def __init__(self, recording: Recording, upstream: Optional[str]):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.recording = recording
+        self.upstream = upstream
+        self.client = httpx.Client(timeout=None) if upstream is not None else None
+        # requests without a recorded response
+        self.missing: list[str] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.client is not None:
+            self.client.close()
+
+
+class TimingCollector(logging.Handler):
+    """collects the timings (see timing.py) of the requests instead of writing them to timing.log"""
+
+    def __init__(self):
+        super().__init__()
+        self.timings: list[dict] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.timings.append(json.loads(record.getMessage()))
+
+
+@contextmanager
+def collect_timings():
+    collector = TimingCollector()
+    loggers = [logging.getLogger("timing"), logging.getLogger("slow")]
+    handlers = [logger.handlers for logger in loggers]
+    loggers[0].handlers, loggers[1].handlers = [collector], []
+    try:
+        yield collector
+    finally:
+        for logger, saved in zip(loggers, handlers):
+            logger.handlers = saved
+
+
+def percentile(values: list[float], p: float) -> float:
+    """nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def calibrate() -> float:
+    """
+    seconds of a fixed cpu-bound workload. the durations are compared in multiples of it,
+    so a baseline saved on another (or a busier) machine still applies
+    """
+    start = perf_counter()
+    sorted(str(i * 7919 % 100003) for i in range(200000))
+    return perf_counter() - start
+
+
+def scratch_caches(directory: str) -> dict:
+    """settings.CACHES with the persistent result stores moved into directory, the recorded results stay out of them"""
+    caches = {}
+    for alias, cache in settings.CACHES.items():
+        if cache["BACKEND"] == "jvmg.result_store.ResultStore":
+            cache = {**cache, "LOCATION": os.path.join(directory, f"{alias}.sqlite3")}
+        caches[alias] = cache
+    return caches
+
+
+def upstream_of(url: str) -> tuple[str, str]:
+    """splits a backend url into scheme and host (the upstream of its stub) and the rest"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}", url[len(parts.scheme) + 3 + len(parts.netloc):]
+
+
+async def send(client: AsyncClient, method: str, path: str, parameters: dict) -> tuple[int, int]:
+    """sends the request of a scenario, returns the status and the size of the (completely read) response"""
+    if method == "POST":
+        response = await client.post(path, json.dumps(parameters), content_type="application/json")
+    else:
+        response = await client.get(path, parameters)
+    if response.streaming:
+        size = sum([len(chunk) async for chunk in response.streaming_content])
+    else:
+        size = len(response.content)
+    return response.status_code, size
+
+
+class Command(BaseCommand):
+    help = ("Measures the views (settings.BENCHMARK_SCENARIOS) with recorded responses of the sparql endpoint "
+            "and elasticsearch, replayed by local stub servers: latency percentiles, peak memory and the time "
+            "of each stage. Record the responses first with --record. A baseline saved with --save-baseline "
+            "makes later runs fail if a scenario got slower (relative to a calibration workload, median of "
+            "--runs runs) or needs more memory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fixtures", default=os.path.join(settings.BASE_DIR, "benchmark_fixtures"),
+                            help="directory of the recorded responses and the baseline")
+        parser.add_argument("--record", action="store_true",
+                            help="record the responses of the first of SPARQL_ENDPOINTS and ELASTICSEARCH into the fixtures directory")
+        parser.add_argument("--scenario", action="append", help="only run this scenario (can be repeated)")
+        parser.add_argument("--repeat", type=int, default=10, help="number of measured requests per scenario and run")
+        parser.add_argument("--runs", type=int, default=5,
+                            help="number of runs through all scenarios, the median of their p50s is compared")
+        parser.add_argument("--warm", action="store_true",
+                            help="keep the caches between requests, by default every request starts cold")
+        parser.add_argument("--save-baseline", action="store_true", help="save the results as new baseline")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="how much (relative) slower or bigger than the baseline a scenario may get")
+
+    def handle(self, *args, fixtures, record=False, scenario=None, repeat=10, runs=5, warm=False,
+               save_baseline=False, tolerance=0.25, **options):
+        scenarios = settings.BENCHMARK_SCENARIOS
+        if scenario:
+            unknown = set(scenario) - scenarios.keys()
+            if unknown:
+                raise CommandError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+            scenarios = {name: scenarios[name] for name in scenario}
+
+        sparql_upstream, sparql_path = upstream_of(settings.SPARQL_ENDPOINTS[0])
+        elasticsearch = settings.ELASTICSEARCH if isinstance(settings.ELASTICSEARCH, str) else settings.ELASTICSEARCH[0]
+        stubs = [StubServer(Recording(os.path.join(fixtures, "sparql")), sparql_upstream if record else None),
+                 StubServer(Recording(os.path.join(fixtures, "elasticsearch")), elasticsearch if record else None)]
+        overrides = {
+            "SPARQL_ENDPOINTS": [stubs[0].url + sparql_path],
+            "SPARQL_PINNED": {},
+            "SPARQL_HEALTH_CHECK_INTERVAL": None,
+            "ELASTICSEARCH": stubs[1].url,
+            "ALLOWED_HOSTS": ["testserver"],
+            "OVERVIEW_SNAPSHOT": os.path.join(fixtures, "overview_snapshot.json"),
+            "LABEL_SNAPSHOT": os.path.join(fixtures, "label_snapshot.json"),
+        }
+        # responses are recorded cold, so every scenario starts cold
+        if record or not warm:
+            overrides.update(SPARQL_CACHE=None, FRAGMENT_CACHE=None, CROSSTAB_CACHE=None, SEARCH_FACET_CACHE=None)
+
+        for stub in stubs:
+            stub.start()
+        try:
+            with tempfile.TemporaryDirectory() as directory, \
+                    override_settings(CACHES=scratch_caches(directory), **overrides), \
+                    collect_timings() as collector:
+                if record:
+                    asyncio.run(self.record(fixtures, scenarios, stubs))
+                    return
+                results = asyncio.run(self.measure(scenarios, stubs, collector, repeat, runs, warm))
+        finally:
+            for stub in stubs:
+                stub.stop()
+
+        baseline_path = os.path.join(fixtures, "baseline.json")
+        if save_baseline:
+            with open(baseline_path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=1)
+            self.stdout.write(f"baseline saved to {baseline_path}")
+        elif os.path.exists(baseline_path):
+            with open(baseline_path, encoding="utf-8") as f:
+                self.compare(json.load(f), results, tolerance)
+        else:
+            self.stdout.write("no baseline yet, save one with --save-baseline")
+
+    async def record(self, fixtures: str, scenarios: dict, stubs: list[StubServer]):
+        os.makedirs(fixtures, exist_ok=True)
+        # the pages are built with the labels of the snapshot, as in production
+        await overview_snapshot.build("benchmark")
+        await label_snapshot.build("benchmark")
+        client = AsyncClient()
+        for name, (method, path, parameters) in scenarios.items():
+            labels.cache.clear()
+            status, size = await send(client, method, path, parameters)
+            self.stdout.write(f"{name}: {method} {path} -> {status}, {size} bytes")
+        for stub in stubs:
+            stub.recording.save()
+        self.stdout.write(f"{sum(len(stub.recording.responses) for stub in stubs)} responses recorded in {fixtures}")
+
+    async def measure(self, scenarios: dict, stubs: list[StubServer], collector: TimingCollector,
+                      repeat: int, runs: int, warm: bool) -> dict:
+        if not label_snapshot.load() or overview_snapshot.load() is None:
+            raise CommandError("no recorded responses, record them first with --record")
+        client = AsyncClient()
+        for name, (method, path, parameters) in scenarios.items():
+            # the first request checks the scenario (and warms up the connections and templates)
+            labels.cache.clear()
+            status, size = await send(client, method, path, parameters)
+            missing = [request for stub in stubs for request in stub.missing]
+            if missing:
+                raise CommandError(f"{name}: no recorded response for {missing[0]}, record again with --record")
+            if status != 200:
+                raise CommandError(f"{name}: {method} {path} returned {status}")
+
+        # the runs alternate the scenarios, so a slow phase of the machine doesn't hit only one of them
+        calibrations = []
+        durations: dict[str, list[float]] = {name: [] for name in scenarios}
+        run_p50s: dict[str, list[float]] = {name: [] for name in scenarios}
+        timings: dict[str, list[dict]] = {name: [] for name in scenarios}
+        for _ in range(runs):
+            calibrations.append(calibrate())
+            for name, (method, path, parameters) in scenarios.items():
+                collector.timings.clear()
+                run = []
+                for _ in range(repeat):
+                    if not warm:
+                        labels.cache.clear()
+                    start = perf_counter()
+                    await send(client, method, path, parameters)
+                    run.append(perf_counter() - start)
+                durations[name].extend(run)
+                run_p50s[name].append(percentile(run, 50))
+                timings[name].extend(collector.timings)
+        calibration = statistics.median(calibrations)
+
+        results = {}
+        for name, (method, path, parameters) in scenarios.items():
+            stages: dict[str, float] = {}
+            for timing in timings[name]:
+                for stage, totals in timing["stages"].items():
+                    stages[stage] = stages.get(stage, 0) + totals["duration"] / len(timings[name])
+
+            # allocations are measured on their own, tracing slows everything down
+            if not warm:
+                labels.cache.clear()
+            tracemalloc.start()
+            _, size = await send(client, method, path, parameters)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            median_p50 = statistics.median(run_p50s[name])
+            results[name] = {
+                **{f"p{p}": percentile(durations[name], p) for p in PERCENTILES},
+                "median_p50": median_p50,
+                "relative_p50": median_p50 / calibration,
+                "peak_bytes": peak,
+                "response_bytes": size,
+                "stages": stages,
+            }
+            self.stdout.write(
+                f"{name}: " + " ".join(f"p{p} {results[name][f'p{p}'] * 1000:.1f}ms" for p in PERCENTILES)
+                + f", median p50 {median_p50 * 1000:.1f}ms ({median_p50 / calibration:.2f}x calibration)"
+                + f", peak {peak / 1024 / 1024:.1f} MiB, {size} bytes"
+                + (", " + " ".join(f"{stage} {duration * 1000:.1f}ms" for stage, duration in stages.items())
+                   if stages else "")
+            )
+        return {"calibration": calibration, "scenarios": results}
+
+    def compare(self, baseline: dict, results: dict, tolerance: float):
+        if "scenarios" not in baseline:
+            raise CommandError("the baseline has absolute durations only, save a new one with --save-baseline")
+        regressions = []
+        for name, result in results["scenarios"].items():
+            if name not in baseline["scenarios"]:
+                continue
+            # durations in multiples of the calibration workload, memory in bytes
+            for measure in ("relative_p50", "peak_bytes"):
+                expected = baseline["scenarios"][name][measure]
+                if result[measure] > expected * (1 + tolerance):
+                    regressions.append(f"{name}: {measure} {result[measure]:.4g} (baseline {expected:.4g}, "
+                                       f"{result[measure] / expected - 1:+.0%})")
+        if regressions:
+            raise CommandError("slower or bigger than the baseline:\n" + "\n".join(regressions))
+        self.stdout.write(f"no regressions (tolerance {tolerance:.0%})")
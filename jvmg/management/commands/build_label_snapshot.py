@@ -0,0 +1,23 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jvmg import label_snapshot, overview_snapshot
+
+
+class Command(BaseCommand):
+    help = "Builds the snapshot of predicate and graph labels (settings.LABEL_SNAPSHOT) if the dataset changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true",
+                            help="rebuild the snapshot even if the dataset didn't change")
+
+    def handle(self, *args, force=False, **options):
+        async def refresh():
+            return await label_snapshot.refresh(await overview_snapshot.dataset_token(), force=force)
+
+        if asyncio.run(refresh()):
+            self.stdout.write(f"label snapshot written to {settings.LABEL_SNAPSHOT}")
+        else:
+            self.stdout.write("dataset unchanged, label snapshot is up to date")
@@ -0,0 +1,20 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jvmg import overview_snapshot
+
+
+class Command(BaseCommand):
+    help = "Builds the snapshot of the overview page (settings.OVERVIEW_SNAPSHOT) if the dataset changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true",
+                            help="rebuild the snapshot even if the dataset didn't change")
+
+    def handle(self, *args, force=False, **options):
+        if asyncio.run(overview_snapshot.refresh(force=force)):
+            self.stdout.write(f"overview snapshot written to {settings.OVERVIEW_SNAPSHOT}")
+        else:
+            self.stdout.write("dataset unchanged, overview snapshot is up to date")
@@ -0,0 +1,71 @@
+import asyncio
+import re
+from collections import Counter
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+
+# the line views.get_resource_uri logs for every resource page and rdf data request
+LOGGED_URI = re.compile(r" uri: (\S+)$")
+
+
+def top_paths(log: str, top: int) -> list[tuple[str, int]]:
+    """returns the paths of the resources requested most often according to the log, with their number of requests"""
+    counts = Counter()
+    with open(log, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = LOGGED_URI.search(line.rstrip("\n"))
+            if match and match.group(1).startswith(settings.DATASET_BASE):
+                counts[match.group(1)[len(settings.DATASET_BASE):]] += 1
+    return counts.most_common(top)
+
+
+class Command(BaseCommand):
+    help = ("Fills the persistent result store (see jvmg/result_store.py) with the sparql results and rendered "
+            "pages of the resources requested most often according to access.log, e.g. after a deploy.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log", default=settings.LOGGING["handlers"]["file"]["filename"],
+                            help="log file with the requested resources (the 'file' handler of LOGGING)")
+        parser.add_argument("--top", type=int, default=1000, help="number of resources to request")
+        parser.add_argument("--accept", action="append",
+                            help="format to request each resource in, like application/n-quads (can be repeated, "
+                                 "default text/html)")
+        parser.add_argument("--concurrency", type=int, default=4, help="number of requests sent at the same time")
+
+    def handle(self, *args, log, top=1000, accept=None, concurrency=4, verbosity=1, **options):
+        try:
+            paths = top_paths(log, top)
+        except OSError as e:
+            raise CommandError(f"can't read {log}: {e}")
+        if not paths:
+            self.stdout.write(f"no requested resources found in {log}")
+            return
+
+        formats = accept or ["text/html"]
+        # the requests don't go through a web server
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            statuses = asyncio.run(self.warm(paths, formats, concurrency, verbosity > 1))
+        summary = ", ".join(f"{count} x {status}" for status, count in sorted(Counter(statuses).items()))
+        self.stdout.write(f"requested {len(paths)} resources as {', '.join(formats)}: {summary}")
+
+    async def warm(self, paths: list[tuple[str, int]], formats: list[str], concurrency: int, verbose: bool) -> list[int]:
+        # failing requests are counted, they don't stop the others
+        client = AsyncClient(raise_request_exception=False)
+        running = asyncio.Semaphore(concurrency)
+
+        async def request(path: str, requests: int, accept: str) -> int:
+            async with running:
+                response = await client.get("/" + quote(path), headers={"Accept": accept})
+                # streamed pages are only stored once they are sent completely
+                if response.streaming:
+                    async for _ in response.streaming_content:
+                        pass
+                if verbose:
+                    self.stdout.write(f"{path} ({requests} requests) as {accept}: {response.status_code}")
+                return response.status_code
+
+        return await asyncio.gather(*(request(path, requests, accept)
+                                      for path, requests in paths for accept in formats))
@@ -0,0 +1,123 @@
+"""
+Streaming parser for N-Quads (and N-Triples) results.
+
+rdflib parses JSON-LD through the full JSON-LD expansion algorithm and stores
+every triple in a ConjunctiveGraph, which the html view then only walks once to
+build its index (see index.py). N-Quads is line based: each line is one quad,
+which is matched by one regular expression and handed to the index directly.
+
+URIs, blank nodes and literals are created once per distinct term and shared by
+all quads they appear in. Blank node labels are kept as they are, the labels
+Fuseki writes to N-Quads are the blank node ids of the store, so blank nodes of
+different results of the same page (see query_plan.py) are the same nodes.
+"""
+import re
+from typing import Iterable, Iterator, Optional
+
+from rdflib import BNode, Literal, URIRef
+from rdflib.term import Node
+
+_IRI = r'<([^>]*)>'
+_BNODE = r'_:([^\s<>"]*[^\s<>".])'
+_LITERAL = r'"((?:[^"\\]|\\.)*)"(?:@([a-zA-Z]+(?:-[a-zA-Z0-9]+)*)|\^\^<([^>]*)>)?'
+
+QUAD = re.compile(
+    rf'\s*(?:{_IRI}|{_BNODE})'              # subject: iri (1) or blank node (2)
+    rf'\s*{_IRI}'                           # predicate (3)
+    rf'\s*(?:{_IRI}|{_BNODE}|{_LITERAL})'  # object: iri (4), blank node (5) or literal (6, lang 7, datatype 8)
+    rf'\s*(?:{_IRI}|{_BNODE})?'             # graph: iri (9) or blank node (10), default graph if missing
+    r'\s*\.\s*(?:#.*)?'
+)
+
+_ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+_ECHAR = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+class ParseError(ValueError):
+    pass
+
+
+def _unescape_match(match: re.Match) -> str:
+    code = match.group(1) or match.group(2)
+    if code:
+        return chr(int(code, 16))
+    return _ECHAR.get(match.group(3), match.group(3))
+
+
+def unescape(text: str) -> str:
+    """resolves the \\t, \\uXXXX, ... escapes of N-Triples strings and IRIs"""
+    if "\\" not in text:
+        return text
+    return _ESCAPE.sub(_unescape_match, text)
+
+
+class Terms:
+    """creates the rdflib terms of a parse, each distinct term only once"""
+    __slots__ = ("iris", "bnodes", "literals")
+
+    def __init__(self):
+        self.iris: dict[str, URIRef] = {}
+        self.bnodes: dict[str, BNode] = {}
+        self.literals: dict[tuple[str, Optional[str], Optional[str]], Literal] = {}
+
+    def iri(self, text: str) -> URIRef:
+        iri = self.iris.get(text)
+        if iri is None:
+            iri = self.iris[text] = URIRef(unescape(text))
+        return iri
+
+    def bnode(self, label: str) -> BNode:
+        bnode = self.bnodes.get(label)
+        if bnode is None:
+            bnode = self.bnodes[label] = BNode(label)
+        return bnode
+
+    def literal(self, text: str, lang: Optional[str], datatype: Optional[str]) -> Literal:
+        key = (text, lang, datatype)
+        literal = self.literals.get(key)
+        if literal is None:
+            literal = self.literals[key] = Literal(unescape(text),
+                                                   lang=lang,
+                                                   datatype=self.iri(datatype) if datatype else None)
+        return literal
+
+
+def parse(data: bytes, default_graph: Node, terms: Optional[Terms] = None) -> Iterator[tuple[Node, Node, Node, Node]]:
+    """
+    yields the (subject, predicate, object, graph) quads of an N-Quads (or N-Triples) document,
+    triples without graph are part of default_graph. pass the same terms to all results of a page.
+    """
+    if terms is None:
+        terms = Terms()
+    iri, bnode, literal = terms.iri, terms.bnode, terms.literal
+    match = QUAD.fullmatch
+    # not splitlines(), literals may contain unescaped unicode line separators
+    for number, line in enumerate(data.decode("utf-8").split("\n"), 1):
+        quad = match(line)
+        if quad is None:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            raise ParseError(f"invalid N-Quads in line {number}: {line[:200]!r}")
+        (s_iri, s_bnode, p_iri, o_iri, o_bnode, o_text, o_lang, o_datatype, g_iri, g_bnode) = quad.groups()
+
+        subject = iri(s_iri) if s_iri is not None else bnode(s_bnode)
+        if o_iri is not None:
+            object = iri(o_iri)
+        elif o_bnode is not None:
+            object = bnode(o_bnode)
+        else:
+            object = literal(o_text, o_lang, o_datatype)
+        if g_iri is not None:
+            graph = iri(g_iri)
+        elif g_bnode is not None:
+            graph = bnode(g_bnode)
+        else:
+            graph = default_graph
+        yield subject, iri(p_iri), object, graph
+
+
+def parse_all(documents: Iterable[bytes], default_graph: Node) -> Iterator[tuple[Node, Node, Node, Node]]:
+    """yields the quads of several results of the same page, they share their terms"""
+    terms = Terms()
+    for data in documents:
+        yield from parse(data, default_graph, terms)
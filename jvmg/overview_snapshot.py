@@ -0,0 +1,185 @@
+"""
+Materialized overview page.
+
+`settings.QUERY_OVERVIEW` runs over the whole store, but its result only
+changes when a new dump is loaded. The grouped result is therefore written to a
+JSON snapshot (`settings.OVERVIEW_SNAPSHOT`), which the overview view serves.
+The snapshot carries a token of the dataset (a checksum of the result of
+`settings.QUERY_OVERVIEW_TOKEN`), it is only rebuilt when that token changes.
+
+The snapshot is built by `manage.py build_overview` or by the background
+refresher (see `start_refresher`, started by the lifespan startup or the first
+request of the server in asgi.py and wsgi.py, not when they are imported),
+which checks the token every `settings.OVERVIEW_REFRESH_INTERVAL`
+seconds. The refresher rebuilds the label snapshot (see label_snapshot.py) as
+well. Only one worker of a host checks the token per interval, the one which
+adds a key to the cache `settings.OVERVIEW_REFRESH_CACHE` first; the others
+read the snapshots once they were replaced. Without a snapshot the overview
+view builds it, the refresher of the worker waits for that build instead of
+running it a second time (see `build_once`).
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from csv import DictReader
+from io import StringIO
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from SPARQLWrapper import CSV
+
+from . import label_snapshot, sparql
+
+logger = logging.getLogger("default")
+
+# snapshot loaded from disk and the modification time of its file
+_snapshot: Optional[dict] = None
+_snapshot_mtime: Optional[float] = None
+
+_refresher: Optional[threading.Thread] = None
+_refresher_lock = threading.Lock()
+
+# the build running in this worker, awaited by the requests and the refresher (which run in different event loops)
+_building: Optional[concurrent.futures.Future] = None
+_building_lock = threading.Lock()
+
+# key of the cache OVERVIEW_REFRESH_CACHE, held by the worker which checks the token during an interval
+REFRESH_KEY = "overview-refresh"
+
+
+def group_by_graph(result: bytes) -> list[list[dict]]:
+    """groups the csv result of QUERY_OVERVIEW by graph, each group sorted by order"""
+    groups = {}
+    for item in DictReader(StringIO(result.decode("utf-8"))):
+        if not item["graph_label"]:
+            item["graph_label"] = "<no graph found>"
+        item["order"] = int(item["order"])
+        item["count"] = int(item["count"])
+        groups.setdefault(item["graph"], []).append(item)
+
+    for group in groups.values():
+        group.sort(key=lambda i: i["order"])
+    return list(groups.values())
+
+
+async def dataset_token() -> str:
+    """returns a checksum of the dataset, it changes when the data in the store changes"""
+    result = await sparql.query_endpoint(settings.QUERY_OVERVIEW_TOKEN, CSV, "overview")
+    # the order of the rows isn't fixed
+    rows = sorted(result.decode("utf-8").splitlines())
+    return hashlib.sha256("\n".join(rows).encode("utf-8")).hexdigest()
+
+
+def load() -> Optional[dict]:
+    """
+    returns the snapshot {"token": str, "created": float, "sources": [...]} or None if
+    there is none yet. the file is only read again after it was replaced.
+    """
+    global _snapshot, _snapshot_mtime
+    try:
+        mtime = os.stat(settings.OVERVIEW_SNAPSHOT).st_mtime
+    except FileNotFoundError:
+        return None
+    if mtime != _snapshot_mtime:
+        with open(settings.OVERVIEW_SNAPSHOT, encoding="utf-8") as f:
+            _snapshot = json.load(f)
+        _snapshot_mtime = mtime
+    return _snapshot
+
+
+def save(snapshot: dict):
+    """writes the snapshot, readers never see a partially written file"""
+    path = settings.OVERVIEW_SNAPSHOT
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+async def build(token: Optional[str] = None) -> dict:
+    """runs QUERY_OVERVIEW and stores its grouped result as new snapshot"""
+    if token is None:
+        token = await dataset_token()
+    start = time.time()
+    result = await sparql.query_endpoint(settings.QUERY_OVERVIEW, CSV, "overview")
+    snapshot = {"token": token, "created": start, "sources": group_by_graph(result)}
+    save(snapshot)
+    logger.info(f"overview snapshot built in {time.time() - start:.3f}s (token {token})")
+    return snapshot
+
+
+async def build_once(token: Optional[str] = None) -> dict:
+    """builds the snapshot like build(), or waits for the build which is already running in this worker"""
+    global _building
+    with _building_lock:
+        future, leader = _building, _building is None
+        if leader:
+            future = _building = concurrent.futures.Future()
+    if not leader:
+        return await asyncio.wrap_future(future)
+
+    try:
+        snapshot = await build(token)
+        future.set_result(snapshot)
+        return snapshot
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _building_lock:
+            _building = None
+
+
+async def refresh(force: bool = False, token: Optional[str] = None) -> bool:
+    """rebuilds the snapshot if the dataset changed (or force is set), returns whether it was rebuilt"""
+    if token is None:
+        token = await dataset_token()
+    snapshot = load()
+    if not force and snapshot is not None and snapshot["token"] == token:
+        return False
+    await build_once(token)
+    return True
+
+
+async def _claim_refresh() -> bool:
+    """returns whether this worker checks the token in this interval, only one worker of the host does"""
+    if settings.OVERVIEW_REFRESH_CACHE is None:
+        return True
+    return await caches[settings.OVERVIEW_REFRESH_CACHE].aadd(REFRESH_KEY, os.getpid(),
+                                                               settings.OVERVIEW_REFRESH_INTERVAL)
+
+
+async def _refresh_forever():
+    while True:
+        try:
+            # a host without snapshot (like a fresh one) doesn't wait for the worker of the interval
+            if load() is None or await _claim_refresh():
+                token = await dataset_token()
+                await refresh(token=token)
+                await label_snapshot.refresh(token)
+            else:
+                # another worker checked the token, the label snapshot it may have rebuilt is read again
+                label_snapshot.load()
+        except Exception as e:
+            logger.error(f"refreshing the overview and label snapshots failed: {e!r}")
+        await asyncio.sleep(settings.OVERVIEW_REFRESH_INTERVAL)
+
+
+def start_refresher():
+    """starts the background refresher of this worker (once, by the server), if it isn't running already or is disabled"""
+    global _refresher
+    if settings.OVERVIEW_REFRESH_INTERVAL is None or _refresher is not None:
+        return
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = threading.Thread(target=asyncio.run,
+                                          args=(_refresh_forever(),),
+                                          name="overview-refresher",
+                                          daemon=True)
+            _refresher.start()
@@ -0,0 +1,75 @@
+"""
+Concurrent fetching of the sparql results a html page is built from.
+
+`settings.QUERY` is one big CONSTRUCT which UNIONs the triples of the resource,
+its blank nodes, its back-links and their labels. The endpoint evaluates it in
+one thread, so its slowest branch (usually the back-links) and all the others
+add up. `settings.QUERY_PLAN` has the same branches as independent queries,
+which are sent concurrently; their results are merged when they are parsed.
+`settings.QUERY_CLUSTER_PLAN` does the same for `settings.QUERY_CLUSTER`.
+
+The planned queries leave out the labels: joining them in with OPTIONAL
+multiplies the result rows by the number of label variants. The labels of all
+URIs of the result are fetched afterwards in batches (see labels.py).
+Custom queries (or `QUERY_PLAN = None`) are sent as they are.
+"""
+import asyncio
+from typing import Optional
+
+from django.conf import settings
+from rdflib import URIRef
+
+from . import back_links, sparql
+from .selection import EVERYTHING, Selection
+
+
+def plan(query: str) -> Optional[dict[str, str]]:
+    """returns the planned queries of query, None if it is sent as it is"""
+    if query == settings.QUERY:
+        return settings.QUERY_PLAN or None
+    if query == settings.QUERY_CLUSTER:
+        return settings.QUERY_CLUSTER_PLAN or None
+    return None
+
+
+def label_free(query: str) -> bool:
+    """whether the labels of the html data of query have to be fetched separately"""
+    return plan(query) is not None
+
+
+def parts(query: str) -> list[str]:
+    """returns the CONSTRUCT queries which together return the html data of query"""
+    paginated = back_links.paginated(query)
+    planned = plan(query)
+    if planned is not None:
+        # paginated back-links are fetched separately
+        queries = [part for name, part in planned.items() if not (paginated and name == "back_links")]
+    elif paginated:
+        queries = [settings.QUERY_FORWARD]
+    else:
+        return [query]
+    if paginated:
+        # blank nodes aren't paginated, see back_links.py
+        queries.append(settings.QUERY_BACK_LINK_BLANK_NODES)
+    return queries
+
+
+async def fetch(resource_uri: URIRef, query: str, selection: Selection = EVERYTHING
+                ) -> tuple[list[bytes], Optional[dict[tuple[URIRef, URIRef], int]]]:
+    """
+    returns the sparql results a html page is built from: a list of documents in settings.HTML_RESULT_FORMAT
+    and, if the back-links are paginated, the number of back-links per (graph, predicate).
+    all queries which don't depend on each other are sent concurrently. graphs hidden by selection are left out.
+    """
+    fetches = [sparql.fetch(resource_uri,
+                            selection.apply(part.replace("$resource", resource_uri)),
+                            settings.HTML_RESULT_FORMAT)
+               for part in parts(query)]
+    if not back_links.paginated(query):
+        return list(await asyncio.gather(*fetches)), None
+
+    *data, back_link_counts = await asyncio.gather(*fetches, back_links.fetch_counts(resource_uri, selection))
+    data.extend(await asyncio.gather(*(
+        back_links.fetch_page(resource_uri, graph, predicate, offset=0) for graph, predicate in back_link_counts
+    )))
+    return data, back_link_counts
@@ -0,0 +1,332 @@
+"""
+Persistent store of sparql results and rendered pages, shared by the workers of a host.
+
+The caches used to live in the memory of each worker, so every worker started
+cold after a deploy or restart and the sparql endpoint got the queries of all of
+them at once. `ResultStore` is a django cache backend which keeps the entries in
+a SQLite database (the LOCATION of the cache) in WAL mode: all workers on the
+host read and write the same file, readers never wait for writers and read the
+pages of the database through a memory map. Values are pickled and compressed
+with zlib.
+
+Besides TIMEOUT and MAX_ENTRIES the cache takes these OPTIONS:
+
+- `MAX_BYTES`: max. total size of the compressed values. Beyond it (or beyond
+  MAX_ENTRIES) the entries read least recently are evicted.
+- `MMAP_SIZE`: bytes of the database file which are memory-mapped.
+- `DATASET_VERSION`: dotted path of a function returning the token of the
+  current version of the dataset, like `jvmg.conditional.dataset_version`.
+  Entries stored for another version are misses, they are deleted with the next
+  write after the token changed.
+
+`manage.py warm_result_store` fills the store with the pages requested most
+often according to access.log.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+# zlib level of the stored values, higher levels barely shrink rdf results but take much longer
+COMPRESSION_LEVEL = 1
+# reads of an entry within this many seconds are recorded as one, so reading doesn't mean writing
+ACCESS_RESOLUTION = 60.0
+# share of MAX_BYTES and MAX_ENTRIES left after an eviction, so not every write evicts
+CULL_TARGET = 0.9
+# seconds a write waits for the writes of other workers
+BUSY_TIMEOUT = 5.0
+# max. number of keys in one query, sqlite limits the number of parameters
+KEYS_PER_QUERY = 500
+# values up to this size (compressed) are decoded on the event loop, bigger ones in a thread
+DECODE_INLINE_BYTES = 64 * 1024
+
+# the totals are kept up to date by triggers, so checking the limits doesn't scan the table.
+# entries are replaced with an upsert, REPLACE wouldn't fire the delete trigger
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_inserted AFTER INSERT ON entries BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_deleted AFTER DELETE ON entries BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_updated AFTER UPDATE OF size ON entries BEGIN
+    UPDATE totals SET bytes = bytes - old.size + new.size;
+END;
+"""
+
+UPSERT = """
+INSERT INTO entries (key, value, size, version, expires, accessed) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, version = excluded.version,
+                                expires = excluded.expires, accessed = excluded.accessed
+"""
+
+
+def _chunks(keys: list[str]):
+    for start in range(0, len(keys), KEYS_PER_QUERY):
+        yield keys[start:start + KEYS_PER_QUERY]
+
+
+class ResultStore(BaseCache):
+    def __init__(self, location: str, params: dict):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.path = location
+        self.max_bytes = int(options.get("MAX_BYTES", 1024 * 1024 * 1024))
+        self.mmap_size = int(options.get("MMAP_SIZE", 256 * 1024 * 1024))
+        self._dataset_version: Optional[Callable[[], str]] = (
+            import_string(options["DATASET_VERSION"]) if options.get("DATASET_VERSION") else None)
+        # the version the entries of other versions were last deleted for, by this worker
+        self._culled_version: Optional[str] = None
+        # connections can't be shared by threads (nor forked processes)
+        self._local = threading.local()
+        # the process which created the schema, it is only created once per process
+        self._schema_pid: Optional[int] = None
+        # key -> time of the reads not yet written, they are written with the next write
+        self._accessed: dict[str, float] = {}
+        self._accessed_lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        """
+        opens a connection, the first one of the process creates the schema. both may wait
+        up to BUSY_TIMEOUT for the writes of other workers, the async methods run it in a thread
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # autocommit, the writes begin their transactions themselves.
+        # the connection is only used by the thread it is stored for, which may not be the one opening it
+        connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        # a commit isn't synced to disk before the next checkpoint, a crash of the host may lose the latest entries
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        if self._schema_pid != os.getpid():
+            connection.executescript(SCHEMA)
+            self._schema_pid = os.getpid()
+        return connection
+
+    def _store_connection(self, connection: sqlite3.Connection) -> sqlite3.Connection:
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        return self._store_connection(self._open())
+
+    async def _aconnection(self) -> sqlite3.Connection:
+        """the connection of the thread of the event loop, it is opened in another thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        return self._store_connection(await sync_to_async(self._open, thread_sensitive=False)())
+
+    def version_token(self) -> str:
+        return self._dataset_version() if self._dataset_version is not None else ""
+
+    @staticmethod
+    def _valid(version: str, expires: Optional[float], current: str, now: float) -> bool:
+        return version == current and (expires is None or expires > now)
+
+    def _read(self, key: str, accessed: float, now: float):
+        if now - accessed > ACCESS_RESOLUTION:
+            with self._accessed_lock:
+                self._accessed[key] = now
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        return zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), COMPRESSION_LEVEL)
+
+    @staticmethod
+    def _decode(data: bytes) -> Any:
+        return pickle.loads(zlib.decompress(data))
+
+    def _decode_many(self, data: dict[Any, bytes]) -> dict[Any, Any]:
+        return {key: self._decode(value) for key, value in data.items()}
+
+    async def _adecode_many(self, data: dict[Any, bytes]) -> dict[Any, Any]:
+        """decodes big values in a thread, unpickling megabytes would block the event loop"""
+        if sum(map(len, data.values())) <= DECODE_INLINE_BYTES:
+            return self._decode_many(data)
+        return await sync_to_async(self._decode_many, thread_sensitive=False)(data)
+
+    def _write(self, write: Callable[[sqlite3.Connection, float, str], Any]) -> Any:
+        """runs write(connection, now, version) in a transaction, with the recorded reads and the eviction"""
+        connection = self._connection()
+        with self._accessed_lock:
+            accessed, self._accessed = self._accessed, {}
+        now = time.time()
+        version = self.version_token()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = write(connection, now, version)
+            if accessed:
+                connection.executemany("UPDATE entries SET accessed = ? WHERE key = ?",
+                                       [(read, key) for key, read in accessed.items()])
+            self._cull(connection, now, version)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._culled_version = version
+        return result
+
+    def _cull(self, connection: sqlite3.Connection, now: float, version: str):
+        if version != self._culled_version:
+            connection.execute("DELETE FROM entries WHERE version != ?", (version,))
+
+        entries, size = connection.execute("SELECT entries, bytes FROM totals").fetchone()
+        if entries <= self._max_entries and size <= self.max_bytes:
+            return
+        connection.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        entries, size = connection.execute("SELECT entries, bytes FROM totals").fetchone()
+        if entries <= self._max_entries and size <= self.max_bytes:
+            return
+
+        excess_entries = entries - int(self._max_entries * CULL_TARGET)
+        excess_bytes = size - int(self.max_bytes * CULL_TARGET)
+        evicted = []
+        cursor = connection.execute("SELECT key, size FROM entries ORDER BY accessed")
+        for key, entry_size in cursor:
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            evicted.append((key,))
+            excess_entries -= 1
+            excess_bytes -= entry_size
+        cursor.close()
+        connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def _select(self, connection: sqlite3.Connection, keys, version) -> dict[Any, bytes]:
+        """returns the stored (encoded) values of the valid entries of keys"""
+        by_key = {self.make_and_validate_key(key, version=version): key for key in keys}
+        current = self.version_token()
+        now = time.time()
+        values = {}
+        for chunk in _chunks(list(by_key)):
+            for key, value, stored_version, expires, accessed in connection.execute(
+                    "SELECT key, value, version, expires, accessed FROM entries "
+                    f"WHERE key IN ({', '.join('?' * len(chunk))})", chunk):
+                if self._valid(stored_version, expires, current, now):
+                    self._read(key, accessed, now)
+                    values[by_key[key]] = value
+        return values
+
+    def _select_version(self, connection: sqlite3.Connection, key, version) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        row = connection.execute("SELECT version, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        return row is not None and self._valid(row[0], row[1], self.version_token(), time.time())
+
+    def get(self, key, default=None, version=None):
+        data = self._select(self._connection(), [key], version)
+        return self._decode(data[key]) if data else default
+
+    def get_many(self, keys, version=None):
+        return self._decode_many(self._select(self._connection(), keys, version))
+
+    def has_key(self, key, version=None):
+        return self._select_version(self._connection(), key, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        entries = [(self.make_and_validate_key(key, version=version), self._encode(value))
+                   for key, value in data.items()]
+
+        def write(connection, now, current):
+            connection.executemany(UPSERT, [(key, value, len(value), current, expires, now)
+                                            for key, value in entries])
+
+        self._write(write)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        key = self.make_and_validate_key(key, version=version)
+        value = self._encode(value)
+
+        def write(connection, now, current):
+            row = connection.execute("SELECT version, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._valid(row[0], row[1], current, now):
+                return False
+            connection.execute(UPSERT, (key, value, len(value), current, expires, now))
+            return True
+
+        return self._write(write)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        key = self.make_and_validate_key(key, version=version)
+
+        def write(connection, now, current):
+            return connection.execute(
+                "UPDATE entries SET expires = ? WHERE key = ? AND version = ? AND (expires IS NULL OR expires > ?)",
+                (expires, key, current, now)).rowcount > 0
+
+        return self._write(write)
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version) > 0
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+
+        def write(connection, now, current):
+            deleted = 0
+            for chunk in _chunks(keys):
+                deleted += connection.execute(
+                    f"DELETE FROM entries WHERE key IN ({', '.join('?' * len(chunk))})", chunk).rowcount
+            return deleted
+
+        return self._write(write)
+
+    def clear(self):
+        self._write(lambda connection, now, current: connection.execute("DELETE FROM entries"))
+
+    # reads from the memory map take microseconds, less than handing them to a thread.
+    # opening the connection, decoding big values and writes (which may wait for the
+    # writes of other workers) run in threads
+    async def aget(self, key, default=None, version=None):
+        data = self._select(await self._aconnection(), [key], version)
+        return (await self._adecode_many(data))[key] if data else default
+
+    async def aget_many(self, keys, version=None):
+        return await self._adecode_many(self._select(await self._aconnection(), keys, version))
+
+    async def ahas_key(self, key, version=None):
+        return self._select_version(await self._aconnection(), key, version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return await sync_to_async(self.set, thread_sensitive=False)(key, value, timeout, version)
+
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return await sync_to_async(self.set_many, thread_sensitive=False)(data, timeout, version)
+
+    def close(self, **kwargs):
+        # the connections are kept open between requests, opening one reads the schema again
+        pass
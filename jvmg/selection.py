@@ -0,0 +1,133 @@
+"""
+The graphs and languages a user looks at.
+
+Hidden graphs and labels in other languages used to be queried, parsed, built
+into view models, rendered and sent, and were only hidden by scripts.js. The
+selection of a request is read from its query parameters, or from the cookies
+of the same name which scripts.js sets:
+
+- `hide_graphs`: comma separated URIs of the graphs to leave out. Without it
+  html pages leave out `settings.NSFW_GRAPHS`, "none" shows all graphs.
+- `lang`: comma separated languages of the labels to show. Of the labels of a
+  node only those in the first of them it has labels in are kept, then the
+  english ones, then those without language, and if there are none of them all
+  labels (like the language switcher did before). Without it, or with "all",
+  every label is kept.
+
+The selection is pushed down into the sparql queries: `$graph_filter` is
+replaced with a FILTER on ?graph (`$other_graph_filter` on ?other_graph) and
+`$language_filter` (in `settings.QUERY_LABELS`) with a langMatches FILTER on
+?label. It keeps the labels in the languages `Selection.choose` looks for and
+those without language, and all labels of a node which has none of them, so
+the last fallback still has them. Results of queries without the placeholders
+are filtered before the view models are built.
+"""
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.http import HttpRequest
+from rdflib import Literal
+
+from .back_links import is_valid_uri
+
+LANGUAGE_TAG = re.compile(r"[a-z]{1,8}(-[a-z0-9]{1,8})*")
+
+
+@dataclass(frozen=True, slots=True)
+class Selection:
+    hidden_graphs: frozenset[str]
+    # None keeps the labels in all languages
+    languages: Optional[tuple[str, ...]]
+
+    def key(self) -> str:
+        """identifies the selection in cache keys and ETags"""
+        languages = ",".join(self.languages) if self.languages is not None else "all"
+        return f"{','.join(sorted(self.hidden_graphs))};{languages}"
+
+    def shows_graph(self, graph) -> bool:
+        return str(graph) not in self.hidden_graphs
+
+    def graph_filter(self, variable: str = "?graph") -> str:
+        if not self.hidden_graphs:
+            return ""
+        return f"FILTER({variable} NOT IN ({', '.join(f'<{graph}>' for graph in sorted(self.hidden_graphs))}))"
+
+    def language_filter(self) -> str:
+        if self.languages is None:
+            return ""
+
+        def shown(variable: str) -> str:
+            return " || ".join([f'lang({variable}) = ""']
+                               + [f'langMatches(lang({variable}), "{language}")' for language in self.fallbacks()])
+
+        return f"FILTER({shown('?label')} || NOT EXISTS {{ ?uri ?predicate ?other_label FILTER({shown('?other_label')}) }})"
+
+    def fallbacks(self) -> tuple[str, ...]:
+        """the languages in the order labels are looked for, without duplicates"""
+        return tuple(dict.fromkeys((*self.languages, "en")))
+
+    def apply(self, query: str) -> str:
+        """replaces the placeholders of the selection in a query"""
+        return (query
+                .replace("$graph_filter", self.graph_filter())
+                .replace("$other_graph_filter", self.graph_filter("?other_graph"))
+                .replace("$language_filter", self.language_filter()))
+
+    def choose(self, labels: list[Literal]) -> list[Literal]:
+        """the labels of a node which are shown, see the module docstring"""
+        if self.languages is None:
+            return labels
+        for language in self.fallbacks():
+            chosen = [label for label in labels if label.language and matches(label.language, language)]
+            if chosen:
+                return chosen
+        return [label for label in labels if not label.language] or labels
+
+
+EVERYTHING = Selection(hidden_graphs=frozenset(), languages=None)
+
+
+def matches(tag: str, language: str) -> bool:
+    """like langMatches in sparql: "en-US" matches "en" """
+    tag = tag.lower()
+    return tag == language or tag.startswith(language + "-")
+
+
+def _split(value: str) -> list[str]:
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def _parameter(request: HttpRequest, name: str) -> Optional[str]:
+    if name in request.GET:
+        return request.GET[name]
+    if name in request.COOKIES:
+        # scripts.js encodes the cookie values, commas are not allowed in cookies
+        return unquote(request.COOKIES[name])
+    return None
+
+
+def from_request(request: HttpRequest, hidden_graphs: Iterable[str] = ()) -> Selection:
+    """the selection of a request, hidden_graphs are hidden if it doesn't choose any"""
+    hide = _parameter(request, "hide_graphs")
+    if hide is None:
+        graphs = frozenset(hidden_graphs)
+    elif hide == "none":
+        graphs = frozenset()
+    else:
+        # the uris are put into queries
+        graphs = frozenset(uri for uri in _split(hide) if is_valid_uri(uri))
+
+    lang = _parameter(request, "lang")
+    if lang is None or lang == "all":
+        languages = None
+    else:
+        languages = tuple(dict.fromkeys(tag for tag in map(str.lower, _split(lang)) if LANGUAGE_TAG.fullmatch(tag)))
+    return Selection(hidden_graphs=graphs, languages=languages or None)
+
+
+def for_page(request: HttpRequest) -> Selection:
+    """the selection of a html page, the graphs in settings.NSFW_GRAPHS are hidden by default"""
+    return from_request(request, settings.NSFW_GRAPHS)
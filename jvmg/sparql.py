@@ -0,0 +1,328 @@
+"""
+Access to the sparql endpoints configured in `settings.SPARQL_ENDPOINTS`.
+
+Query results are fetched as raw response bytes, which can be cached (see
+`settings.SPARQL_CACHE`) and parsed into rdflib graphs (or directly into the
+index of the html view, see parse_index) when needed. Results
+which are too big for the cache can be streamed instead (see fetch_stream).
+Every query is sent to one of the endpoints (see endpoints.py), through its
+shared connection pool (`clients.sparql_client()`).
+
+Every query has to be answered within the timeout of its kind
+(`settings.SPARQL_QUERY_TIMEOUTS`) and goes through the circuit breaker of its
+endpoint (see breaker.py). If no endpoint can answer, `EndpointUnavailable`
+is raised, fetch and fetch_stream serve the last known good result instead
+(see stale.py).
+"""
+import asyncio
+import json
+import logging
+import re
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar, Union
+
+import httpx
+from django.conf import settings
+from django.core.cache import caches
+from rdflib import BNode, ConjunctiveGraph
+from SPARQLWrapper import CSV, JSON, JSONLD, TURTLE, XML
+
+from . import endpoints, nquads, stale, timing
+from .breaker import EndpointUnavailable
+from .cache import get_or_compute, make_key, single_flight
+from .clients import sparql_client
+from .index import TripleIndex
+
+logger = logging.getLogger("default")
+
+# line based formats which SPARQLWrapper doesn't have constants for
+NTRIPLES = "nt"
+NQUADS = "nquads"
+
+# return formats -> accept header sent to the sparql endpoint
+ACCEPT = {
+    XML: "application/rdf+xml",
+    TURTLE: "text/turtle",
+    JSONLD: "application/ld+json",
+    JSON: "application/sparql-results+json",
+    CSV: "text/csv",
+    NTRIPLES: "application/n-triples",
+    NQUADS: "application/n-quads",
+}
+
+# return formats -> rdflib parser names
+RDF_FORMATS = {
+    XML: "xml",
+    TURTLE: "turtle",
+    JSONLD: "json-ld",
+    NTRIPLES: "nt",
+    NQUADS: "nquads",
+}
+
+# context of the triples of N-Triples results and of N-Quads lines without graph
+DEFAULT_GRAPH = BNode()
+
+# an empty CONSTRUCT result (only prefixes, an empty json-ld document, ...) is smaller than this
+EMPTY_RESULT_MAX_BYTES = 16 * 1024
+# the lines of an empty turtle result: comments and prefix or base declarations
+TURTLE_HEADER = re.compile(rb"#|@prefix\s|@base\s|prefix\s|base\s", re.IGNORECASE)
+# an empty rdf/xml result: the root element without children
+EMPTY_RDF_XML = re.compile(rb"\s*(<\?xml[^>]*\?>)?\s*(<!--.*?-->\s*)*<(\w+:)?RDF\b[^>]*?(/>|>\s*</(\w+:)?RDF>)\s*",
+                           re.DOTALL)
+
+# connection failures, a query which failed with one of them is sent once more (to another endpoint if there is one)
+RETRIED_ERRORS = (httpx.ConnectError, httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError)
+
+T = TypeVar("T")
+
+
+def timeout_for(kind: str) -> float:
+    return settings.SPARQL_QUERY_TIMEOUTS.get(kind, settings.SPARQL_QUERY_TIMEOUTS["default"])
+
+
+@asynccontextmanager
+async def guarded(kind: str, avoid: Optional[endpoints.Endpoint] = None) -> AsyncIterator[endpoints.Endpoint]:
+    """
+    chooses the endpoint for a query of this kind, limits the query to its timeout and reports
+    the outcome to the circuit breaker of the endpoint. raises EndpointUnavailable if the
+    circuits of all endpoints are open, the query timed out or the endpoint failed.
+    """
+    try:
+        endpoint = endpoints.choose(kind, avoid)
+    except EndpointUnavailable:
+        timing.count("sparql_rejected")
+        raise
+    breaker = endpoint.breaker
+    timing.count(f"sparql_endpoint.{endpoint.name}")
+
+    timeout = timeout_for(kind)
+    start = perf_counter()
+    endpoint.start()
+    try:
+        async with asyncio.timeout(timeout):
+            yield endpoint
+    except TimeoutError as e:
+        endpoint.finish()
+        breaker.failure()
+        timing.count("sparql_timeout")
+        raise EndpointUnavailable(f"{kind} query timed out after {timeout}s", breaker.retry_after()) from e
+    except httpx.TransportError as e:
+        endpoint.finish()
+        breaker.failure()
+        raise EndpointUnavailable(f"{kind} query failed: {e!r}", breaker.retry_after()) from e
+    except httpx.HTTPStatusError as e:
+        endpoint.finish(perf_counter() - start)
+        # an invalid query is answered by a working endpoint
+        if e.response.status_code < 500 and e.response.status_code != 429:
+            breaker.success()
+            raise
+        breaker.failure()
+        raise EndpointUnavailable(f"{kind} query failed: {e}", breaker.retry_after()) from e
+    except BaseException:
+        endpoint.finish()
+        raise
+
+    duration = perf_counter() - start
+    endpoint.finish(duration)
+    if duration > timeout * settings.SPARQL_BREAKER_SLOW:
+        breaker.failure()
+    else:
+        breaker.success()
+
+
+async def send(kind: str, run: Callable[[endpoints.Endpoint], Awaitable[T]]) -> T:
+    """awaits run(endpoint) for a query of this kind in guarded(), once more if the connection failed"""
+    failed = None
+    while True:
+        try:
+            async with guarded(kind, failed) as endpoint:
+                return await run(endpoint)
+        except EndpointUnavailable as e:
+            if failed is not None or not isinstance(e.__cause__, RETRIED_ERRORS):
+                raise
+            failed = endpoint
+            timing.count("sparql_retry")
+
+
+async def open_endpoint(query: str, data_format: str, endpoint: endpoints.Endpoint) -> httpx.Response:
+    """sends the query to the sparql endpoint and returns the http response, its body is not read yet"""
+    client = sparql_client(endpoint.url)
+    request = client.build_request("POST",
+                                   endpoint.url,
+                                   data={"query": query},
+                                   headers={"Accept": ACCEPT[data_format]})
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.TransportError as e:
+        logger.error(f"No connection to sparql endpoint: {endpoint.url}!")
+        raise e
+
+    if response.is_error:
+        await response.aread()
+        await response.aclose()
+        response.raise_for_status()
+    return response
+
+
+async def query_endpoint(query: str, data_format: str, kind: str = "default") -> bytes:
+    """runs the query against the sparql endpoint and returns the raw response body"""
+    async def run(endpoint: endpoints.Endpoint) -> bytes:
+        response = await open_endpoint(query, data_format, endpoint)
+        try:
+            return await response.aread()
+        finally:
+            await response.aclose()
+
+    with timing.span("sparql"):
+        return await send(kind, run)
+
+
+async def fetch(resource_uri: str, query: str, data_format: str) -> bytes:
+    """
+    returns the raw result of the query for the resource_uri.
+    results are cached in settings.SPARQL_CACHE, keyed by (resource_uri, query, data_format),
+    and kept in settings.STALE_CACHE for when the endpoint is unavailable.
+    """
+    key = make_key("sparql", resource_uri, query, data_format)
+
+    async def compute() -> bytes:
+        data = await query_endpoint(query, data_format)
+        stale.remember(key, data)
+        return data
+
+    return await stale.fallback(key, lambda: get_or_compute(settings.SPARQL_CACHE, key, compute,
+                                                            max_bytes=settings.SPARQL_CACHE_MAX_BYTES))
+
+
+class Stream:
+    """
+    a result which is too big to be cached. its beginning (head) is already read,
+    the rest is read from the http response in chunks while iterating over it.
+    """
+
+    def __init__(self, head: bytes, chunks: AsyncIterator[bytes], response: httpx.Response):
+        self.head = head
+        self.chunks = chunks
+        self.response = response
+        self.claimed = False
+
+    def claim(self) -> bool:
+        """a stream can only be read once, only the first caller of claim() gets True"""
+        claimed, self.claimed = self.claimed, True
+        return not claimed
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            chunk_size = settings.SPARQL_STREAM_CHUNK_SIZE
+            for start in range(0, len(self.head), chunk_size):
+                yield self.head[start:start + chunk_size]
+            self.head = b""
+            async for chunk in self.chunks:
+                yield chunk
+        finally:
+            await self.response.aclose()
+
+
+async def fetch_stream(resource_uri: str, query: str, data_format: str) -> Union[bytes, Stream]:
+    """
+    like fetch(), but results bigger than settings.SPARQL_CACHE_MAX_BYTES are not read
+    completely. they are returned as Stream, which passes the response of the sparql
+    endpoint through in chunks, so memory usage doesn't grow with the size of the result.
+    """
+    max_bytes = settings.SPARQL_CACHE_MAX_BYTES
+    key = make_key("sparql", resource_uri, query, data_format)
+
+    async def read_head(endpoint: endpoints.Endpoint) -> Union[bytes, Stream]:
+        response = await open_endpoint(query, data_format, endpoint)
+        chunks = response.aiter_bytes(settings.SPARQL_STREAM_CHUNK_SIZE)
+        head = []
+        size = 0
+        try:
+            async for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    timing.count("sparql_streamed")
+                    return Stream(b"".join(head), chunks, response)
+        except BaseException:
+            await response.aclose()
+            raise
+        await response.aclose()
+        return b"".join(head)
+
+    async def open_stream() -> Union[bytes, Stream]:
+        # the rest of a stream is read while the response is sent, it isn't part of the span (nor the timeout)
+        with timing.span("sparql"):
+            data = await send("default", read_head)
+        if isinstance(data, Stream):
+            return data
+        if settings.SPARQL_CACHE is not None:
+            await caches[settings.SPARQL_CACHE].aset(key, data)
+        stale.remember(key, data)
+        return data
+
+    if settings.SPARQL_CACHE is not None:
+        data = await caches[settings.SPARQL_CACHE].aget(key)
+        if data is not None:
+            timing.count(f"cache_hit.{settings.SPARQL_CACHE}")
+            return data
+        timing.count(f"cache_miss.{settings.SPARQL_CACHE}")
+
+    async def compute() -> Union[bytes, Stream]:
+        # fetch() shares the cache key, but must never get a Stream from a flight of fetch_stream()
+        result = await single_flight(make_key("sparql-stream", resource_uri, query, data_format), open_stream)
+        # other requests waiting for the same result can't share a stream, they open their own
+        if isinstance(result, Stream) and not result.claim():
+            result = await open_stream()
+        return result
+
+    # only complete results are stored, the background refresh doesn't need a stream
+    return await stale.fallback(key, compute, lambda: fetch(resource_uri, query, data_format))
+
+
+def is_empty(data: bytes, data_format: str) -> bool:
+    """checks if a complete CONSTRUCT result contains no triples at all, without parsing it"""
+    # an empty result is never this big
+    if len(data) > EMPTY_RESULT_MAX_BYTES:
+        return False
+    if data_format in (NTRIPLES, NQUADS):
+        return not any(line.strip() and not line.lstrip().startswith(b"#") for line in data.splitlines())
+    if data_format == TURTLE:
+        return all(not line.strip() or TURTLE_HEADER.match(line.strip()) for line in data.splitlines())
+    if data_format == XML:
+        return EMPTY_RDF_XML.fullmatch(data) is not None
+    if data_format == JSONLD:
+        # only the json is loaded, it isn't converted to rdf
+        try:
+            document = json.loads(data)
+        except ValueError:
+            return False
+        if isinstance(document, dict) and set(document) <= {"@context", "@graph"}:
+            document = document.get("@graph", [])
+        return document == []
+    return not data.strip()
+
+
+def parse(data: bytes, data_format: str) -> ConjunctiveGraph:
+    """parses a raw CONSTRUCT result into a ConjunctiveGraph"""
+    graph = ConjunctiveGraph()
+    graph.parse(data=data, format=RDF_FORMATS[data_format])
+    return graph
+
+
+def parse_index(results: list[bytes], data_format: str) -> TripleIndex:
+    """
+    parses the raw CONSTRUCT results of one page into one TripleIndex. N-Triples and
+    N-Quads are fed to the index line by line, without building an rdflib graph.
+    """
+    with timing.span("parse"):
+        if data_format in (NTRIPLES, NQUADS):
+            index = TripleIndex(nquads.parse_all(results, DEFAULT_GRAPH))
+        else:
+            graph = parse(results[0], data_format)
+            for data in results[1:]:
+                graph.parse(data=data, format=RDF_FORMATS[data_format])
+            index = TripleIndex.from_graph(graph)
+    timing.count("triples", index.size)
+    return index
@@ -0,0 +1,130 @@
+"""
+Last known good results of the sparql endpoint.
+
+Every complete result of `sparql.fetch` and `sparql.fetch_stream` (up to
+`settings.SPARQL_CACHE_MAX_BYTES`) is also kept in `settings.STALE_CACHE`, a
+persistent cache without expiry. If the endpoint can't answer a query (the
+circuit is open, the query timed out or failed, see breaker.py), the stored
+result is served instead and the query is repeated in the background, so the
+next request gets a fresh result again.
+
+`StaleMiddleware` marks responses built from stored results with a `Warning`
+and an `Age` header (the age of the oldest stored result). Requests which
+neither get a fresh nor a stored result are answered with 503 and `Retry-After`.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest, HttpResponse
+
+from . import timing
+from .breaker import EndpointUnavailable
+
+logger = logging.getLogger("default")
+
+# ages (in seconds) of the stored results served for the current request
+_current: ContextVar[Optional[list[float]]] = ContextVar("stale_ages", default=None)
+
+# keys refreshed in the background right now, and the tasks doing it (asyncio only keeps weak references)
+_refreshing: set[str] = set()
+_tasks: set[asyncio.Task] = set()
+
+
+def _background(coroutine: Awaitable):
+    # the task isn't part of the request which started it
+    task = asyncio.get_running_loop().create_task(coroutine, context=contextvars.Context())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def remember(key: str, data: bytes):
+    """stores a complete result as the last known good result for key, in the background"""
+    if settings.STALE_CACHE is None or len(data) > settings.SPARQL_CACHE_MAX_BYTES:
+        return
+
+    async def store():
+        try:
+            await caches[settings.STALE_CACHE].aset(key, (time.time(), data))
+        except Exception as e:
+            logger.error(f"storing a result in {settings.STALE_CACHE} failed: {e!r}")
+
+    _background(store())
+
+
+def _refresh(key: str, refresh: Callable[[], Awaitable[Any]]):
+    if key in _refreshing:
+        return
+
+    async def run():
+        try:
+            await refresh()
+        except Exception as e:
+            logger.info(f"refreshing a stale result failed: {e!r}")
+        finally:
+            _refreshing.discard(key)
+
+    _refreshing.add(key)
+    _background(run())
+
+
+async def fallback(key: str,
+                   compute: Callable[[], Awaitable[Any]],
+                   refresh: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+    """
+    returns compute(), or the result stored for key if the endpoint is unavailable.
+    in that case refresh() (compute() by default) is awaited in the background.
+    """
+    try:
+        return await compute()
+    except EndpointUnavailable:
+        if settings.STALE_CACHE is None:
+            raise
+        entry = await caches[settings.STALE_CACHE].aget(key)
+        if entry is None:
+            raise
+
+    stored, data = entry
+    timing.count("stale")
+    ages = _current.get()
+    if ages is not None:
+        ages.append(time.time() - stored)
+    _refresh(key, refresh or compute)
+    return data
+
+
+class StaleMiddleware:
+    """adds the staleness headers, and answers requests the endpoint failed for with 503"""
+    async_capable = True
+    sync_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    async def __call__(self, request: HttpRequest) -> HttpResponse:
+        ages = []
+        token = _current.set(ages)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        if ages:
+            response.headers["Warning"] = '110 - "Response is Stale"'
+            response.headers["Age"] = str(int(max(ages)))
+        return response
+
+    async def process_exception(self, request: HttpRequest, exception: Exception) -> Optional[HttpResponse]:
+        if not isinstance(exception, EndpointUnavailable):
+            return None
+        logger.error(f"sparql endpoint unavailable for {request.path}: {exception}")
+        response = HttpResponse("The SPARQL endpoint is unavailable, please try again later.",
+                                status=503, content_type="text/plain; charset=utf-8")
+        response.headers["Retry-After"] = str(max(1, math.ceil(exception.retry_after)))
+        return response
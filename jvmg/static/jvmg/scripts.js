@@ -18,54 +18,53 @@ document.addEventListener("DOMContentLoaded", () => {
 
 
 //
-// Language switcher for predicate labels
+// Cookies with the languages and hidden graphs of the pages, see jvmg/selection.py
+//
+function getCookie(name) {
+  for (const cookie of document.cookie.split("; ")) {
+    const [key, value] = cookie.split("=");
+    if (key === name)
+      return decodeURIComponent(value);
+  }
+  return null;
+}
+
+function setCookie(name, value) {
+  document.cookie = `${name}=${encodeURIComponent(value)}; path=/; max-age=31536000; SameSite=Lax`;
+}
+
+
+//
+// Language switcher for labels, the server only sends the labels in the chosen language
 //
 document.addEventListener("DOMContentLoaded", () => {
-  const langSpanContainers = new Set(Array.from(document.querySelectorAll("span[lang]")).map(span => span.parentElement));
+  const selector = document.querySelector("nav div.lang_selector > div");
+  if (!selector)
+    return;
 
   function switchToLanguage(targetLang) {
-    for (container of langSpanContainers) {
-      const spans = Array.from(container.querySelectorAll("span"));
-
-      const tryToShowSpansWith = (targetLang) => {
-        const matchingSpans = spans.filter(span => span.getAttribute("lang") === targetLang);
-        if (matchingSpans.length > 0) {
-          matchingSpans.forEach(span => span.style.display = "initial");
-          spans.filter(span => span.getAttribute("lang") != targetLang).forEach(span => span.style.display = "none");
-          return true;
-        } else {
-          return false;
-        }
-      };
-
-      if (targetLang == "all") {
-        spans.forEach(span => span.style.display = "initial");
-        continue;
-      }
-
-      // show spans with matching lang tag
-      if (tryToShowSpansWith(targetLang))
-        continue;
-      // if empty: show spans with lang "en"
-      if (tryToShowSpansWith("en"))
-        continue;
-      // if empty: show spans without lang attribute
-      if (tryToShowSpansWith(null))
-        continue;
-
-      // if empty: show all spans
-      spans.forEach(span => span.style.display = "initial");
-    }
+    setCookie("lang", targetLang);
+    window.location.reload();
+  }
 
-    localStorage.setItem("language", targetLang);
+  // the language used to be chosen in the browser only
+  const storedLang = localStorage.getItem("language");
+  if (storedLang) {
+    localStorage.removeItem("language");
+    if (getCookie("lang") === null && storedLang !== "all") {
+      switchToLanguage(storedLang);
+      return;
+    }
   }
 
   // Create language switcher links
-  const allLangs = new Set(Array.from(document.querySelectorAll("span[lang]")).map(span => span.getAttribute("lang")))
-  for (let lang of Array.from(allLangs).sort()) {
+  const pageLangs = Array.from(document.querySelectorAll("span[lang]")).map(span => span.getAttribute("lang"));
+  const allLangs = new Set([...pageLangs, ...(typeof label_languages === "undefined" ? [] : label_languages)]);
+  for (let lang of [...Array.from(allLangs).sort(), "all"]) {
     const a = document.createElement("a");
     a.setAttribute("href", "#");
-    a.setAttribute("lang", lang);
+    if (lang !== "all")
+      a.setAttribute("lang", lang);
     a.textContent = lang;
 
     a.addEventListener("click", event => {
@@ -73,71 +72,112 @@ document.addEventListener("DOMContentLoaded", () => {
       event.preventDefault();
     });
 
-    document.querySelector("nav div.lang_selector > div").append(a);
+    selector.append(a);
   }
+});
 
-  const a = document.createElement("a");
-  a.setAttribute("href", "#");
-  a.textContent = "all";
 
-  a.addEventListener("click", event => {
-    switchToLanguage("all");
-    event.preventDefault();
-  });
+//
+// Hiding graphs, hidden graphs are left out by the server and listed in the nav
+//
+document.addEventListener("DOMContentLoaded", () => {
+  function hiddenGraphs() {
+    const cookie = getCookie("hide_graphs");
+    if (cookie === null)
+      return typeof hidden_graphs === "undefined" ? [] : hidden_graphs;
+    return cookie === "none" ? [] : cookie.split(",");
+  }
 
-  document.querySelector("nav div.lang_selector > div").append(a);
+  function setHiddenGraphs(graphs) {
+    setCookie("hide_graphs", graphs.length > 0 ? graphs.join(",") : "none");
+  }
 
-  // Switch to stored language
-  if (localStorage.getItem("language"))
-    switchToLanguage(localStorage.getItem("language"));
-});
+  // the graphs used to be hidden in the browser only
+  const graph_preference = localStorage.getItem("graph_preference");
+  if (graph_preference) {
+    localStorage.removeItem("graph_preference");
+    try {
+      const hidden = Object.entries(JSON.parse(graph_preference)).filter(([_, shown]) => !shown).map(([graph, _]) => graph);
+      if (getCookie("hide_graphs") === null && hidden.length > 0)
+        setHiddenGraphs(Array.from(new Set([...hiddenGraphs(), ...hidden])));
+    } catch (error) {
+      // an empty or invalid preference, there is nothing to keep
+    }
+  }
 
+  for (const a_graph of document.querySelectorAll("a.graph_toggle")) {
+    a_graph.textContent = "hide";
+    a_graph.addEventListener("click", event => {
+      const graph = a_graph.dataset.graph;
+      const graphs = hiddenGraphs();
+      if (!graphs.includes(graph))
+        setHiddenGraphs([...graphs, graph]);
+      event.target.closest("div").style["display"] = "none";
+      event.preventDefault();
+    });
+  }
 
-document.addEventListener("DOMContentLoaded", () => {
-  let graphs = new Set(Array.from(document.querySelectorAll("h2.graph > a > span")).map(span => span));
-
-  let graph_preference = localStorage.getItem("graph_preference");
-  if (!graph_preference) {
-    localStorage.setItem("graph_preference", []);
-    graph_preference = {};
-  } else {
-    graph_preference = JSON.parse(graph_preference);
+  for (const a_show of document.querySelectorAll("nav a.show_graph")) {
+    a_show.addEventListener("click", event => {
+      setHiddenGraphs(hiddenGraphs().filter(graph => graph !== a_show.dataset.graph));
+      window.location.reload();
+      event.preventDefault();
+    });
   }
+});
 
-  // create graph menu and update graph_preference
-  for (const graph of graphs) {
-    if (!(graph.textContent in graph_preference)) {
-      if (nsfw_graphs.includes(graph.textContent)) {
-        graph_preference[graph.textContent] = false;
-      } else {
-        graph_preference[graph.textContent] = true;
-      }
-    }
 
-    if (!graph_preference[graph.textContent]) {
-      graph.closest("div").querySelector("table").style["display"] = "none";
-      const a_graph = graph.closest("div").querySelector("a.graph_toggle");
-      a_graph.textContent = "show";
-      a_graph.classList.add("hide");
-    } else {
-      graph.closest("div").querySelector("a.graph_toggle").textContent = "hide";
+//
+// Load more back-links of paginated predicates
+//
+document.addEventListener("DOMContentLoaded", () => {
+  function createLabelSpans(parent, labels) {
+    for (const label of labels) {
+      const span = document.createElement("span");
+      if (label.lang)
+        span.setAttribute("lang", label.lang);
+      span.textContent = label.label;
+      parent.append(span);
     }
   }
 
-  const a_graphs = Array.from(document.querySelectorAll("a.graph_toggle"));
-  a_graphs.map(a => a.addEventListener("click", event => {
-    const graph = event.target.closest("div").querySelector("h2 a:nth-of-type(1)").textContent.trim();
-    const a_hide = event.target.classList.toggle("hide");
-    if (a_hide) {
-      event.target.closest("div").querySelector("table").style["display"] = "none";
-      event.target.textContent = "show";
-      graph_preference[graph] = false;
-    } else {
-      event.target.closest("div").querySelector("table").style["display"] = "table";
-      event.target.textContent = "hide";
-      graph_preference[graph] = true;
-    }
-    localStorage.setItem("graph_preference", JSON.stringify(graph_preference));
-    event.preventDefault();
-  }))
+  for (const a_more of document.querySelectorAll("a.more_back_links")) {
+    a_more.addEventListener("click", event => {
+      event.preventDefault();
+      const params = new URLSearchParams({
+        resource: resource_uri,
+        graph: a_more.dataset.graph,
+        predicate: a_more.dataset.predicate,
+        offset: a_more.dataset.offset
+      });
+
+      fetch(`/applications/get_back_links?${params}`, {headers: {"Accept": "application/json"}})
+        .then(response => {
+          if (!response.ok)
+            throw new Error("Network response was not ok");
+          return response.json();
+        })
+        .then(data => {
+          const ul = a_more.previousElementSibling;
+          for (const item of data["items"]) {
+            const li = document.createElement("li");
+            if (item.uri) {
+              const a = document.createElement("a");
+              a.setAttribute("href", item.uri);
+              createLabelSpans(a, item.labels);
+              li.append(a);
+            } else {
+              createLabelSpans(li, item.labels);
+            }
+            ul.append(li);
+          }
+
+          if (data["next_offset"] === null)
+            a_more.remove();
+          else
+            a_more.dataset.offset = data["next_offset"];
+        })
+        .catch(error => console.error("There was a problem with the fetch operation:", error));
+    });
+  }
 });
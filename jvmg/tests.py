@@ -1,3 +1,1920 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib
+import itertools
+import json
+import os
+import re
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from elasticsearch import NotFoundError
+from rdflib import BNode, ConjunctiveGraph, Dataset, Literal, URIRef, Variable, XSD
+from rdflib.compare import isomorphic
+from rdflib.plugins.sparql.algebra import translateQuery
+from rdflib.plugins.sparql.parser import parseQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+from SPARQLWrapper import JSON, JSONLD, TURTLE, XML
+
+from . import (back_links, batch, breaker, cache, clients, conditional, crosstab, elastic, endpoints, label_snapshot,
+               fast_render, labels, nquads,
+               overview_snapshot, query_plan, result_store, sparql, timing, views)
+from .breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, EndpointUnavailable
+from .index import TripleIndex
+from .management.commands import benchmark_renderer
+from .result_store import ResultStore
+from .selection import EVERYTHING, Selection
+
+RDFS_LABEL = URIRef("http://www.w3.org/2000/01/rdf-schema#label")
+
+
+def crosstab_result(rows: list[tuple[str, str, int]]) -> bytes:
+    """a json result of QUERY_CROSSTAB with (property, value uri, count) rows"""
+    return json.dumps({"results": {"bindings": [
+        {"property": {"type": "uri", "value": property},
+         "value": {"type": "uri", "value": value},
+         "count": {"type": "literal", "value": str(count)}}
+        for property, value, count in rows
+    ]}}).encode("utf-8")
+
+
+def template_quads(node: CompValue, graph=None):
+    """the (graph, triple) patterns of a parsed graph pattern"""
+    if node.name == "BGP":
+        for triple in node.triples:
+            yield graph, triple
+    elif node.name == "Graph":
+        yield from template_quads(node.p, node.term)
+    else:
+        for value in node.values():
+            if isinstance(value, CompValue):
+                yield from template_quads(value, graph)
+
+
+def construct(dataset: Dataset, query: str) -> bytes:
+    """
+    evaluates a CONSTRUCT query with GRAPH blocks in its template (like the endpoint does,
+    rdflib only parses triples there) and returns the result as N-Quads
+    """
+    head, pattern = re.split(r"\bwhere\b", query, maxsplit=1, flags=re.IGNORECASE)
+    prologue, template = re.split(r"\bCONSTRUCT\b", head, maxsplit=1, flags=re.IGNORECASE)
+    quads = list(template_quads(translateQuery(parseQuery(prologue + "SELECT * WHERE " + template)).algebra))
+    result = Dataset()
+    for row in dataset.query(prologue + "SELECT * WHERE " + pattern):
+        bindings = row.asdict()
+        for graph, triple in quads:
+            graph, *triple = (bindings.get(str(term)) if isinstance(term, Variable) else term for term in (graph, *triple))
+            if None not in triple and not isinstance(triple[0], Literal):
+                result.add((*triple, result.graph(graph) if graph is not None else result.default_context))
+    return result.serialize(format="nquads", encoding="utf-8")
+
+
+class SingleFlightTests(SimpleTestCase):
+    async def test_concurrent_calls_compute_once(self):
+        computed = []
+
+        async def compute():
+            computed.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*(cache.single_flight("key", compute) for _ in range(5)))
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(cache._in_flight, {})
+
+    async def test_exceptions_reach_every_waiter(self):
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(*(cache.single_flight("key", compute) for _ in range(3)),
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        # the next call computes again
+        self.assertEqual(await cache.single_flight("key", mock.AsyncMock(return_value="value")), "value")
+
+    async def test_cancelled_waiter_leaves_the_computation_running(self):
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return "value"
+
+        leader = asyncio.create_task(cache.single_flight("key", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.single_flight("key", compute))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        self.assertEqual(await leader, "value")
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+    async def test_cancelled_leader_cancels_the_waiters(self):
+        async def compute():
+            await asyncio.sleep(10)
+
+        leader = asyncio.create_task(cache.single_flight("key", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.single_flight("key", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        for task in (leader, waiter):
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertEqual(cache._in_flight, {})
+
+
+def current_store_version() -> str:
+    """the DATASET_VERSION of the result stores in ResultStoreTests"""
+    return ResultStoreTests.version
+
+
+class ClientTests(SimpleTestCase):
+    def test_clients_are_shared_by_a_loop_and_closed_with_it(self):
+        async def use():
+            await asyncio.sleep(0)
+            return clients.sparql_client("http://example.org/sparql"), clients.elasticsearch_client()
+
+        async def request():
+            # concurrent requests of one loop share the clients
+            (sparql_client, es), (other_sparql_client, other_es) = await asyncio.gather(use(), use())
+            self.assertIs(sparql_client, other_sparql_client)
+            self.assertIs(es, other_es)
+            return sparql_client, es
+
+        with mock.patch.object(clients.elasticsearch.AsyncElasticsearch, "close", mock.AsyncMock()) as close:
+            # like a WSGI request, each one in an event loop of its own
+            first, _ = asyncio.run(request())
+            second, _ = asyncio.run(request())
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed and second.is_closed)
+        self.assertEqual(close.await_count, 2)
+        self.assertEqual(len(clients._clients), 0)
+
+
+class ResultStoreTests(SimpleTestCase):
+    version = "1"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "store.sqlite3")
+        self.now = 1000.0
+        clock = mock.patch.object(result_store.time, "time", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def store(self, **options) -> ResultStore:
+        return ResultStore(self.path, {"TIMEOUT": None, "OPTIONS": {
+            "DATASET_VERSION": "jvmg.tests.current_store_version", **options}})
+
+    def rows(self, store: ResultStore) -> tuple[int, int]:
+        return store._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+    def totals(self, store: ResultStore) -> tuple[int, int]:
+        return store._connection().execute("SELECT entries, bytes FROM totals").fetchone()
+
+    def test_replaced_entries_keep_the_totals(self):
+        store = self.store()
+        store.set("a", "x")
+        store.set("a", "x" * 1000)
+        store.set_many({"b": 1, "c": 2})
+        store.delete("c")
+        self.assertEqual(self.totals(store), self.rows(store))
+        self.assertEqual(self.totals(store)[0], 2)
+
+    def test_entries_of_another_dataset_version_are_misses(self):
+        store = self.store()
+        store.set("a", "old")
+        new_version = mock.patch.object(ResultStoreTests, "version", "2")
+        new_version.start()
+        self.addCleanup(new_version.stop)
+        self.assertIsNone(store.get("a"))
+        self.assertFalse(store.has_key("a"))
+        self.assertEqual(store.get_many(["a"]), {})
+        self.assertTrue(store.add("a", "new"))
+        self.assertEqual(store.get("a"), "new")
+
+        store.set("b", "new")
+        # the old entries were deleted with the first write of the new version
+        self.assertEqual(self.rows(store)[0], 2)
+        self.assertEqual(self.totals(store), self.rows(store))
+
+    def test_least_recently_read_entries_are_evicted(self):
+        store = self.store(MAX_ENTRIES=10)
+        for i in range(10):
+            self.now += 100
+            store.set(f"k{i}", i)
+        self.now += 100
+        self.assertEqual(store.get("k0"), 0)
+        self.now += 100
+        # 11 entries, the store is culled to 90% of MAX_ENTRIES
+        store.set("k10", 10)
+        self.assertEqual(self.totals(store), self.rows(store))
+        self.assertEqual(self.totals(store)[0], 9)
+        self.assertEqual(store.get("k0"), 0)
+        self.assertIsNone(store.get("k1"))
+        self.assertIsNone(store.get("k2"))
+        self.assertEqual(store.get("k3"), 3)
+
+    def test_evicted_for_max_bytes(self):
+        store = self.store(MAX_BYTES=10000)
+        for i in range(10):
+            self.now += 100
+            store.set(f"k{i}", os.urandom(1500))
+        entries, size = self.totals(store)
+        self.assertLessEqual(size, 10000)
+        self.assertEqual((entries, size), self.rows(store))
+        self.assertIsNone(store.get("k0"))
+        self.assertIsNotNone(store.get("k9"))
+
+    def test_get_and_set(self):
+        store = self.store()
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(store.get("a", "default"), "default")
+        store.set("a", {"value": [1, 2]})
+        store.set_many({"b": "x", "c": None})
+        self.assertEqual(store.get("a"), {"value": [1, 2]})
+        self.assertEqual(store.get_many(["a", "b", "c", "d"]), {"a": {"value": [1, 2]}, "b": "x", "c": None})
+        self.assertFalse(store.add("a", "other"))
+        self.assertTrue(store.has_key("c"))
+        store.delete("a")
+        self.assertFalse(store.has_key("a"))
+
+    def test_expired_entries_are_misses(self):
+        store = self.store()
+        store.set("a", 1, timeout=10)
+        self.now += 11
+        self.assertIsNone(store.get("a"))
+        self.assertFalse(store.has_key("a"))
+
+    def test_async_reads_open_the_connection_and_decode_big_values_off_the_loop(self):
+        self.store().set_many({"small": "x", "big": os.urandom(result_store.DECODE_INLINE_BYTES * 2)})
+        store = self.store()
+        threads = {}
+        original_open, original_decode = store._open, store._decode_many
+
+        def recording(name, function):
+            def call(*args):
+                threads.setdefault(name, set()).add(threading.get_ident())
+                return function(*args)
+            return call
+
+        async def read():
+            threads["loop"] = threading.get_ident()
+            with mock.patch.object(store, "_open", recording("open", original_open)), \
+                    mock.patch.object(store, "_decode_many", recording("decode", original_decode)):
+                small = await store.aget("small")
+                threads["small"] = set(threads.pop("decode"))
+                big = await store.aget_many(["big"])
+                return small, big
+
+        small, big = asyncio.run(read())
+        self.assertEqual(small, "x")
+        self.assertEqual(len(big["big"]), result_store.DECODE_INLINE_BYTES * 2)
+        loop = threads["loop"]
+        self.assertNotIn(loop, threads["open"])
+        self.assertEqual(threads["small"], {loop})
+        self.assertNotIn(loop, threads["decode"])
+
+    def test_async_writes(self):
+        store = self.store()
+
+        async def write():
+            await store.aset("a", 1)
+            await store.aset_many({"b": 2})
+            return await store.aget_many(["a", "b"]), await store.ahas_key("c")
+
+        self.assertEqual(asyncio.run(write()), ({"a": 1, "b": 2}, False))
+
+    def test_the_schema_is_created_once_per_process(self):
+        store = self.store()
+        store.set("a", 1)
+        connections = []
+        # the connections of other threads would fail running it
+        with mock.patch.object(result_store, "SCHEMA", "invalid sql"):
+            thread = threading.Thread(target=lambda: connections.append(store._connection()))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(connections), 1)
+        self.assertIsNot(connections[0], store._connection())
+
+    def test_concurrent_writers(self):
+        # several workers (stores on the same file) with several threads each
+        stores = [self.store(MAX_ENTRIES=100) for _ in range(3)]
+        errors = []
+        ticks = itertools.count(self.now, 100)
+        clock = mock.patch.object(result_store.time, "time", lambda: next(ticks))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+        def write(store: ResultStore, worker: int):
+            try:
+                for i in range(60):
+                    store.set(f"{worker}-{i}", os.urandom(100))
+                    store.get(f"{worker}-{i // 2}")
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=write, args=(store, number * 2 + thread))
+                   for number, store in enumerate(stores) for thread in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        entries, _ = self.totals(stores[0])
+        self.assertEqual(self.totals(stores[0]), self.rows(stores[0]))
+        self.assertLessEqual(entries, 100)
+        # no entry was lost or broken by the writes of the others
+        values = stores[0].get_many(f"{worker}-{i}" for worker in range(6) for i in range(60))
+        self.assertEqual(len(values), entries)
+        self.assertTrue(all(len(value) == 100 for value in values.values()))
+
+
+class TripleIndexTests(SimpleTestCase):
+    VNDB, ANIDB = URIRef("http://mediagraph.link/graph/vndb"), URIRef("http://mediagraph.link/graph/anidb")
+    ITEM, TAG = URIRef("http://mediagraph.link/vn/1"), URIRef("http://mediagraph.link/tag/1")
+    P = URIRef("http://example.org/p")
+
+    def graph(self) -> ConjunctiveGraph:
+        graph = ConjunctiveGraph()
+        release = BNode()
+        for context in (self.VNDB, self.ANIDB):
+            graph.get_context(context).add((self.ITEM, URIRef("http://example.org/tag"), self.TAG))
+            graph.get_context(context).add((self.ITEM, RDFS_LABEL, Literal("Clannad", lang="en")))
+        vndb = graph.get_context(self.VNDB)
+        vndb.add((self.ITEM, RDFS_LABEL, Literal("")))
+        vndb.add((self.ITEM, self.P, Literal("1")))
+        vndb.add((self.ITEM, self.P, Literal(1)))
+        vndb.add((self.ITEM, URIRef("http://example.org/release"), release))
+        vndb.add((release, URIRef("http://example.org/date"), Literal("2004")))
+        vndb.add((URIRef("http://mediagraph.link/vn/2"), URIRef("http://example.org/tag"), self.TAG))
+        graph.get_context(self.ANIDB).add((release, URIRef("http://example.org/platform"), URIRef("http://example.org/pc")))
+        graph.add((self.VNDB, URIRef("http://mediagraph.link/jvmg/ont/shortLabel"), Literal("vndb")))
+        return graph
+
+    def test_same_lookups_as_rdflib(self):
+        graph = self.graph()
+        index = TripleIndex.from_graph(graph)
+        # the triples in both graphs are counted twice
+        self.assertEqual(index.size, len(list(graph.quads())))
+        self.assertEqual(set(index.contexts()), {context.identifier for context in graph.contexts()})
+        for context in graph.contexts():
+            identifier = context.identifier
+            for node in set(context.subjects()) | set(context.objects()):
+                self.assertEqual(set(index.predicates(identifier, node)), set(context.predicates(subject=node)))
+                if not isinstance(node, Literal):
+                    self.assertEqual(set(index.back_link_predicates(identifier, node)),
+                                     set(context.predicates(object=node)))
+                for predicate in set(context.predicates()):
+                    objects = index.objects(identifier, node, predicate)
+                    self.assertEqual(sorted(objects), sorted(context.objects(node, predicate)))
+                    if not isinstance(node, Literal):
+                        self.assertEqual(sorted(index.subjects(identifier, node, predicate)),
+                                         sorted(context.subjects(predicate, node)))
+        # blank nodes over all graphs
+        [release] = {node for node in graph.subjects() if isinstance(node, BNode)}
+        self.assertEqual(index.by_subject[release], {predicate: [object] for predicate, object in
+                                                     graph.predicate_objects(release)})
+        self.assertEqual(index.uris(), {node for quad in graph.quads() for node in quad
+                                        if isinstance(node, URIRef)} | {self.VNDB, self.ANIDB})
+
+    def test_labels_of_all_graphs_once(self):
+        index = TripleIndex.from_graph(self.graph())
+        # the same label in two graphs, the empty label is left out
+        self.assertEqual(index.labels_for(self.ITEM, [RDFS_LABEL]), [Literal("Clannad", lang="en")])
+        self.assertEqual(index.labels_for(self.VNDB, [URIRef("http://mediagraph.link/jvmg/ont/shortLabel")]),
+                         [Literal("vndb")])
+        # equal literals with other datatypes are other objects
+        self.assertEqual(len(index.objects(self.VNDB, self.ITEM, self.P)), 2)
+
+        index.add_labels({self.ITEM: {RDFS_LABEL: [Literal("Clannad", lang="en"), Literal("クラナド", lang="ja")]},
+                          self.TAG: {RDFS_LABEL: [Literal("drama")]}})
+        self.assertEqual(index.labels_for(self.ITEM, [RDFS_LABEL]),
+                         [Literal("Clannad", lang="en"), Literal("クラナド", lang="ja")])
+        self.assertEqual(index.labels_for(self.TAG, [RDFS_LABEL]), [Literal("drama")])
+
+    def test_same_index_as_the_nquads_parser(self):
+        graph = self.graph()
+        data = graph.serialize(format="nquads", encoding="utf-8")
+        ours = TripleIndex(nquads.parse(data, URIRef("urn:x-rdflib:default")))
+        theirs = TripleIndex.from_graph(graph)
+        self.assertEqual(ours.size, theirs.size)
+        self.assertEqual(set(ours.contexts()) - {URIRef("urn:x-rdflib:default")},
+                         set(theirs.contexts()) - {URIRef("urn:x-rdflib:default")})
+        for context in (self.VNDB, self.ANIDB):
+            self.assertEqual({(s, p, frozenset(o)) for s, by_p in ours.forward[context].items()
+                              for p, o in by_p.items() if not isinstance(s, BNode)},
+                             {(s, p, frozenset(o)) for s, by_p in theirs.forward[context].items()
+                              for p, o in by_p.items() if not isinstance(s, BNode)})
+
+
+class InfosTests(SimpleTestCase):
+    ITEM, OTHER = URIRef("http://mediagraph.link/vn/1"), URIRef("http://mediagraph.link/vn/2")
+    GRAPH = URIRef("http://mediagraph.link/graph/vndb")
+    GRAPH_LABEL = URIRef("http://mediagraph.link/jvmg/ont/shortLabel")
+
+    def setUp(self):
+        for name, value in (("DATASET_BASE", "http://mediagraph.link/"), ("WEB_BASE", "http://localhost:8000/")):
+            patch = mock.patch.object(views, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        # nothing is taken from the snapshot of the worker
+        patch = mock.patch.object(label_snapshot, "labels_for", return_value=None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def infos(self, selection=EVERYTHING) -> views.Infos:
+        graph = ConjunctiveGraph()
+        context = graph.get_context(self.GRAPH)
+        for uri in (self.ITEM, self.OTHER):
+            context.add((uri, RDFS_LABEL, Literal("Clannad", lang="en")))
+        context.add((self.ITEM, RDFS_LABEL, Literal("クラナド", lang="ja")))
+        context.add((self.GRAPH, RDFS_LABEL, Literal("the vndb graph")))
+        graph.add((self.GRAPH, self.GRAPH_LABEL, Literal("vndb")))
+        return views.Infos(TripleIndex.from_graph(graph), selection)
+
+    def test_rewrite_url(self):
+        self.assertEqual(views.rewrite_url("http://mediagraph.link/vn/1"), "http://localhost:8000/vn/1")
+        self.assertEqual(views.rewrite_url("http://example.org/vn/1"), "http://example.org/vn/1")
+
+    def test_nodes_are_resolved_once(self):
+        infos = self.infos()
+        with mock.patch.object(views.Infos, "create", autospec=True, side_effect=views.Infos.create) as create:
+            first = infos(self.ITEM)
+            self.assertIs(infos(URIRef(str(self.ITEM))), first)
+            self.assertIs(infos.graph(self.GRAPH), infos.graph(self.GRAPH))
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(first.uri, "http://localhost:8000/vn/1")
+        self.assertEqual([str(label) for label in first.labels], ["Clannad", "クラナド"])
+        self.assertEqual(first.sort_key, "Clannadクラナド")
+        # equal labels of other nodes are the same object
+        self.assertIs(infos(self.OTHER).labels[0], first.labels[0])
+
+    def test_graphs_have_their_own_labels(self):
+        infos = self.infos()
+        self.assertEqual(infos.graph(self.GRAPH).labels, (views.Label("vndb", ""),))
+        self.assertEqual(infos(self.GRAPH).labels, (views.Label("the vndb graph", ""),))
+
+    def test_nodes_without_labels(self):
+        infos = self.infos()
+        unlabelled, blank, literal = (infos(node) for node in (
+            URIRef("http://example.org/x"), BNode("b1"), Literal("text", lang="de")))
+        self.assertEqual((unlabelled.uri, unlabelled.labels), ("http://example.org/x",
+                                                                (views.Label("http://example.org/x", ""),)))
+        self.assertEqual((blank.uri, blank.labels), (None, (views.Label("b1", ""),)))
+        self.assertEqual((literal.uri, literal.labels), (None, (views.Label("text", "de"),)))
+
+    def test_labels_of_the_snapshot_and_the_selection(self):
+        with mock.patch.object(label_snapshot, "labels_for", return_value=[Literal("from the snapshot")]):
+            self.assertEqual(self.infos()(self.ITEM).labels, (views.Label("from the snapshot", ""),))
+        japanese = Selection(hidden_graphs=frozenset(), languages=("ja",))
+        self.assertEqual(self.infos(japanese)(self.ITEM).labels, (views.Label("クラナド", "ja"),))
+
+
+class NQuadsTests(SimpleTestCase):
+    DEFAULT = URIRef("urn:x-rdflib:default")
+
+    def graph(self) -> ConjunctiveGraph:
+        graph = ConjunctiveGraph()
+        vndb = graph.get_context(URIRef("http://mediagraph.link/graph/vndb"))
+        item, release = URIRef("http://mediagraph.link/vn/1"), BNode()
+        vndb.add((item, RDFS_LABEL, Literal("Clannad", lang="en")))
+        vndb.add((item, RDFS_LABEL, Literal("クラナド", lang="ja-Jpan")))
+        vndb.add((item, URIRef("http://example.org/quote"), Literal('a "quoted"\ttab\nnewline\\ and \u2028')))
+        vndb.add((item, URIRef("http://example.org/count"), Literal(5)))
+        vndb.add((item, URIRef("http://example.org/date"), Literal("2004", datatype=XSD.gYear)))
+        vndb.add((item, URIRef("http://example.org/release"), release))
+        vndb.add((release, URIRef("http://example.org/url"), URIRef("http://example.org/a%20b?c=d#e")))
+        anidb = graph.get_context(URIRef("http://mediagraph.link/graph/anidb"))
+        anidb.add((release, RDFS_LABEL, Literal("")))
+        return graph
+
+    def parse_all(self, *documents: bytes) -> ConjunctiveGraph:
+        graph = ConjunctiveGraph()
+        for s, p, o, g in nquads.parse_all(documents, self.DEFAULT):
+            graph.get_context(g).add((s, p, o))
+        return graph
+
+    def assert_same_quads(self, ours: ConjunctiveGraph, theirs: ConjunctiveGraph):
+        self.assertEqual({context.identifier for context in ours.contexts()},
+                         {context.identifier for context in theirs.contexts() if len(context)})
+        # blank nodes shared by the graphs are compared by comparing the union, too
+        self.assertTrue(isomorphic(ours, theirs))
+        for context in ours.contexts():
+            self.assertTrue(isomorphic(context, theirs.get_context(context.identifier)), context.identifier)
+
+    def test_same_quads_as_rdflib(self):
+        data = self.graph().serialize(format="nquads", encoding="utf-8")
+        theirs = ConjunctiveGraph()
+        theirs.parse(data=data, format="nquads")
+        self.assert_same_quads(self.parse_all(data), theirs)
+
+    def test_results_of_a_page_share_their_blank_nodes(self):
+        lines = self.graph().serialize(format="nquads", encoding="utf-8").splitlines(keepends=True)
+        half = len(lines) // 2
+        ours = self.parse_all(b"".join(lines[:half]), b"# comment\n\n" + b"".join(lines[half:]))
+        self.assertEqual(len({o for o in ours.objects() if isinstance(o, BNode)} |
+                             {s for s in ours.subjects() if isinstance(s, BNode)}), 1)
+        self.assert_same_quads(ours, self.graph())
+
+    def test_triples_are_in_the_default_graph(self):
+        data = b'<http://example.org/a> <http://example.org/p> "x"@en .\n'
+        self.assertEqual(list(nquads.parse(data, self.DEFAULT)),
+                         [(URIRef("http://example.org/a"), URIRef("http://example.org/p"), Literal("x", lang="en"),
+                           self.DEFAULT)])
+
+    def test_invalid_lines(self):
+        with self.assertRaises(nquads.ParseError):
+            list(nquads.parse(b'<http://example.org/a> <http://example.org/p> .\n', self.DEFAULT))
+
+    def test_escapes(self):
+        data = (rb'<http://example.org/\u00e9> <http://example.org/p> "caf\u00E9 \U0001F600 \"q\" \\n \r\n" .' b"\n"
+                rb'<http://example.org/a> <http://example.org/p> "line\u2028separator" .' b"\n")
+        [(subject, _, first, _), (_, _, second, _)] = nquads.parse(data, self.DEFAULT)
+        self.assertEqual(subject, URIRef("http://example.org/\u00e9"))
+        self.assertEqual(first, Literal('caf\u00e9 \U0001F600 "q" \\n \r\n'))
+        self.assertEqual(second, Literal("line\u2028separator"))
+
+    def test_unescaped_line_separators_and_crlf(self):
+        data = '<http://example.org/a> <http://example.org/p> "a\u2028b\u0085c" .\r\n'.encode("utf-8")
+        [(_, _, literal, _)] = nquads.parse(data, self.DEFAULT)
+        self.assertEqual(literal, Literal("a\u2028b\u0085c"))
+
+    def test_comments_datatypes_and_graphs(self):
+        data = (b"# a comment\n"
+                b"   \n"
+                b'<http://example.org/a> <http://example.org/p> "5"^^<http://www.w3.org/2001/XMLSchema#integer> . # 5\n'
+                b'_:b <http://example.org/p> "x"@en-Latn-US _:g .\n'
+                b'_:b <http://example.org/p> <http://example.org/o> <http://example.org/g> .')
+        quads = list(nquads.parse(data, self.DEFAULT))
+        self.assertEqual([quad[2] for quad in quads],
+                         [Literal(5), Literal("x", lang="en-Latn-US"), URIRef("http://example.org/o")])
+        self.assertEqual([type(quad[3]) for quad in quads], [URIRef, BNode, URIRef])
+        self.assertEqual(quads[0][3], self.DEFAULT)
+        self.assertEqual(quads[2][3], URIRef("http://example.org/g"))
+
+    def test_terms_are_shared(self):
+        data = (b'<http://example.org/a> <http://example.org/p> "x" _:g .\n'
+                b'<http://example.org/a> <http://example.org/p> "x" _:g .\n')
+        first, second = nquads.parse(data, self.DEFAULT)
+        self.assertTrue(all(a is b for a, b in zip(first, second)))
+        # results parsed separately share nothing, results of the same page (parse_all) do
+        [other] = nquads.parse(data.split(b"\n")[0], self.DEFAULT)
+        self.assertIsNot(other[0], first[0])
+        quads = list(nquads.parse_all([data, data], self.DEFAULT))
+        self.assertTrue(all(a is b for a, b in zip(quads[0], quads[3])))
+
+    def test_invalid_lines_are_reported_with_their_number(self):
+        for line in (b'<http://example.org/a> <http://example.org/p> "x"',
+                     b'<http://example.org/a> <http://example.org/p> "x .',
+                     b'"x" <http://example.org/p> <http://example.org/o> .',
+                     b'<http://example.org/a> _:p <http://example.org/o> .',
+                     b'<http://example.org/a> <http://example.org/p> <http://example.org/o> "g" .'):
+            with self.subTest(line=line), self.assertRaisesRegex(nquads.ParseError, "line 2"):
+                list(nquads.parse(b"# comment\n" + line, self.DEFAULT))
+
+
+class FakeElasticsearch:
+    """answers the searches of elastic.cursor_page and elastic.page from documents, sorted like elastic.SORT"""
+
+    def __init__(self, documents: int):
+        self.hits = [{"_source": {"label": f"doc {i}"}, "sort": [1.0 / (i + 1), i]} for i in range(documents)]
+        self.searches: list[dict] = []
+        self.opened = 0
+        self.closed: list[str] = []
+
+    async def open_point_in_time(self, index, keep_alive):
+        self.opened += 1
+        return {"id": "pit-0"}
+
+    async def close_point_in_time(self, id):
+        self.closed.append(id)
+
+    async def search(self, query, size, pit=None, sort=None, search_after=None, highlight=None, aggregations=None,
+                     index=None, from_=0):
+        self.searches.append({"pit": pit and pit["id"], "search_after": search_after, "aggregations": aggregations})
+        after = [hit for hit in self.hits if search_after is None or hit["sort"][1] > search_after[1]]
+        response = {"hits": {"total": {"value": len(self.hits)}, "hits": after[from_:from_ + size]}}
+        if pit is not None:
+            # the id of a point in time may change with every search
+            response["pit_id"] = f"pit-{len(self.searches)}"
+        if aggregations:
+            response["aggregations"] = {"type": {"buckets": [{"key": "vn", "doc_count": len(self.hits)}]}}
+        return response
+
+
+@override_settings(ELASTICSEARCH_PAGE_SIZE=2, SEARCH_FACET_CACHE=None)
+class CursorPageTests(SimpleTestCase):
+    async def pages(self, documents: int) -> tuple[FakeElasticsearch, list[dict]]:
+        es = FakeElasticsearch(documents)
+        pages, cursor = [], None
+        with mock.patch.object(elastic, "elasticsearch_client", return_value=es):
+            while True:
+                pages.append(await elastic.cursor_page("sakura", "match", {}, cursor))
+                cursor = pages[-1]["cursor"]
+                if cursor is None:
+                    return es, pages
+
+    async def test_pages_continue_after_the_last_hit(self):
+        es, pages = await self.pages(5)
+        self.assertEqual([[hit["label"] for hit in page["hits"]] for page in pages],
+                         [["doc 0", "doc 1"], ["doc 2", "doc 3"], ["doc 4"]])
+        self.assertEqual([search["search_after"] for search in es.searches], [None, [0.5, 1], [0.25, 3]])
+        # every search uses the latest id of the point in time, the last one closes it
+        self.assertEqual([search["pit"] for search in es.searches], ["pit-0", "pit-1", "pit-2"])
+        self.assertEqual((es.opened, es.closed), (1, ["pit-3"]))
+        self.assertEqual(pages[0]["facets"], {"type": {"vn": 5}})
+        self.assertEqual([search["aggregations"] is not None for search in es.searches], [True, False, False])
+
+    async def test_last_full_page(self):
+        es, pages = await self.pages(4)
+        self.assertEqual([len(page["hits"]) for page in pages], [2, 2, 0])
+        self.assertEqual(es.closed, ["pit-3"])
+
+    def test_cursor_round_trip(self):
+        cursor = elastic.encode_cursor("pit", [1.5, 7])
+        self.assertEqual(elastic.decode_cursor(cursor), ("pit", [1.5, 7]))
+        for invalid in ("", "not base64!", elastic.encode_cursor("pit", [])[:-4], "e30="):
+            with self.assertRaises(elastic.InvalidCursor):
+                elastic.decode_cursor(invalid)
+
+    def test_cursors_are_url_safe(self):
+        for pit_id, search_after in (("a+b/c==", [0.1, 2]), ("ピット", ["ü", None]), ("pit", [])):
+            cursor = elastic.encode_cursor(pit_id, search_after)
+            self.assertRegex(cursor, r"^[A-Za-z0-9_=-]+$")
+            self.assertEqual(elastic.decode_cursor(cursor), (pit_id, search_after))
+        # valid json, but not a cursor
+        for data in (b'[]', b'{"pit": 1, "after": []}', b'{"pit": "pit", "after": {}}', b'{"pit": "pit"}'):
+            with self.assertRaises(elastic.InvalidCursor):
+                elastic.decode_cursor(base64.urlsafe_b64encode(data).decode("ascii"))
+
+    async def request(self, es: FakeElasticsearch, cursor) -> tuple[int, dict]:
+        body = {"search": "sakura", "search_type": "match", "checkboxes": {}, "cursor": cursor}
+        request = RequestFactory().post("/get_search_page", json.dumps(body), content_type="application/json")
+        with mock.patch.object(elastic, "elasticsearch_client", return_value=es):
+            response = await views.get_search_page(request)
+        return response.status_code, json.loads(response.content)
+
+    async def test_view_pages_through_the_cursors(self):
+        es = FakeElasticsearch(3)
+        status, first = await self.request(es, None)
+        self.assertEqual((status, [hit["label"] for hit in first["hits"]]), (200, ["doc 0", "doc 1"]))
+        self.assertNotIn("total", first)
+        status, last = await self.request(es, first["cursor"])
+        self.assertEqual((status, [hit["label"] for hit in last["hits"]], last["cursor"]), (200, ["doc 2"], None))
+        self.assertEqual(es.closed, ["pit-2"])
+
+    async def test_view_rejects_invalid_cursors(self):
+        es = FakeElasticsearch(3)
+        for cursor in ("not base64!", "e30=", 42):
+            self.assertEqual(await self.request(es, cursor), (400, {"error": "invalid cursor"}))
+        # nothing was sent to elasticsearch
+        self.assertEqual((es.opened, es.searches), (0, []))
+
+    async def test_view_reports_expired_cursors(self):
+        es = FakeElasticsearch(3)
+        es.search = mock.AsyncMock(side_effect=NotFoundError("point in time expired", mock.Mock(status=404), {}))
+        self.assertEqual(await self.request(es, elastic.encode_cursor("pit-0", [0.5, 1])),
+                         (410, {"error": "cursor expired"}))
+
+
+@override_settings(ELASTICSEARCH_PAGE_SIZE=2, SEARCH_FACET_CACHE="search")
+class FacetTests(SimpleTestCase):
+    def setUp(self):
+        caches["search"].clear()
+        self.addCleanup(caches["search"].clear)
+        self.es = FakeElasticsearch(5)
+        patch = mock.patch.object(elastic, "elasticsearch_client", return_value=self.es)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def test_first_page_computes_the_facets_with_its_hits(self):
+        first = await elastic.page("sakura", "match", {"type": ["vn", "char"], "graph": ["vndb"]}, 0)
+        self.assertEqual((first["total"], first["facets"]), (5, {"type": {"vn": 5}}))
+        self.assertEqual(len(self.es.searches), 1)
+        self.assertIsNotNone(self.es.searches[0]["aggregations"])
+
+        # the first page again, with the filters in another order, and a later page
+        again = await elastic.page("sakura", "match", {"graph": ["vndb"], "type": ["char", "vn"]}, 0)
+        later = await elastic.page("sakura", "match", {"type": ["vn", "char"], "graph": ["vndb"]}, 1)
+        self.assertEqual(again["facets"], first["facets"])
+        self.assertNotIn("facets", later)
+        self.assertEqual([search["aggregations"] for search in self.es.searches[1:]], [None, None])
+
+    async def test_facets_of_the_search_view_are_shared(self):
+        self.es.search = mock.AsyncMock(wraps=self.es.search)
+        facets = await elastic.facets("sakura", "match", {})
+        self.assertEqual(facets, {"total": 5, "facets": {"type": {"vn": 5}}})
+        await elastic.facets("sakura", "match", {})
+        page = await elastic.page("sakura", "match", {}, 0)
+        self.assertEqual(self.es.search.await_count, 2)
+        self.assertIsNone(self.es.search.await_args.kwargs["aggregations"])
+        self.assertEqual(page["facets"], facets["facets"])
+
+    def test_other_searches_have_other_keys(self):
+        keys = {elastic.facet_key("sakura", "match", {}), elastic.facet_key("sakura", "fuzzy", {}),
+                elastic.facet_key("sakura", "match", {"type": ["vn"]}), elastic.facet_key("clannad", "match", {})}
+        self.assertEqual(len(keys), 4)
+
+    @override_settings(SEARCH_FACET_CACHE=None)
+    async def test_without_a_cache_every_first_page_computes_them(self):
+        for _ in range(2):
+            self.assertEqual((await elastic.page("sakura", "match", {}, 0))["facets"], {"type": {"vn": 5}})
+        self.assertEqual([search["aggregations"] is not None for search in self.es.searches], [True, True])
+
+
+class BatchSplitTests(SimpleTestCase):
+    LABEL = "<http://www.w3.org/2000/01/rdf-schema#label>"
+    GRAPH_LABEL = "<http://mediagraph.link/jvmg/ont/shortLabel>"
+    # the lines of the batch query for <a> and <b> in the order the endpoint may return them
+    A = ["<a> <p> <c> <g> .",
+         "<a> <q> _:b1 <g> .",
+         "_:b1 <r> \"2004\" <g> .",
+         f"<r> {LABEL} \"date\"@en <g> .",
+         f"<g> {GRAPH_LABEL} \"g\" <g> .",
+         f"<p> {LABEL} \"p\" .",
+         f"<c> {LABEL} \"c\" .",
+         "<d> <p> <a> <h> .",
+         f"<d> {LABEL} \"d\" .",
+         f"<h> {GRAPH_LABEL} \"h\" <h> ."]
+    B = ["<b> <s> \"literal\" <h> .",
+         f"<s> {LABEL} \"s\" .",
+         # the label of graph h is in the result for <a>
+         f"<h> {GRAPH_LABEL} \"h\" <h> ."]
+    OTHERS = [f"<e> {LABEL} \"not shown\" .",
+              "_:b1 <r> \"other graph\" <h> ."]
+
+    def test_lines_of_each_resource(self):
+        lines = self.A + self.B[:2] + self.OTHERS
+        data = "\n".join(lines[i] for i in (9, 0, 12, 3, 10, 6, 1, 13, 11, 4, 8, 2, 7, 5)).encode("utf-8")
+        split = batch.split(data, ["a", "b", "nothing"])
+        self.assertCountEqual(split["a"], self.A)
+        self.assertCountEqual(split["b"], self.B)
+        self.assertEqual(split["nothing"], [])
+
+    def test_invalid_lines(self):
+        with self.assertRaises(nquads.ParseError):
+            batch.split(b"<a> <p> .", ["a"])
+
+
+class BatchQueryTests(SimpleTestCase):
+    DATA = """
+        @prefix ex: <http://example.org/> .
+        @prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+        @prefix jvmg: <http://mediagraph.link/jvmg/ont/> .
+        ex:g {
+            ex:a ex:title "A"@en , "エー"@ja ; ex:tag ex:t ; ex:release [ ex:date "2004" ; ex:platform ex:pc ] .
+            ex:b ex:tag ex:t .
+            ex:g jvmg:shortLabel "g" .
+        }
+        ex:nsfw { ex:a ex:tag ex:hidden . ex:c ex:sequel ex:a . }
+        ex:h { ex:c ex:prequel ex:b . ex:h jvmg:shortLabel "h" . }
+        ex:t rdfs:label "tag"@en . ex:tag rdfs:label "has tag"@en . ex:c rdfs:label "c" .
+        ex:date rdfs:label "date"@en . ex:g jvmg:shortLabel "g" .
+    """
+    RESOURCES = ["http://example.org/a", "http://example.org/b", "http://example.org/t", "http://example.org/none"]
+
+    def setUp(self):
+        self.dataset = Dataset()
+        self.dataset.parse(data=self.DATA, format="trig")
+
+    def test_same_lines_as_query(self):
+        for shown in (EVERYTHING, Selection(hidden_graphs=frozenset({"http://example.org/nsfw"}), languages=None)):
+            result = batch.split(construct(self.dataset, batch.build_query(self.RESOURCES, shown)), self.RESOURCES)
+            for uri in self.RESOURCES:
+                with self.subTest(uri=uri, hidden=shown.hidden_graphs):
+                    single = construct(self.dataset, shown.apply(views.settings.QUERY.replace("$resource", uri)))
+                    self.assertCountEqual(result[uri], [line for line in single.decode("utf-8").splitlines() if line])
+            self.assertEqual(any("nsfw" in line for line in result["http://example.org/a"]), not shown.hidden_graphs)
+
+    def test_query_without_where(self):
+        with override_settings(QUERY="DESCRIBE <$resource>"), self.assertRaises(batch.ImproperlyConfigured):
+            batch.build_query(self.RESOURCES)
+
+
+class BackLinkTests(SimpleTestCase):
+    RESOURCE = URIRef("http://example.org/tag")
+    GRAPH = URIRef("http://example.org/g")
+    PREDICATE = URIRef("http://example.org/has_tag")
+
+    def counts_result(self, rows: list[tuple[str, str, int]]) -> bytes:
+        return json.dumps({"results": {"bindings": [
+            {"graph": {"type": "uri", "value": graph},
+             "predicate": {"type": "uri", "value": predicate},
+             "count": {"type": "literal", "value": str(count)}}
+            for graph, predicate, count in rows
+        ] or [{}]}}).encode("utf-8")
+
+    async def test_fetch_counts(self):
+        fetch = mock.AsyncMock(return_value=self.counts_result([(self.GRAPH, self.PREDICATE, 250)]))
+        shown = Selection(hidden_graphs=frozenset({"http://example.org/hidden"}), languages=None)
+        with mock.patch.object(back_links.sparql, "fetch", fetch):
+            counts = await back_links.fetch_counts(self.RESOURCE, shown)
+        self.assertEqual(counts, {(self.GRAPH, self.PREDICATE): 250})
+        query = fetch.call_args.args[1]
+        self.assertIn(f"<{self.RESOURCE}>", query)
+        self.assertIn("http://example.org/hidden", query)
+        self.assertNotIn("$", query)
+
+        # an aggregate over no back-links at all returns one empty row
+        with mock.patch.object(back_links.sparql, "fetch", mock.AsyncMock(return_value=self.counts_result([]))):
+            self.assertEqual(await back_links.fetch_counts(self.RESOURCE, EVERYTHING), {})
+
+    def page(self, *subjects: str) -> bytes:
+        return "".join(
+            f'<{subject}> <{self.PREDICATE}> <{self.RESOURCE}> <{self.GRAPH}> .\n'
+            f'<{subject}> <{RDFS_LABEL}> "{subject.rsplit("/", 1)[1]}"@en .\n'
+            for subject in subjects
+        ).encode("utf-8")
+
+    async def get_back_links(self, page: bytes, **params) -> dict:
+        request = RequestFactory().get("/back_links", {"resource": self.RESOURCE, "graph": self.GRAPH,
+                                                       "predicate": self.PREDICATE, **params})
+        with mock.patch.object(views.back_links, "fetch_page", mock.AsyncMock(return_value=page)) as fetch_page:
+            response = await views.get_back_links(request)
+        if response.status_code == 200:
+            fetch_page.assert_awaited_once_with(self.RESOURCE, self.GRAPH, self.PREDICATE, int(params["offset"]))
+        return response
+
+    @override_settings(BACK_LINK_PAGE_SIZE=2)
+    async def test_get_back_links(self):
+        response = await self.get_back_links(self.page("http://example.org/b", "http://example.org/a"), offset="4")
+        result = json.loads(response.content)
+        self.assertEqual([item["labels"] for item in result["items"]],
+                         [[{"label": "a", "lang": "en"}], [{"label": "b", "lang": "en"}]])
+        self.assertEqual(result["next_offset"], 6)
+
+        response = await self.get_back_links(self.page("http://example.org/c"), offset="6")
+        self.assertIsNone(json.loads(response.content)["next_offset"])
+
+        for offset in ("-1", "x"):
+            response = await self.get_back_links(b"", offset=offset)
+            self.assertEqual(response.status_code, 400)
+
+    async def fetch(self, resource_uri, query, data_format):
+        """answers the queries of a page whose resource is only linked by a blank node"""
+        if "COUNT(" in query:
+            return self.counts_result([])
+        if "isBlank(?s)" in query:
+            return (f'_:b1 <{self.PREDICATE}> <{self.RESOURCE}> <{self.GRAPH}> .\n'
+                    f'<{self.PREDICATE}> <{RDFS_LABEL}> "has tag"@en .\n').encode("utf-8")
+        return b""
+
+    @override_settings(BACK_LINK_PAGE_SIZE=100, FRAGMENT_CACHE=None, STREAM_HTML=False,
+                       DATASET_BASE="http://example.org/")
+    async def test_blank_node_back_links_are_shown(self):
+        with mock.patch.object(query_plan.sparql, "fetch", self.fetch), \
+                mock.patch.object(labels, "fetch", mock.AsyncMock(return_value={})):
+            data, counts = await query_plan.fetch(self.RESOURCE, views.settings.QUERY)
+            _, graphs = await views.build_graphs(self.RESOURCE, data, counts, True, EVERYTHING)
+            response = await views.get_html(RequestFactory().get("/tag"), "tag", views.settings.QUERY)
+
+        [graph] = list(graphs)
+        [predicate] = graph.predicates
+        self.assertTrue(predicate.is_back_link)
+        self.assertEqual((predicate.num_objects, predicate.num_blank_nodes, predicate.next_offset), (0, 1, None))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("has tag", response.content.decode("utf-8"))
+
+
+@override_settings(QUERY="query", QUERY_CLUSTER="cluster", QUERY_FORWARD="forward",
+                   QUERY_BACK_LINK_BLANK_NODES="blank nodes", QUERY_BACK_LINK_COUNTS="counts $resource",
+                   QUERY_PLAN={"forward": "forward $resource", "back_links": "back links $resource"},
+                   QUERY_CLUSTER_PLAN={"members": "members $resource"}, BACK_LINK_PAGE_SIZE=0)
+class QueryPlanTests(SimpleTestCase):
+    RESOURCE = URIRef("http://example.org/r")
+
+    def test_plan(self):
+        self.assertEqual(query_plan.plan("query"), {"forward": "forward $resource", "back_links": "back links $resource"})
+        self.assertEqual(query_plan.plan("cluster"), {"members": "members $resource"})
+        self.assertIsNone(query_plan.plan("custom"))
+        self.assertTrue(query_plan.label_free("query"))
+        self.assertFalse(query_plan.label_free("custom"))
+        with override_settings(QUERY_PLAN=None, QUERY_CLUSTER_PLAN={}):
+            self.assertIsNone(query_plan.plan("query"))
+            self.assertIsNone(query_plan.plan("cluster"))
+            self.assertFalse(query_plan.label_free("query"))
+
+    def test_parts(self):
+        self.assertEqual(query_plan.parts("query"), ["forward $resource", "back links $resource"])
+        self.assertEqual(query_plan.parts("custom"), ["custom"])
+        with override_settings(BACK_LINK_PAGE_SIZE=100):
+            # paginated back-links are fetched separately, their blank nodes aren't paginated
+            self.assertEqual(query_plan.parts("query"), ["forward $resource", "blank nodes"])
+            self.assertEqual(query_plan.parts("cluster"), ["members $resource"])
+            self.assertEqual(query_plan.parts("custom"), ["custom"])
+            with override_settings(QUERY_PLAN=None):
+                self.assertEqual(query_plan.parts("query"), ["forward", "blank nodes"])
+
+    async def test_fetch(self):
+        fetch = mock.AsyncMock(side_effect=lambda resource_uri, query, data_format: query.encode("utf-8"))
+        with mock.patch.object(query_plan.sparql, "fetch", fetch):
+            data, counts = await query_plan.fetch(self.RESOURCE, "query")
+            self.assertEqual(data, [f"forward {self.RESOURCE}".encode(), f"back links {self.RESOURCE}".encode()])
+            self.assertIsNone(counts)
+            data, counts = await query_plan.fetch(self.RESOURCE, "custom")
+            self.assertEqual((data, counts), ([b"custom"], None))
+
+    @override_settings(BACK_LINK_PAGE_SIZE=100)
+    async def test_fetch_paginated(self):
+        graph, predicate = URIRef("http://example.org/g"), URIRef("http://example.org/p")
+        fetch = mock.AsyncMock(side_effect=lambda resource_uri, query, data_format: query.encode("utf-8"))
+        fetch_counts = mock.AsyncMock(return_value={(graph, predicate): 250})
+        fetch_page = mock.AsyncMock(return_value=b"page")
+        with mock.patch.object(query_plan.sparql, "fetch", fetch), \
+                mock.patch.object(query_plan.back_links, "fetch_counts", fetch_counts), \
+                mock.patch.object(query_plan.back_links, "fetch_page", fetch_page):
+            data, counts = await query_plan.fetch(self.RESOURCE, "query")
+        self.assertEqual(data, [f"forward {self.RESOURCE}".encode(), b"blank nodes", b"page"])
+        self.assertEqual(counts, {(graph, predicate): 250})
+        fetch_counts.assert_awaited_once_with(self.RESOURCE, EVERYTHING)
+        fetch_page.assert_awaited_once_with(self.RESOURCE, graph, predicate, offset=0)
+
+    async def test_fetch_applies_the_selection(self):
+        selection = Selection(hidden_graphs=frozenset({"http://example.org/hidden"}), languages=None)
+        fetch = mock.AsyncMock(return_value=b"")
+        with mock.patch.object(query_plan.sparql, "fetch", fetch), \
+                mock.patch.object(Selection, "apply", autospec=True,
+                                  side_effect=lambda self, query: query + " hidden") as apply:
+            await query_plan.fetch(self.RESOURCE, "query", selection)
+        self.assertEqual([call.args[1] for call in fetch.await_args_list],
+                         [f"forward {self.RESOURCE} hidden", f"back links {self.RESOURCE} hidden"])
+        self.assertTrue(all(call.args[0] is selection for call in apply.call_args_list))
+
+
+@override_settings(DATASET_BASE="http://example.org/", NSFW_GRAPHS=[], CACHES={
+    **views.settings.CACHES, "pages": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "pages"}})
+class StreamedPageTests(SimpleTestCase):
+    DATA = (b'<http://example.org/a> <http://www.w3.org/2000/01/rdf-schema#label> "A & <a>"@en <http://example.org/g> .\n'
+            b'<http://example.org/a> <http://example.org/p> <http://example.org/b> <http://example.org/g> .\n'
+            b'<http://example.org/a> <http://example.org/p> _:r <http://example.org/g> .\n'
+            b'_:r <http://example.org/date> "2004" <http://example.org/g> .\n'
+            b'<http://example.org/c> <http://example.org/q> <http://example.org/a> <http://example.org/h> .\n'
+            b'<http://example.org/g> <http://mediagraph.link/jvmg/ont/shortLabel> "g" .\n')
+
+    async def page(self) -> bytes:
+        with mock.patch.object(views.query_plan, "fetch", mock.AsyncMock(return_value=([self.DATA], {}))), \
+                mock.patch.object(labels, "fetch", mock.AsyncMock(return_value={})):
+            response = await views.get_html(RequestFactory().get("/a"), "a", views.settings.QUERY)
+            self.assertEqual(response.status_code, 200)
+            if response.streaming:
+                return b"".join([chunk async for chunk in response.streaming_content])
+            return response.content
+
+    async def test_streamed_page_is_the_rendered_page(self):
+        with override_settings(STREAM_HTML=False, FRAGMENT_CACHE=None):
+            rendered = await self.page()
+        with override_settings(STREAM_HTML=True, FRAGMENT_CACHE=None):
+            streamed = await self.page()
+        self.assertEqual(streamed.decode("utf-8"), rendered.decode("utf-8"))
+        self.assertIn("A &amp; &lt;a&gt;", rendered.decode("utf-8"))
+
+    async def test_pages_of_cached_fragments_are_the_rendered_page(self):
+        with override_settings(STREAM_HTML=False, FRAGMENT_CACHE=None):
+            rendered = await self.page()
+        caches["pages"].clear()
+        for stream in (True, True, False):
+            # the first page stores the fragments, the others are built from them
+            with override_settings(STREAM_HTML=stream, FRAGMENT_CACHE="pages"):
+                self.assertEqual((await self.page()).decode("utf-8"), rendered.decode("utf-8"))
+        self.assertTrue(any(key for key in caches["pages"]._cache))
+
+
+class FastRenderTests(SimpleTestCase):
+    def graphs(self, result: ConjunctiveGraph, resource: URIRef, **back_link_counts) -> list:
+        infos = views.Infos(TripleIndex.from_graph(result))
+        return [views.Graph.build(graph.identifier, infos, resource, **back_link_counts)
+                for graph in result.contexts()]
+
+    def assert_same_html(self, graphs: list):
+        for graph in graphs:
+            with self.subTest(graph=graph.uri):
+                self.assertEqual(fast_render.graph_html(graph),
+                                 views.render_to_string("jvmg/graph.html", {"graph": graph}))
+
+    def test_synthetic_result(self):
+        result, resource = benchmark_renderer.synthetic_result(10)
+        self.assert_same_html(self.graphs(result, resource))
+        # paginated back-links are rendered with a "more" link
+        graphs = self.graphs(result, resource, back_link_counts={URIRef(benchmark_renderer.BASE + "ont/tag"): 25})
+        self.assertTrue(any(predicate.next_offset for graph in graphs for predicate in graph.predicates))
+        self.assert_same_html(graphs)
+
+    def test_edge_cases(self):
+        result = ConjunctiveGraph()
+        resource, other = URIRef("http://example.org/a?b='c'&d"), URIRef("http://example.org/o")
+        # a graph without label, a single object, an object without label and a blank node back-link
+        graph = result.get_context(URIRef("http://example.org/g?h='i'&j"))
+        graph.add((resource, URIRef("http://example.org/p"), other))
+        graph.add((resource, URIRef("http://example.org/q"), Literal('"quoted" & <b>', lang="en-US")))
+        graph.add((resource, URIRef("http://example.org/q"), Literal("")))
+        node = BNode()
+        graph.add((node, URIRef("http://example.org/link"), resource))
+        graph.add((node, URIRef("http://example.org/q"), Literal("x")))
+        result.add((other, RDFS_LABEL, Literal("<o>", lang="en"), URIRef("http://example.org/labels")))
+        self.assert_same_html(self.graphs(result, resource))
+
+    @override_settings(FAST_GRAPH_RENDERER=True)
+    def test_render_graph(self):
+        result, resource = benchmark_renderer.synthetic_result(3)
+        for graph in self.graphs(result, resource):
+            fast = views.render_graph(graph)
+            with override_settings(FAST_GRAPH_RENDERER=False):
+                self.assertEqual(fast, views.render_graph(graph))
+
+
+class OverviewSnapshotTests(SimpleTestCase):
+    async def test_request_and_refresher_share_a_build(self):
+        builds = []
+
+        async def build(token=None):
+            builds.append(token)
+            await asyncio.sleep(0.2)
+            return {"token": "token", "sources": []}
+
+        with mock.patch.object(overview_snapshot, "build", build):
+            # the refresher runs in its own thread and event loop
+            refresher = threading.Thread(target=asyncio.run, args=(overview_snapshot.build_once("token"),))
+            refresher.start()
+            await asyncio.sleep(0.05)
+            snapshot = await overview_snapshot.build_once()
+            refresher.join()
+        self.assertEqual(builds, ["token"])
+        self.assertEqual(snapshot["token"], "token")
+        self.assertIsNone(overview_snapshot._building)
+
+    async def test_failed_build_reaches_every_waiter(self):
+        started = threading.Event()
+
+        async def build(token=None):
+            started.set()
+            await asyncio.sleep(0.2)
+            raise EndpointUnavailable("circuit open")
+
+        def wait_in_another_loop():
+            started.wait()
+            with self.assertRaises(EndpointUnavailable):
+                asyncio.run(overview_snapshot.build_once())
+
+        with mock.patch.object(overview_snapshot, "build", build):
+            follower = threading.Thread(target=wait_in_another_loop)
+            follower.start()
+            with self.assertRaises(EndpointUnavailable):
+                await overview_snapshot.build_once("token")
+            follower.join()
+        self.assertIsNone(overview_snapshot._building)
+
+    async def test_refresh_only_rebuilds_a_changed_dataset(self):
+        build = mock.AsyncMock(return_value={"token": "new", "sources": []})
+        with mock.patch.object(overview_snapshot, "load", return_value={"token": "old", "sources": []}), \
+                mock.patch.object(overview_snapshot, "build", build):
+            self.assertFalse(await overview_snapshot.refresh(token="old"))
+            self.assertTrue(await overview_snapshot.refresh(force=True, token="old"))
+            self.assertTrue(await overview_snapshot.refresh(token="new"))
+        self.assertEqual(build.await_args_list, [mock.call("old"), mock.call("new")])
+
+    @override_settings(CACHES={"refresh": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                       OVERVIEW_REFRESH_CACHE="refresh", OVERVIEW_REFRESH_INTERVAL=60)
+    async def test_one_worker_checks_the_token_per_interval(self):
+        self.assertTrue(await overview_snapshot._claim_refresh())
+        self.assertFalse(await overview_snapshot._claim_refresh())
+        with override_settings(OVERVIEW_REFRESH_CACHE=None):
+            self.assertTrue(await overview_snapshot._claim_refresh())
+
+
+class ServerTests(SimpleTestCase):
+    def test_importing_the_applications_starts_nothing(self):
+        from jvmg_frontend import asgi, wsgi
+
+        with mock.patch.object(overview_snapshot, "start_refresher") as start_refresher:
+            # the modules may have been imported by another test already
+            importlib.reload(asgi)
+            importlib.reload(wsgi)
+        start_refresher.assert_not_called()
+
+    async def test_lifespan_starts_the_refresher(self):
+        from jvmg_frontend import asgi
+
+        messages = asyncio.Queue()
+        for message in ("lifespan.startup", "lifespan.shutdown"):
+            messages.put_nowait({"type": message})
+        sent = []
+
+        async def send(message):
+            sent.append(message["type"])
+
+        with mock.patch.object(overview_snapshot, "start_refresher") as start_refresher:
+            await asgi.application({"type": "lifespan"}, messages.get, send)
+        start_refresher.assert_called_once_with()
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+
+    def test_first_request_starts_the_refresher(self):
+        from jvmg_frontend import wsgi
+
+        with mock.patch.object(overview_snapshot, "start_refresher") as start_refresher, \
+                mock.patch.object(wsgi, "django_application", return_value=[b"page"]) as django_application:
+            self.assertEqual(wsgi.application({}, None), [b"page"])
+        start_refresher.assert_called_once_with()
+        django_application.assert_called_once_with({}, None)
+
+
+class CrosstabTests(SimpleTestCase):
+    def setUp(self):
+        labels.cache.clear()
+
+    @override_settings(LABEL_BATCH_SIZE=1)
+    async def test_unavailable_labels_fall_back_to_the_uri(self):
+        async def fetch_batch(uris, selection):
+            if uris == [URIRef("http://example.org/b")]:
+                raise EndpointUnavailable("circuit open")
+            return {uri: {RDFS_LABEL: (Literal(f"label of {uri}", lang="en"),)} for uri in uris}
+
+        result = crosstab_result([("http://example.org/p", "http://example.org/a", 2),
+                                  ("http://example.org/p", "http://example.org/b", 1)])
+        with mock.patch.object(crosstab.sparql, "query_endpoint", mock.AsyncMock(return_value=result)), \
+                mock.patch.object(labels, "fetch_batch", fetch_batch):
+            rows = await crosstab.compute("http://example.org/tag")
+
+        self.assertEqual([row["value_label"] for row in rows],
+                         ["label of http://example.org/a", "http://example.org/b"])
+        self.assertEqual(rows[0]["property_label"], "label of http://example.org/p")
+
+    def test_top_k_per_property(self):
+        columns = {"property": ["p", "q", "p", "p", "q", "r"], "count": [1, 7, 5, 3, 2, 4]}
+        rows = crosstab.top_k(columns, 2)
+        self.assertEqual(rows, [1, 2, 5, 3, 4])
+        self.assertEqual([columns["property"][row] for row in crosstab.top_k(columns, 1)], ["q", "p", "r"])
+        self.assertEqual(crosstab.top_k({"property": [], "count": []}, 2), [])
+
+    def test_empty_aggregate_row(self):
+        self.assertEqual(crosstab.to_columns([{}]), {"property": [], "value": [], "is_uri": [], "count": []})
+
+    def dataset(self) -> Dataset:
+        """five entities linking to tag, with (p, value i) for i < their number, a literal and a type"""
+        dataset = Dataset(default_union=True)
+        graph = dataset.graph(URIRef("http://example.org/graph"))
+        for entity in range(5):
+            uri = URIRef(f"http://example.org/e{entity}")
+            graph.add((uri, URIRef("http://example.org/tagged"), URIRef("http://example.org/tag")))
+            graph.add((uri, URIRef("http://example.org/type"), URIRef("http://example.org/Item")))
+            graph.add((uri, URIRef("http://example.org/year"), Literal("2004")))
+            for value in range(entity):
+                graph.add((uri, URIRef("http://example.org/p"), URIRef(f"http://example.org/v{value}")))
+        dataset.add((URIRef("http://example.org/v0"), RDFS_LABEL, Literal("value 0", lang="en")))
+        dataset.add((URIRef("http://example.org/v0"), RDFS_LABEL, Literal("値 0", lang="ja")))
+        return dataset
+
+    async def rows(self, dataset: Dataset) -> tuple[list[dict], list[list[URIRef]]]:
+        """the crosstab of tag in dataset, and the URIs whose labels were fetched"""
+        fetched = []
+
+        async def query_endpoint(query, result_format, kind):
+            return dataset.query(query).serialize(format="json")
+
+        async def fetch_batch(uris, selection):
+            fetched.append(uris)
+            return {uri: {RDFS_LABEL: tuple(dataset.objects(uri, RDFS_LABEL))} for uri in uris}
+
+        with mock.patch.object(crosstab.sparql, "query_endpoint", query_endpoint), \
+                mock.patch.object(labels, "fetch_batch", fetch_batch):
+            return await crosstab.compute("http://example.org/tag"), fetched
+
+    @override_settings(CROSSTAB_TOP_K=2, CROSSTAB_MAX_ROWS=100000, CROSSTAB_PROPERTIES=None)
+    async def test_rows_and_labels(self):
+        rows, fetched = await self.rows(self.dataset())
+        self.assertEqual([(row["property"], row["value"], row["count"]) for row in rows], [
+            ("http://example.org/tagged", "http://example.org/tag", 5),
+            ("http://example.org/type", "http://example.org/Item", 5),
+            ("http://example.org/year", "2004", 5),
+            ("http://example.org/p", "http://example.org/v0", 4),
+            ("http://example.org/p", "http://example.org/v1", 3),
+        ])
+        # only the shown URIs are looked up, not the literal nor the values below the top k
+        self.assertEqual(set(fetched[0]), {URIRef(f"http://example.org/{name}")
+                                          for name in ("tagged", "tag", "type", "Item", "year", "p", "v0", "v1")})
+        labels_of = {row["value"]: row["value_label"] for row in rows}
+        self.assertEqual(labels_of["http://example.org/v0"], "value 0")
+        self.assertEqual(labels_of["http://example.org/v1"], "http://example.org/v1")
+        self.assertEqual(labels_of["2004"], "2004")
+
+    @override_settings(CROSSTAB_TOP_K=50, CROSSTAB_MAX_ROWS=4, CROSSTAB_PROPERTIES=None)
+    async def test_truncated_at_max_rows(self):
+        self.assertIn("LIMIT 4", crosstab.build_query("http://example.org/tag"))
+        rows, _ = await self.rows(self.dataset())
+        # the most frequent pairs are kept
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([row["count"] for row in rows], [5, 5, 5, 4])
+
+    @override_settings(CROSSTAB_TOP_K=50, CROSSTAB_MAX_ROWS=100000,
+                       CROSSTAB_PROPERTIES=["http://example.org/p", "http://example.org/year"])
+    async def test_restricted_to_the_properties(self):
+        rows, _ = await self.rows(self.dataset())
+        self.assertEqual({row["property"] for row in rows}, {"http://example.org/p", "http://example.org/year"})
+        self.assertEqual(len(rows), 5)
+
+
+@override_settings(LABEL_CACHE_SIZE=2, LABEL_CACHE_TIMEOUT=60)
+class LabelCacheTests(SimpleTestCase):
+    A, B, C = (URIRef(f"http://example.org/{name}") for name in "abc")
+
+    def setUp(self):
+        labels.cache.clear()
+        self.now = 100.0
+        clock = mock.patch.object(labels.time, "monotonic", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    @staticmethod
+    def key(uri: URIRef, languages=None) -> labels.Key:
+        return uri, frozenset(), languages
+
+    def test_entries_expire(self):
+        labels.cache.set_many({self.key(self.A): {RDFS_LABEL: (Literal("a"),)}})
+        self.now += 59
+        self.assertEqual(labels.cache.get(self.key(self.A)), {RDFS_LABEL: (Literal("a"),)})
+        self.now += 2
+        self.assertIsNone(labels.cache.get(self.key(self.A)))
+        self.assertEqual(len(labels.cache.entries), 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        labels.cache.set_many({self.key(self.A): {}, self.key(self.B): {}})
+        self.assertEqual(labels.cache.get(self.key(self.A)), {})
+        labels.cache.set_many({self.key(self.C): {}})
+        self.assertEqual(list(labels.cache.entries), [self.key(self.A), self.key(self.C)])
+        self.assertIsNone(labels.cache.get(self.key(self.B)))
+
+    @override_settings(LABEL_BATCH_SIZE=2, LABEL_CACHE_SIZE=100)
+    async def test_fetch_looks_up_each_uri_once(self):
+        batches = []
+
+        async def fetch_batch(uris, selection):
+            batches.append(uris)
+            return {uri: {RDFS_LABEL: (Literal(f"label {uri[-1]}", lang="en"),)} for uri in uris if uri != self.C}
+
+        with mock.patch.object(labels, "fetch_batch", fetch_batch):
+            found = await labels.fetch([str(self.C), str(self.B), str(self.A), str(self.B)])
+            # the uri without labels is cached as well
+            self.assertEqual(await labels.fetch([self.A, self.C]), {self.A: found[self.A], self.C: {}})
+            # the labels in all languages contain those of a language
+            german = Selection(hidden_graphs=frozenset(), languages=("de",))
+            self.assertEqual(await labels.fetch([self.A], german), {self.A: found[self.A]})
+        self.assertEqual(batches, [[self.A, self.B], [self.C]])
+        self.assertEqual(found[self.C], {})
+
+    @override_settings(LABEL_CACHE_SIZE=100)
+    async def test_labels_of_a_language_are_cached_apart(self):
+        english = Selection(hidden_graphs=frozenset(), languages=("en",))
+        fetch_batch = mock.AsyncMock(return_value={self.A: {RDFS_LABEL: (Literal("a", lang="en"),)}})
+        with mock.patch.object(labels, "fetch_batch", fetch_batch):
+            await labels.fetch([self.A], english)
+            await labels.fetch([self.A], english)
+            # the english labels aren't all labels
+            await labels.fetch([self.A])
+        self.assertEqual([call.args[1] for call in fetch_batch.await_args_list], [english, EVERYTHING])
+
+
+class LabelSnapshotTests(SimpleTestCase):
+    GRAPH = URIRef("http://example.org/graph")
+    P, Q = URIRef("http://example.org/p"), URIRef("http://example.org/q")
+    GRAPH_LABEL = URIRef("http://mediagraph.link/jvmg/ont/shortLabel")
+
+    def setUp(self):
+        # the snapshot of the worker is restored afterwards
+        saved = (label_snapshot._labels, label_snapshot._token, label_snapshot._mtime)
+        self.addCleanup(self.restore, saved)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = override_settings(LABEL_SNAPSHOT=os.path.join(directory.name, "label_snapshot.json"))
+        path.enable()
+        self.addCleanup(path.disable)
+        labels.cache.clear()
+
+    @staticmethod
+    def restore(saved):
+        label_snapshot._labels, label_snapshot._token, label_snapshot._mtime = saved
+
+    def dataset(self) -> Dataset:
+        dataset = Dataset(default_union=True)
+        graph = dataset.graph(self.GRAPH)
+        graph.add((URIRef("http://example.org/a"), self.P, URIRef("http://example.org/b")))
+        graph.add((URIRef("http://example.org/a"), self.Q, Literal("1", datatype=XSD.integer)))
+        dataset.add((self.P, RDFS_LABEL, Literal("has p", lang="en")))
+        dataset.add((self.P, RDFS_LABEL, Literal("p", datatype=XSD.string)))
+        dataset.add((self.P, RDFS_LABEL, Literal("")))
+        dataset.add((self.GRAPH, self.GRAPH_LABEL, Literal("graph")))
+        return dataset
+
+    async def build(self, dataset: Dataset, token: str = "v1"):
+        async def query_endpoint(query, result_format, kind):
+            return dataset.query(query).serialize(format="json")
+
+        with mock.patch.object(label_snapshot.sparql, "query_endpoint", query_endpoint):
+            return await label_snapshot.refresh(token)
+
+    async def test_labels_of_predicates_and_graphs(self):
+        self.assertTrue(await self.build(self.dataset()))
+        self.assertEqual(set(label_snapshot.labels_for(self.P, [RDFS_LABEL])),
+                         {Literal("has p", lang="en"), Literal("p", datatype=XSD.string)})
+        self.assertEqual(label_snapshot.labels_for(self.GRAPH, [self.GRAPH_LABEL]), [Literal("graph")])
+        # a predicate without labels is known, other URIs aren't in the snapshot
+        self.assertTrue(label_snapshot.known(self.Q))
+        self.assertEqual(label_snapshot.labels_for(self.Q, [RDFS_LABEL]), [])
+        self.assertFalse(label_snapshot.known(URIRef("http://example.org/b")))
+        self.assertIsNone(label_snapshot.labels_for(URIRef("http://example.org/b"), [RDFS_LABEL]))
+
+    async def test_refresh_only_rebuilds_another_dataset(self):
+        dataset = self.dataset()
+        await self.build(dataset)
+        dataset.add((self.Q, RDFS_LABEL, Literal("has q")))
+        self.assertFalse(await self.build(dataset))
+        self.assertEqual(label_snapshot.labels_for(self.Q, [RDFS_LABEL]), [])
+        self.assertTrue(await self.build(dataset, "v2"))
+        self.assertEqual(label_snapshot.labels_for(self.Q, [RDFS_LABEL]), [Literal("has q")])
+
+    async def test_a_changed_file_is_loaded_again(self):
+        await self.build(self.dataset())
+        with open(views.settings.LABEL_SNAPSHOT, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        snapshot["labels"] = {str(self.Q): {str(RDFS_LABEL): [["q", "en", None]]}}
+        label_snapshot.save(snapshot)
+        os.utime(views.settings.LABEL_SNAPSHOT, (0, 0))
+        self.assertTrue(label_snapshot.load())
+        self.assertEqual(label_snapshot.labels_for(self.Q, [RDFS_LABEL]), [Literal("q", lang="en")])
+        self.assertFalse(label_snapshot.known(self.P))
+
+    async def test_other_uris_are_fetched(self):
+        await self.build(self.dataset())
+        data = (f'<http://example.org/a> <{self.P}> <http://example.org/b> <{self.GRAPH}> .\n'
+                f'<http://example.org/a> <{self.Q}> "1" <{self.GRAPH}> .\n').encode("utf-8")
+        fetch_batch = mock.AsyncMock(return_value={
+            URIRef("http://example.org/b"): {RDFS_LABEL: (Literal("b", lang="en"),)}})
+        with mock.patch.object(labels, "fetch_batch", fetch_batch):
+            _, graphs = await views.build_graphs(URIRef("http://example.org/a"), [data], None, True, EVERYTHING)
+            [graph] = list(graphs)
+        self.assertEqual(set(fetch_batch.await_args.args[0]),
+                         {URIRef("http://example.org/a"), URIRef("http://example.org/b")})
+        self.assertEqual(sorted(tuple(map(str, predicate.info.labels)) for predicate in graph.predicates),
+                         [("has p", "p"), ("http://example.org/q",)])
+        [object] = [predicate for predicate in graph.predicates if predicate.uri == str(self.P)][0].objects
+        self.assertEqual(object.labels, (views.Label("b", "en"),))
+
+
+class SelectionTests(SimpleTestCase):
+    LABELS = [Literal("Drama", lang="en"), Literal("ドラマ", lang="ja"), Literal("dorama", lang="ja-Latn"),
+              Literal("drama")]
+
+    def choose(self, languages, labels=LABELS):
+        return Selection(hidden_graphs=frozenset(), languages=languages).choose(labels)
+
+    def test_all_languages(self):
+        self.assertEqual(self.choose(None), self.LABELS)
+
+    def test_first_language_with_labels(self):
+        self.assertEqual(self.choose(("de", "ja")), [Literal("ドラマ", lang="ja"), Literal("dorama", lang="ja-Latn")])
+        self.assertEqual(self.choose(("ja-latn",)), [Literal("dorama", lang="ja-Latn")])
+
+    def test_english_then_without_language(self):
+        self.assertEqual(self.choose(("de",)), [Literal("Drama", lang="en")])
+        self.assertEqual(self.choose(("de",), self.LABELS[1:]), [Literal("drama")])
+
+    def test_all_labels_without_a_match(self):
+        labels = [Literal("ドラマ", lang="ja")]
+        self.assertEqual(self.choose(("en",), labels), labels)
+
+
+class SelectionQueryTests(SimpleTestCase):
+    DATA = """
+        @prefix ex: <http://example.org/> .
+        @prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+        @prefix jvmg: <http://mediagraph.link/jvmg/ont/> .
+        ex:g {
+            ex:a rdfs:label "Drama"@en , "ドラマ"@ja , "dorama"@ja-Latn .
+            ex:b rdfs:label "Drama"@de .
+            ex:c rdfs:label "c" , "ce"@fr .
+            ex:cluster jvmg:hasMember ex:member .
+            ex:member ex:title "member" .
+        }
+        ex:nsfw {
+            ex:a rdfs:label "Secret"@en .
+            ex:d rdfs:label "only hidden" .
+            ex:member ex:title "secret" .
+        }
+        ex:cluster jvmg:hasMember ex:member .
+    """
+    HIDDEN = frozenset({"http://example.org/nsfw"})
+
+    def setUp(self):
+        labels.cache.clear()
+        # the default graph of the endpoint is the union of its graphs
+        self.dataset = Dataset(default_union=True)
+        self.dataset.parse(data=self.DATA, format="trig")
+        self.queries = 0
+
+    async def query_endpoint(self, query, data_format, kind):
+        self.queries += 1
+        return self.dataset.query(query).serialize(format="json")
+
+    async def fetch_labels(self, languages):
+        with mock.patch.object(labels.sparql, "query_endpoint", self.query_endpoint):
+            found = await labels.fetch([f"http://example.org/{name}" for name in "abcd"],
+                                       Selection(hidden_graphs=self.HIDDEN, languages=languages))
+        return {uri.rsplit("/", 1)[1]: sorted(map(str, uri_labels.get(RDFS_LABEL, ()))) for uri, uri_labels in found.items()}
+
+    async def test_labels_in_the_chosen_languages_and_shown_graphs(self):
+        self.assertEqual(await self.fetch_labels(("ja",)),
+                         {"a": ["Drama", "dorama", "ドラマ"], "b": ["Drama"], "c": ["c"], "d": []})
+        self.assertEqual(await self.fetch_labels(None),
+                         {"a": ["Drama", "dorama", "ドラマ"], "b": ["Drama"], "c": ["c", "ce"], "d": []})
+        self.assertEqual(self.queries, 2)
+        # the labels in all languages contain those of every language
+        self.assertEqual((await self.fetch_labels(("fr",)))["c"], ["c", "ce"])
+        self.assertEqual(self.queries, 2)
+
+    def test_members_in_hidden_graphs_are_left_out(self):
+        dataset = Dataset()
+        dataset.parse(data=self.DATA, format="trig")
+        query = views.settings.QUERY_CLUSTER.replace("$resource", "http://example.org/cluster")
+        shown = construct(dataset, EVERYTHING.apply(query)).decode("utf-8")
+        filtered = construct(dataset, Selection(hidden_graphs=self.HIDDEN, languages=None).apply(query)).decode("utf-8")
+        self.assertIn('"secret"', shown)
+        self.assertIn('"member"', filtered)
+        self.assertNotIn("nsfw", filtered)
+
+
+class TimingTests(SimpleTestCase):
+    def setUp(self):
+        # fresh metrics, the ones of the worker are restored afterwards
+        for name, metric in (("REQUEST_DURATION", timing.Histogram("request", "Requests.", "view", (0.1, 1))),
+                             ("STAGE_DURATION", timing.Histogram("stage", "Stages.", "stage", (0.1, 1))),
+                             ("RESPONSE_BYTES", timing.Histogram("bytes", "Bytes.", "view", (10, 100))),
+                             ("EVENTS", timing.Counter("events", "Events.", "event"))):
+            patch = mock.patch.object(timing, name, metric)
+            patch.start()
+            self.addCleanup(patch.stop)
+        patch = mock.patch.object(timing, "METRICS", (timing.REQUEST_DURATION, timing.STAGE_DURATION,
+                                                      timing.RESPONSE_BYTES, timing.EVENTS))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_histogram_exposition(self):
+        histogram = timing.Histogram("jvmg_duration_seconds", "Duration.", "view", (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe("page", value)
+        histogram.observe("metrics", 0.01)
+        self.assertEqual(histogram.expose(), [
+            "# HELP jvmg_duration_seconds Duration.",
+            "# TYPE jvmg_duration_seconds histogram",
+            'jvmg_duration_seconds_bucket{view="metrics",le="0.1"} 1',
+            'jvmg_duration_seconds_bucket{view="metrics",le="1"} 1',
+            'jvmg_duration_seconds_bucket{view="metrics",le="+Inf"} 1',
+            'jvmg_duration_seconds_sum{view="metrics"} 0.01',
+            'jvmg_duration_seconds_count{view="metrics"} 1',
+            # the buckets are cumulative, a value on a bound is in its bucket
+            'jvmg_duration_seconds_bucket{view="page",le="0.1"} 2',
+            'jvmg_duration_seconds_bucket{view="page",le="1"} 3',
+            'jvmg_duration_seconds_bucket{view="page",le="+Inf"} 4',
+            'jvmg_duration_seconds_sum{view="page"} 3.65',
+            'jvmg_duration_seconds_count{view="page"} 4',
+        ])
+
+    def test_exposition_of_all_metrics(self):
+        timing.EVENTS.inc("cache_hit.labels", 3)
+        timing.EVENTS.inc("cache_hit.labels")
+        text = timing.expose()
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn('# TYPE events counter\nevents_total{event="cache_hit.labels"} 4\n', text)
+        self.assertEqual(re.findall(r"^# TYPE (\S+)", text, re.MULTILINE), ["request", "stage", "bytes", "events"])
+
+    def test_spans_outside_of_requests(self):
+        with timing.span("sparql"):
+            timing.count("triples")
+        self.assertEqual(timing.EVENTS.series, {})
+
+    @staticmethod
+    def request():
+        request = RequestFactory().get("/vn/1")
+        request.resolver_match = mock.Mock(url_name="page")
+        return request
+
+    @override_settings(SERVER_TIMING=True, SLOW_LOG_THRESHOLD=60)
+    async def test_middleware_adds_up_the_stages(self):
+        async def stage(name):
+            with timing.span(name):
+                await asyncio.sleep(0.01)
+
+        async def view(request):
+            # concurrent spans of a stage add up
+            await asyncio.gather(stage("sparql"), stage("sparql"))
+            with timing.span("render"):
+                timing.count("triples", 5)
+            timing.count("triples", 2)
+            return HttpResponse(b"x" * 20)
+
+        with self.assertLogs("timing", "INFO") as logs, self.assertNoLogs("slow"):
+            response = await timing.TimingMiddleware(view)(self.request())
+        [line] = logs.records
+        logged = json.loads(line.getMessage())
+        self.assertEqual((logged["view"], logged["status"], logged["bytes"]), ("page", 200, 20))
+        self.assertEqual(logged["stages"]["sparql"]["count"], 2)
+        self.assertGreaterEqual(logged["stages"]["sparql"]["duration"], 0.02)
+        self.assertEqual(logged["counts"], {"triples": 7})
+        self.assertRegex(response["Server-Timing"], r"^sparql;dur=\d+\.\d, render;dur=\d+\.\d$")
+
+        self.assertEqual(timing.EVENTS.series, {"triples": 7})
+        self.assertEqual(timing.STAGE_DURATION.series["sparql"][0], [1, 0, 0])
+        self.assertEqual(timing.RESPONSE_BYTES.series["page"], [[0, 1, 0], 20])
+        self.assertEqual(sum(timing.REQUEST_DURATION.series["page"][0]), 1)
+
+    @override_settings(SERVER_TIMING=False, SLOW_LOG_THRESHOLD=0)
+    async def test_streamed_responses_are_measured_until_the_last_chunk(self):
+        async def content():
+            yield b"head"
+            with timing.span("render"):
+                timing.count("triples")
+            yield b"graphs"
+
+        async def view(request):
+            with timing.span("sparql"):
+                pass
+            return StreamingHttpResponse(content())
+
+        with self.assertLogs("timing", "INFO") as logs, self.assertLogs("slow", "INFO"):
+            response = await timing.TimingMiddleware(view)(self.request())
+            self.assertNotIn("Server-Timing", response)
+            self.assertEqual(logs.records, [])
+            self.assertEqual(b"".join([chunk async for chunk in response.streaming_content]), b"headgraphs")
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual(set(logged["stages"]), {"sparql", "render"})
+        self.assertEqual((logged["bytes"], logged["counts"]), (10, {"triples": 1}))
+
+
+class BreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        clock = mock.patch.object(breaker.time, "monotonic", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.breaker = CircuitBreaker("endpoint", failures=3, reset=30)
+
+    def open(self):
+        for _ in range(3):
+            self.breaker.failure()
+
+    def test_opens_after_failures_in_a_row(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.now += 10
+        self.assertEqual(self.breaker.retry_after(), 20)
+
+    def test_one_trial_query_after_the_reset(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual((self.breaker.state, self.breaker.failures), (CLOSED, 0))
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 0)
+
+    def test_failed_trial_opens_again(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+
+    def test_trial_without_answer_doesnt_block_forever(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+
+class StubEndpoint:
+    """a local sparql endpoint which answers every query with status and body"""
+
+    def __init__(self, status: int = 200, body: bytes = b'{"head": {}, "boolean": true}', delay: float = 0.0):
+        self.status = status
+        self.body = body
+        self.delay = delay
+        self.queries = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.queries += 1
+                time.sleep(stub.delay)
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/sparql-results+json")
+                self.send_header("Content-Length", str(len(stub.body)))
+                self.end_headers()
+                self.wfile.write(stub.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/sparql"
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def unused_url() -> str:
+    """the url of a port nobody listens on"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/sparql"
+
+
+@override_settings(SPARQL_HEALTH_CHECK_INTERVAL=None, SPARQL_PINNED={}, SPARQL_ROUTING="least_outstanding",
+                   SPARQL_BREAKER_FAILURES=2, SPARQL_BREAKER_RESET=30.0)
+class EndpointTests(SimpleTestCase):
+    def setUp(self):
+        endpoints._endpoints.clear()
+        self.stubs = [StubEndpoint(), StubEndpoint()]
+        self.urls = [stub.url for stub in self.stubs]
+
+    def tearDown(self):
+        for stub in self.stubs:
+            stub.stop()
+        endpoints._endpoints.clear()
+
+    def test_least_outstanding(self):
+        with override_settings(SPARQL_ENDPOINTS=self.urls):
+            first, second = endpoints.all_endpoints()
+            first.start()
+            self.assertIs(endpoints.choose("default"), second)
+            second.start()
+            second.start()
+            self.assertIs(endpoints.choose("default"), first)
+
+    def test_latency(self):
+        with override_settings(SPARQL_ENDPOINTS=self.urls, SPARQL_ROUTING="latency"):
+            first, second = endpoints.all_endpoints()
+            first.latency, second.latency = 0.1, 0.5
+            self.assertIs(endpoints.choose("default"), first)
+            # 5 queries running on the fast one weigh more than none on the slow one
+            for _ in range(5):
+                first.start()
+            self.assertIs(endpoints.choose("default"), second)
+
+    def test_pinning(self):
+        with override_settings(SPARQL_ENDPOINTS=self.urls, SPARQL_PINNED={"crosstab": [self.urls[1]]}):
+            first, second = endpoints.all_endpoints()
+            second.start()
+            self.assertIs(endpoints.choose("crosstab"), second)
+            self.assertIs(endpoints.choose("default"), first)
+            # a pinned endpoint isn't replaced by others when its circuit is open
+            second.breaker.failure()
+            second.breaker.failure()
+            with self.assertRaises(EndpointUnavailable):
+                endpoints.choose("crosstab")
+
+    def test_open_circuits_and_unhealthy_endpoints_are_left_out(self):
+        with override_settings(SPARQL_ENDPOINTS=self.urls):
+            first, second = endpoints.all_endpoints()
+            first.breaker.failure()
+            first.breaker.failure()
+            self.assertEqual(first.breaker.state, OPEN)
+            self.assertEqual({endpoints.choose("default") for _ in range(20)}, {second})
+            second.healthy = False
+            # unhealthy endpoints are still tried if nothing else is left
+            self.assertIs(endpoints.choose("default"), second)
+
+    async def test_health_checks(self):
+        with override_settings(SPARQL_ENDPOINTS=self.urls):
+            first, second = endpoints.all_endpoints()
+            await endpoints.check(first)
+            self.assertTrue(first.healthy)
+
+            self.stubs[0].status = 500
+            await endpoints.check(first)
+            self.assertFalse(first.healthy)
+            self.assertEqual({endpoints.choose("default") for _ in range(20)}, {second})
+
+            self.stubs[0].status = 200
+            await endpoints.check(first)
+            self.assertTrue(first.healthy)
+
+    async def test_health_checks_leave_the_circuit_open(self):
+        with override_settings(SPARQL_ENDPOINTS=self.urls):
+            first, _ = endpoints.all_endpoints()
+            first.breaker.failure()
+            first.breaker.failure()
+            await endpoints.check(first)
+            self.assertTrue(first.healthy)
+            self.assertEqual(first.breaker.state, OPEN)
+
+    async def test_failover_to_another_endpoint(self):
+        down = unused_url()
+        # ties go to the first endpoint, so every query tries the one which is down until its circuit opens
+        with override_settings(SPARQL_ENDPOINTS=[down, self.urls[0]]), \
+                mock.patch.object(endpoints.random, "choice", lambda choices: choices[0]):
+            for _ in range(4):
+                self.assertEqual(await sparql.query_endpoint("ASK {}", JSON), self.stubs[0].body)
+            self.assertEqual(self.stubs[0].queries, 4)
+            self.assertEqual(endpoints._endpoints[down].breaker.state, OPEN)
+            self.assertEqual(endpoints._endpoints[self.urls[0]].breaker.state, CLOSED)
+
+    async def test_failed_queries_open_the_circuit(self):
+        self.stubs[0].status = 503
+        with override_settings(SPARQL_ENDPOINTS=self.urls[:1]):
+            for _ in range(2):
+                with self.assertRaises(EndpointUnavailable):
+                    await sparql.query_endpoint("ASK {}", JSON)
+            with self.assertRaises(EndpointUnavailable):
+                await sparql.query_endpoint("ASK {}", JSON)
+            self.assertEqual(self.stubs[0].queries, 2)
+
+
+class SparqlTests(SimpleTestCase):
+    GRAPH = """
+        @prefix ex: <http://example.org/> .
+        ex:graph { ex:a ex:p "x"@en , ex:b . }
+    """
+
+    def serializations(self, graph: ConjunctiveGraph) -> dict[str, bytes]:
+        return {
+            TURTLE: graph.serialize(format="turtle", encoding="utf-8"),
+            XML: graph.serialize(format="xml", encoding="utf-8"),
+            JSONLD: graph.serialize(format="json-ld", encoding="utf-8"),
+            sparql.NTRIPLES: graph.serialize(format="nt", encoding="utf-8"),
+            sparql.NQUADS: graph.serialize(format="nquads", encoding="utf-8"),
+        }
+
+    def test_is_empty_agrees_with_rdflib(self):
+        full = ConjunctiveGraph()
+        full.parse(data=self.GRAPH, format="trig")
+        empty = ConjunctiveGraph()
+        empty.bind("ex", "http://example.org/")
+        for graph in (full, empty):
+            for data_format, data in self.serializations(graph).items():
+                with self.subTest(data_format=data_format, triples=len(graph)):
+                    self.assertEqual(sparql.is_empty(data, data_format), len(sparql.parse(data, data_format)) == 0)
+
+    def test_is_empty_of_endpoint_results(self):
+        empty = {
+            TURTLE: b"@prefix ex: <http://example.org/> .\nPREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>\n",
+            XML: b'<rdf:RDF\n    xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n</rdf:RDF>\n',
+            JSONLD: b'{ "@context": { "ex": "http://example.org/" } }',
+            sparql.NQUADS: b"# nothing\n\n",
+        }
+        for data_format, data in empty.items():
+            with self.subTest(data_format=data_format):
+                self.assertTrue(sparql.is_empty(data, data_format))
+        self.assertTrue(sparql.is_empty(b"[]", JSONLD))
+        self.assertTrue(sparql.is_empty(b"{}", JSONLD))
+        self.assertTrue(sparql.is_empty(b"", TURTLE))
+        self.assertFalse(sparql.is_empty(b"prefix:a prefix:b prefix:c .", TURTLE))
+        self.assertFalse(sparql.is_empty(b'{"@graph": [{"@id": "http://example.org/a"}]}', JSONLD))
+
+    @override_settings(SPARQL_HEALTH_CHECK_INTERVAL=None, SPARQL_PINNED={}, SPARQL_CACHE="default",
+                       SPARQL_CACHE_MAX_BYTES=10, STALE_CACHE=None)
+    async def test_fetch_never_gets_the_stream_of_fetch_stream(self):
+        endpoints._endpoints.clear()
+        stub = StubEndpoint(body=b"<http://example.org/a> <http://example.org/p> <http://example.org/b> .\n",
+                            delay=0.2)
+        try:
+            with override_settings(SPARQL_ENDPOINTS=[stub.url]):
+                streamed, fetched = await asyncio.gather(
+                    sparql.fetch_stream("http://example.org/a", "CONSTRUCT {} WHERE {}", sparql.NTRIPLES),
+                    sparql.fetch("http://example.org/a", "CONSTRUCT {} WHERE {}", sparql.NTRIPLES))
+                self.assertIsInstance(streamed, sparql.Stream)
+                self.assertEqual(fetched, stub.body)
+                await streamed.response.aclose()
+        finally:
+            stub.stop()
+            endpoints._endpoints.clear()
+
+
+class ConditionalTests(SimpleTestCase):
+    QUADS = (b'<http://example.org/a> <http://example.org/p> "1" <http://example.org/g> .\n'
+             b'<http://example.org/a> <http://example.org/p> "2" <http://example.org/g> .\n')
+    REORDERED = b"\n".join(reversed(QUADS.splitlines())) + b"\n"
+
+    def test_statements_in_another_order_keep_their_etag(self):
+        self.assertEqual(conditional.etag(conditional.canonical(self.QUADS, sparql.NQUADS)),
+                         conditional.etag(conditional.canonical(self.REORDERED, sparql.NQUADS)))
+        self.assertNotEqual(conditional.canonical(self.QUADS, TURTLE), conditional.canonical(self.REORDERED, TURTLE))
+
+    async def test_rdf_data_revalidates_and_varies(self):
+        request = RequestFactory().get("/a", headers={"Accept": "application/n-quads"})
+        with mock.patch.object(views.sparql, "fetch_stream", mock.AsyncMock(return_value=self.QUADS)):
+            response = await views.get_data(request, "a", sparql.NQUADS, "application/n-quads", "$resource")
+        self.assertTrue(response["ETag"].startswith("W/"))
+        self.assertEqual(response["Vary"], "Accept, Cookie")
+
+        request = RequestFactory().get("/a", headers={"Accept": "application/n-quads",
+                                                      "If-None-Match": response["ETag"]})
+        with mock.patch.object(views.sparql, "fetch_stream", mock.AsyncMock(return_value=self.REORDERED)):
+            response = await views.get_data(request, "a", sparql.NQUADS, "application/n-quads", "$resource")
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Vary"], "Accept, Cookie")
+
+    def test_canonical_ignores_order_and_blank_lines(self):
+        padded = b"\n  " + self.REORDERED.replace(b"\n", b"  \n\n")
+        self.assertEqual(conditional.canonical(padded, sparql.NQUADS), conditional.canonical(self.QUADS, sparql.NQUADS))
+        self.assertEqual(conditional.canonical(padded, sparql.NTRIPLES),
+                         conditional.canonical(self.QUADS, sparql.NTRIPLES))
+        # other statements are another version
+        changed = self.QUADS.replace(b'"2"', b'"3"')
+        self.assertNotEqual(conditional.canonical(changed, sparql.NQUADS),
+                            conditional.canonical(self.QUADS, sparql.NQUADS))
+        self.assertEqual(conditional.canonical(self.QUADS, JSONLD), self.QUADS)
+
+    def test_weak_and_strong_etags(self):
+        strong, weak = conditional.etag(b"a", b"b"), conditional.etag(b"a", b"b", weak=True)
+        self.assertRegex(strong, r'^"[0-9a-f]{32}"$')
+        self.assertEqual(weak, "W/" + strong)
+        # the parts are hashed one by one, moving bytes between them is another representation
+        self.assertNotEqual(conditional.etag(b"ab", b""), strong)
+
+    @override_settings(SPARQL_CACHE=None)
+    async def test_rdf_data_in_other_formats_has_a_strong_etag(self):
+        data = b'{"@id": "http://example.org/a"}'
+        request = RequestFactory().get("/a", headers={"Accept": "application/ld+json"})
+        with mock.patch.object(views.sparql, "fetch_stream", mock.AsyncMock(return_value=data)):
+            response = await views.get_data(request, "a", JSONLD, "application/ld+json", "$resource")
+        self.assertFalse(response["ETag"].startswith("W/"))
+
+        # If-Match compares strongly, a weak ETag doesn't match
+        for validator, status in ((response["ETag"], 200), ("W/" + response["ETag"], 412)):
+            request = RequestFactory().get("/a", headers={"Accept": "application/ld+json", "If-Match": validator})
+            with mock.patch.object(views.sparql, "fetch_stream", mock.AsyncMock(return_value=data)):
+                self.assertEqual((await views.get_data(request, "a", JSONLD, "application/ld+json",
+                                                       "$resource")).status_code, status)
+
+    async def get_html(self, data: bytes, **headers):
+        """the page of http://example.org/a built from data, the number of rendered pages"""
+        request = RequestFactory().get("/a", headers=headers)
+        with mock.patch.object(views.query_plan, "fetch", mock.AsyncMock(return_value=([data], {}))), \
+                mock.patch.object(labels, "fetch", mock.AsyncMock(return_value={})), \
+                mock.patch.object(views, "render_page", wraps=views.render_page) as render_page, \
+                mock.patch.object(conditional.overview_snapshot, "load",
+                                  return_value={"token": "v1", "created": 1700000000.5, "sources": []}):
+            response = await views.get_html(request, "a", views.settings.QUERY)
+        return response, render_page.await_count
+
+    @override_settings(DATASET_BASE="http://example.org/", FRAGMENT_CACHE=None, STREAM_HTML=False, NSFW_GRAPHS=[])
+    async def test_html_pages_are_answered_with_304_before_rendering(self):
+        response, rendered = await self.get_html(self.QUADS)
+        self.assertEqual((response.status_code, rendered), (200, 1))
+        etag = response["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertEqual(response["Last-Modified"], "Tue, 14 Nov 2023 22:13:20 GMT")
+
+        # the same statements in another order, by ETag or by date
+        for headers in ({"If-None-Match": etag}, {"If-None-Match": f'"other", {etag}'},
+                        {"If-Modified-Since": response["Last-Modified"]}):
+            response, rendered = await self.get_html(self.REORDERED, **headers)
+            self.assertEqual((response.status_code, rendered), (304, 0))
+            self.assertEqual(response["ETag"], etag)
+            self.assertEqual(response["Vary"], "Accept, Cookie")
+
+        # changed statements or another selection of graphs are another page
+        response, rendered = await self.get_html(self.QUADS.replace(b'"2"', b'"3"'), **{"If-None-Match": etag})
+        self.assertEqual((response.status_code, rendered), (200, 1))
+        self.assertNotEqual(response["ETag"], etag)
+        request = {"If-None-Match": etag, "Cookie": "hide_graphs=http://example.org/g"}
+        response, rendered = await self.get_html(self.QUADS, **request)
+        self.assertEqual((response.status_code, rendered), (200, 1))
+
+    def test_validators_without_a_snapshot(self):
+        with mock.patch.object(conditional.overview_snapshot, "load", return_value=None):
+            self.assertIsNone(conditional.last_modified())
+            self.assertEqual(conditional.dataset_version(), "")
+            response = conditional.set_validators(HttpResponse(), '"tag"', conditional.last_modified())
+        self.assertEqual(response["ETag"], '"tag"')
+        self.assertNotIn("Last-Modified", response)
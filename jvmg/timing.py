@@ -0,0 +1,222 @@
+"""
+Per-request timings and process-wide metrics.
+
+`TimingMiddleware` starts a `RequestTimings` for every request. The stages of
+the request (sparql queries, parsing, building the view models, rendering,
+elasticsearch, ...) are measured with `span(name)`, other numbers (triples,
+cache hits and misses) are counted with `count(name)`. Concurrent spans of the
+same stage (e.g. the queries of a page) add up.
+
+When the response is complete the timings are
+- sent in the `Server-Timing` header (for streamed responses: the stages before
+  the first byte),
+- logged as one JSON line to the "timing" logger (and to the "slow" logger if
+  the request took longer than `settings.SLOW_LOG_THRESHOLD`),
+- added to the histograms served by the `/metrics` view in the Prometheus text
+  format. They are kept per worker process.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+timing_logger = logging.getLogger("timing")
+slow_logger = logging.getLogger("slow")
+
+
+class RequestTimings:
+    __slots__ = ("start", "durations", "counts")
+
+    def __init__(self):
+        self.start = perf_counter()
+        # stage -> [total duration in seconds, number of spans]
+        self.durations: dict[str, list] = {}
+        self.counts: dict[str, int] = {}
+
+    def add(self, stage: str, duration: float):
+        totals = self.durations.get(stage)
+        if totals is None:
+            self.durations[stage] = [duration, 1]
+        else:
+            totals[0] += duration
+            totals[1] += 1
+
+    def server_timing(self) -> str:
+        return ", ".join(f'{stage};dur={total * 1000:.1f}' for stage, (total, _) in self.durations.items())
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def span(stage: str):
+    """measures the duration of a stage of the current request (if there is one)"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stage, perf_counter() - start)
+
+
+def count(name: str, value: int = 1):
+    """adds value to a counter of the current request (if there is one)"""
+    timings = _current.get()
+    if timings is not None:
+        timings.counts[name] = timings.counts.get(name, 0) + value
+
+
+class Histogram:
+    """a Prometheus histogram with one series per label value"""
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = buckets
+        # label value -> [count per bucket (+Inf last), sum]
+        self.series: dict[str, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, (counts, total) in sorted(self.series.items()):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{label}}} {total}")
+                lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """a Prometheus counter with one series per label value"""
+
+    def __init__(self, name: str, documentation: str, label: str):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.series: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_value: str, value: float = 1):
+        with self.lock:
+            self.series[label_value] = self.series.get(label_value, 0) + value
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_value, value in sorted(self.series.items()):
+                lines.append(f'{self.name}_total{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+SECONDS = tuple(settings.METRICS_DURATION_BUCKETS)
+REQUEST_DURATION = Histogram("jvmg_request_duration_seconds", "Duration of requests per view.", "view", SECONDS)
+STAGE_DURATION = Histogram("jvmg_stage_duration_seconds", "Duration of the stages of requests.", "stage", SECONDS)
+RESPONSE_BYTES = Histogram("jvmg_response_bytes", "Size of response bodies per view.", "view",
+                           tuple(4 ** exponent * 1024 for exponent in range(8)))
+EVENTS = Counter("jvmg_events", "Counted events (triples, cache hits and misses, ...).", "event")
+METRICS = (REQUEST_DURATION, STAGE_DURATION, RESPONSE_BYTES, EVENTS)
+
+
+def expose() -> str:
+    """returns all metrics in the Prometheus text format"""
+    return "\n".join(line for metric in METRICS for line in metric.expose()) + "\n"
+
+
+def finish(request: HttpRequest, response: HttpResponse, timings: RequestTimings, response_bytes: int):
+    """logs the timings of a complete request and adds them to the metrics"""
+    duration = perf_counter() - timings.start
+    match = request.resolver_match
+    view = match.url_name if match is not None and match.url_name else "other"
+
+    REQUEST_DURATION.observe(view, duration)
+    RESPONSE_BYTES.observe(view, response_bytes)
+    for stage, (total, _) in timings.durations.items():
+        STAGE_DURATION.observe(stage, total)
+    for name, value in timings.counts.items():
+        EVENTS.inc(name, value)
+
+    line = json.dumps({
+        "time": time.time(),
+        "method": request.method,
+        "path": request.path,
+        "view": view,
+        "status": response.status_code,
+        "duration": round(duration, 6),
+        "bytes": response_bytes,
+        "stages": {stage: {"duration": round(total, 6), "count": spans}
+                   for stage, (total, spans) in timings.durations.items()},
+        "counts": timings.counts,
+    }, separators=(",", ":"))
+    timing_logger.info(line)
+    if duration > settings.SLOW_LOG_THRESHOLD:
+        slow_logger.info(line)
+
+
+class TimingMiddleware:
+    """measures every request, see the module docstring"""
+    async_capable = True
+    sync_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    async def __call__(self, request: HttpRequest) -> HttpResponse:
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        if settings.SERVER_TIMING and timings.durations:
+            response.headers["Server-Timing"] = timings.server_timing()
+
+        if not response.streaming:
+            finish(request, response, timings, len(response.content))
+            return response
+
+        content = response.streaming_content
+
+        async def measured():
+            response_bytes = 0
+            # the stages of streamed content are part of this request as well
+            _current.set(timings)
+            try:
+                if response.is_async:
+                    async for chunk in content:
+                        response_bytes += len(chunk)
+                        yield chunk
+                else:
+                    for chunk in content:
+                        response_bytes += len(chunk)
+                        yield chunk
+            finally:
+                finish(request, response, timings, response_bytes)
+
+        response.streaming_content = measured()
+        return response
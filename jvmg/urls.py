@@ -5,8 +5,11 @@ from . import views
 urlpatterns = [
     path('applications/search', views.search, name='search'),
     path('applications/get_search_page', views.get_search_page, name='get_search_page'),
+    path('applications/get_back_links', views.get_back_links, name='get_back_links'),
+    path('applications/resources', views.get_resources, name='get_resources'),
     path('applications/crosstab', views.uri_crosstab, name="uri_crosstab"),
     path('overview', views.overview, name="overview"),
+    path('metrics', views.metrics, name="metrics"),
     path('jvmg/<path:path>', views.get_cluster, name="get_cluster"),
     path('<path:path>', views.main, name="main"),
    ]
@@ -1,168 +1,235 @@
-from dataclasses import InitVar, dataclass, field
-from io import StringIO
-from typing import Tuple, Union
-from urllib.error import URLError
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
 from django.http.response import JsonResponse
 from django.shortcuts import render
-from django.http import Http404, HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_vary_headers
+from django.utils.safestring import mark_safe
+from django.core.cache import caches
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
-from SPARQLWrapper import SPARQLWrapper, XML, JSONLD, TURTLE, JSON, CSV
+from elasticsearch import NotFoundError
+from SPARQLWrapper import XML, JSONLD, TURTLE
 import rdflib
-from rdflib import ConjunctiveGraph, Literal, URIRef, BNode
+from rdflib import Literal, URIRef, BNode
 from rdflib.term import Node
 from django.conf import settings
-from time import perf_counter
-import elasticsearch
+from . import (back_links, batch, conditional, crosstab, elastic, fast_render, label_snapshot, labels,
+               overview_snapshot, query_plan, selection, sparql, timing)
+from .cache import make_key
+from .index import TripleIndex
 import logging
 import json
-from csv import DictReader
 
 logger = logging.getLogger("default")
-slow_logger = logging.getLogger("slow")
 
 
-def rewrite_url(url: URIRef) -> URIRef:
-    return URIRef(url.replace(settings.DATASET_BASE, str(settings.WEB_BASE)))
+# compiled once at startup instead of for every label lookup
+LABEL_URIS: tuple[URIRef, ...] = tuple(URIRef(label_uri) for label_uri in settings.LABEL_URIS)
+GRAPH_LABEL_URIS: tuple[URIRef, ...] = tuple(URIRef(label_uri) for label_uri in settings.GRAPH_LABEL_URIS)
+DATASET_BASE: str = settings.DATASET_BASE
+WEB_BASE: str = str(settings.WEB_BASE)
 
 
-@dataclass
+def rewrite_url(url: str) -> str:
+    return url.replace(DATASET_BASE, WEB_BASE)
+
+
+# The view models below are frozen and slotted and hold only plain strings, no rdflib nodes
+# and no reference to the sparql result, so the result can be freed as soon as they are built.
+
+@dataclass(frozen=True, slots=True, order=True)
+class Label:
+    """a label as it is shown, language is "" for labels without language"""
+    text: str
+    language: str
+
+    def __str__(self):
+        return self.text
+
+
+@dataclass(frozen=True, slots=True)
 class Info:
-    item: Union[Node, rdflib.Graph]
-    sparql_result: InitVar[ConjunctiveGraph]
-    uri: URIRef = field(init=False)
-    labels: list[Literal] = field(init=False)
-
-    def __post_init__(self, sparql_result: ConjunctiveGraph):
-        if isinstance(self.item, BNode):
-            self.labels = [Literal(str(self.item))]
-        elif isinstance(self.item, Literal):
-            self.labels = [self.item]
-
-        elif isinstance(self.item, URIRef) or isinstance(self.item, rdflib.Graph):
-            if isinstance(self.item, URIRef):
-                self.uri = self.item
-                label_uris: list[URIRef] = [URIRef(label_uri) for label_uri in settings.LABEL_URIS]
-            else:
-                self.uri = self.item.identifier
-                label_uris: list[URIRef] = [URIRef(label_uri) for label_uri in settings.GRAPH_LABEL_URIS]
-
-            self.labels = []
-            for label_uri in label_uris:
-                for label in set(sparql_result.objects(subject=self.uri, predicate=label_uri)):
-                    if isinstance(label, Literal) and len(label):
-                        self.labels.append(label)
-            if self.labels:
-                self.labels.sort()
-            else:
-                self.labels = [Literal(self.uri)]
+    """label(s) and link of a node, shared by every place the node is shown (see Infos)"""
+    uri: Optional[str]
+    labels: tuple[Label, ...]
+    sort_key: str
 
-            self.uri = rewrite_url(self.uri)
 
+class Infos:
+    """
+    creates the Info objects for the view models of one request.
+    every node is resolved only once, later lookups return the same Info object.
+    equal labels of different nodes share one Label object.
+    only the labels in the languages of the selection are kept.
+    """
+    __slots__ = ("index", "selection", "infos", "labels")
+
+    def __init__(self, index: TripleIndex, selection: selection.Selection = selection.EVERYTHING):
+        self.index = index
+        self.selection = selection
+        self.infos: dict[Union[Node, Tuple[str, Node]], Info] = {}
+        self.labels: dict[Tuple[str, str], Label] = {}
+
+    def __call__(self, node: Node) -> Info:
+        info = self.infos.get(node)
+        if info is None:
+            info = self.infos[node] = self.create(node)
+        return info
+
+    def graph(self, identifier: Node) -> Info:
+        # graphs use other label uris than nodes, so they need their own key
+        key = ("graph", identifier)
+        info = self.infos.get(key)
+        if info is None:
+            info = self.infos[key] = self.create(identifier, GRAPH_LABEL_URIS)
+        return info
+
+    def label(self, text: str, language: Optional[str] = None) -> Label:
+        key = (str(text), language or "")
+        label = self.labels.get(key)
+        if label is None:
+            label = self.labels[key] = Label(*key)
+        return label
 
-@dataclass
-class Blank_node:
-    uri: BNode
-    sparql_result: ConjunctiveGraph
-    info: Info = field(init=False)
-    items: list[Tuple[Info, list[Info]]] = field(init=False)
-
-    def __post_init__(self):
-        self.info = Info(self.uri, self.sparql_result)
-        self.items = []
-
-        for predicate in set(self.sparql_result.predicates(subject=self.uri)):
-            objects = [
-                Info(object, self.sparql_result)
-                for object in self.sparql_result.objects(subject=self.uri, predicate=predicate)
-            ]
-            objects.sort(key=lambda item: "".join(item for item in item.labels))
-            self.items.append((Info(predicate, self.sparql_result), objects))
-
-@dataclass
-class Predicate:
-    graph: rdflib.Graph
-    sparql_result: ConjunctiveGraph
-    uri: Node
-    resource_uri: URIRef
-    is_back_link: bool = False
-    objects: list[Info] = field(init=False)
-    blank_nodes: list[Blank_node] = field(init=False)
-    labels: list[Literal] = field(init=False)
-    info: Info = field(init=False)
-    num_objects: int = field(default=0)
-    num_blank_nodes: int = field(default=0)
-
-    def __post_init__(self):
-        self.info = Info(self.uri, self.sparql_result)
-
-        if self.is_back_link:
-            self.objects = [
-                Info(subject, self.sparql_result)
-                for subject in set(self.graph.subjects(predicate=self.uri, object=self.resource_uri))
-                if not isinstance(subject, BNode)
-            ]
-
-            self.blank_nodes = [
-                Blank_node(uri=bnode, sparql_result=self.sparql_result)
-                for bnode in set(self.graph.subjects(predicate=self.uri, object=self.resource_uri))
-                if isinstance(bnode, BNode)
-            ]
+    def create(self, item: Node, label_uris: tuple[URIRef, ...] = LABEL_URIS) -> Info:
+        if isinstance(item, BNode):
+            return Info(uri=None, labels=(self.label(item),), sort_key=str(item))
+        elif isinstance(item, Literal):
+            return Info(uri=None, labels=(self.label(item, item.language),), sort_key=str(item))
+
+        uri = item
+        # predicates and graphs are labeled by the label snapshot
+        literals = label_snapshot.labels_for(uri, label_uris)
+        if literals is None:
+            literals = self.index.labels_for(uri, label_uris)
+        literals = self.selection.choose(literals)
+
+        if literals:
+            labels = sorted(self.label(literal, literal.language) for literal in literals)
         else:
-            self.objects = [
-                Info(object, self.sparql_result)
-                for object in set(self.graph.objects(predicate=self.uri, subject=self.resource_uri))
-                if not isinstance(object, BNode)
-            ]
+            labels = [self.label(uri)]
+
+        return Info(uri=rewrite_url(uri), labels=tuple(labels), sort_key="".join(label.text for label in labels))
 
-            self.blank_nodes = [
-                Blank_node(uri=bnode, sparql_result=self.sparql_result)
-                for bnode in set(self.graph.objects(predicate=self.uri, subject=self.resource_uri))
-                if isinstance(bnode, BNode)
-            ]
 
+def by_sort_key(item) -> str:
+    return item.sort_key
 
-        self.objects.sort(key=lambda item: "".join(item for item in item.labels))
-        self.blank_nodes.sort(key=lambda item: "".join(item for item in item.info.labels))
-        self.num_objects = len(self.objects)
-        self.num_blank_nodes = len(self.blank_nodes)
 
+@dataclass(frozen=True, slots=True)
+class Blank_node:
+    items: tuple[Tuple[Info, tuple[Info, ...]], ...]
+    # blank node ids differ every time a result is parsed, so blank nodes are sorted by their content
+    sort_key: tuple
+
+    @classmethod
+    def build(cls, node: BNode, infos: Infos) -> "Blank_node":
+        # sorted by predicate, the order of the triples in the result isn't fixed
+        items = tuple(sorted(
+            ((infos(predicate), tuple(sorted(map(infos, objects), key=by_sort_key)))
+             for predicate, objects in infos.index.by_subject.get(node, {}).items()),
+            key=lambda item: item[0].sort_key
+        ))
+        sort_key = tuple((predicate.sort_key, *(object.sort_key for object in objects)) for predicate, objects in items)
+        return cls(items=items, sort_key=sort_key)
+
+
+@dataclass(frozen=True, slots=True)
+class Predicate:
+    uri: str
+    info: Info
+    is_back_link: bool
+    objects: tuple[Info, ...]
+    blank_nodes: tuple[Blank_node, ...]
+    num_objects: int
+    num_blank_nodes: int
+    # set if back-links are paginated and objects only holds the first page of them
+    next_offset: Optional[int] = None
+
+    @classmethod
+    def build(cls, graph: Node, infos: Infos, uri: Node, resource_uri: URIRef,
+              is_back_link: bool = False, total: Optional[int] = None) -> "Predicate":
+        """total is the number of back-links if they are paginated"""
+        index = infos.index
+        if is_back_link:
+            nodes = index.subjects(graph, object=resource_uri, predicate=uri)
+        else:
+            nodes = index.objects(graph, subject=resource_uri, predicate=uri)
 
-@dataclass
+        objects = []
+        blank_nodes = []
+        for node in nodes:
+            if isinstance(node, BNode):
+                blank_nodes.append(Blank_node.build(node, infos))
+            else:
+                objects.append(infos(node))
+        objects.sort(key=by_sort_key)
+        blank_nodes.sort(key=by_sort_key)
+
+        num_objects = len(objects)
+        next_offset = None
+        if total is not None:
+            if total > num_objects:
+                next_offset = num_objects
+            num_objects = total
+
+        return cls(uri=str(uri),
+                   info=infos(uri),
+                   is_back_link=is_back_link,
+                   objects=tuple(objects),
+                   blank_nodes=tuple(blank_nodes),
+                   num_objects=num_objects,
+                   num_blank_nodes=len(blank_nodes),
+                   next_offset=next_offset)
+
+
+@dataclass(frozen=True, slots=True)
 class Graph:
-    graph: rdflib.Graph
-    sparql_result: ConjunctiveGraph
-    resource_uri: URIRef
-    predicates: list[Predicate] = field(init=False)
-    info: Info = field(init=False)
-
-    def __post_init__(self):
-        self.info = Info(self.graph, self.sparql_result)
-
-        self.predicates = [
-            Predicate(graph=self.graph, sparql_result=self.sparql_result, uri=predicate, resource_uri=self.resource_uri)
-            for predicate in set(self.graph.predicates(subject=self.resource_uri))
+    uri: str
+    info: Info
+    predicates: tuple[Predicate, ...]
+
+    @classmethod
+    def build(cls, identifier: Node, infos: Infos, resource_uri: URIRef,
+              back_link_counts: Optional[dict[Node, int]] = None) -> "Graph":
+        """
+        back_link_counts is the number of back-links (URIs) per predicate, if they are paginated.
+        blank nodes linking to the resource are always shown as the blank nodes of their predicate,
+        predicates with only blank nodes aren't counted, see back_links.py
+        """
+        index = infos.index
+        predicates = [
+            Predicate.build(identifier, infos, predicate, resource_uri)
+            for predicate in index.predicates(identifier, subject=resource_uri)
         ]
-        back_links = [
-            Predicate(graph=self.graph,
-                      sparql_result=self.sparql_result,
-                      uri=predicate,
-                      is_back_link=True,
-                      resource_uri=self.resource_uri)
-            for predicate in set(self.graph.predicates(object=self.resource_uri))
-        ]
-        self.predicates.extend(back_links)
-        self.predicates.sort(key=lambda predicate: "".join(label for label in predicate.info.labels))
-
-
-def main(request, path, query=None):
+        if back_link_counts is None:
+            predicates.extend(
+                Predicate.build(identifier, infos, predicate, resource_uri, is_back_link=True)
+                for predicate in index.back_link_predicates(identifier, object=resource_uri)
+            )
+        else:
+            back_link_predicates = dict.fromkeys(back_link_counts)
+            back_link_predicates.update(dict.fromkeys(index.back_link_predicates(identifier, object=resource_uri)))
+            predicates.extend(
+                Predicate.build(identifier, infos, predicate, resource_uri, is_back_link=True,
+                                total=back_link_counts.get(predicate, 0))
+                for predicate in back_link_predicates
+            )
+        predicates.sort(key=lambda predicate: predicate.info.sort_key)
+        return cls(uri=str(identifier), info=infos.graph(identifier), predicates=tuple(predicates))
+
+
+async def main(request, path, query=None):
     """
     main entry point for URI lookups. reads the accept_headers/formats to returns the rdf data as requested.
     this includes:
     - "application/rdf+xml" returns the rdf-data in xml
     - "text/turtle" returns the rdf-data in ttl
     - "application/json" returns the rdf-data in json
+    - "application/n-triples" and "application/n-quads" return the rdf-data as n-triples/n-quads
     - otherwise a html site is created
     """
     # get accept headers
@@ -173,22 +240,21 @@ def main(request, path, query=None):
 
     for accepted_format in accepted_formats:
         if accepted_format == "application/rdf+xml":
-            return get_data(path, XML, "application/rdf+xml", query)
+            return await get_data(request, path, XML, "application/rdf+xml", query)
         elif accepted_format == "text/turtle":
-            return get_data(path, TURTLE, "text/turtle", query)
+            return await get_data(request, path, TURTLE, "text/turtle", query)
         elif accepted_format == "application/json":
-            return get_data(path, JSONLD, "application/json", query)
+            return await get_data(request, path, JSONLD, "application/json", query)
+        elif accepted_format == "application/n-triples":
+            return await get_data(request, path, sparql.NTRIPLES, "application/n-triples", query)
+        elif accepted_format == "application/n-quads":
+            return await get_data(request, path, sparql.NQUADS, "application/n-quads", query)
         else:
-            context = get_data(path, JSONLD, "text/html", query)
-            return render(request, "jvmg/main.html", context)
+            return await get_html(request, path, query)
 
 
-def get_data(path, data_format, content_type, query):
-    """
-    Uses the sparql_query and sparql_endpoint to get the rdf_data (defined in setting.py).
-    Dependent on the data_format and content_type (xml, ttl and jsonld) we return
-    the sparql_result directly or create the following data structure which is used to create HTML.
-    """
+def get_resource_uri(path):
+    """returns the URI of the resource for the requested path, raises Http404 if it isn't a valid URI"""
     resource_uri = URIRef(settings.DATASET_BASE + path)
     url_val = URLValidator()
     try:
@@ -198,51 +264,197 @@ def get_data(path, data_format, content_type, query):
         raise Http404
 
     logger.info(f"uri: {resource_uri}")
+    return resource_uri
 
-    # we don't use format() to avoid escaping all the curly braces in sparql queries
-    query = query.replace("$resource", resource_uri)
-
-    sparql = SPARQLWrapper(settings.SPARQL_ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(data_format)
-    start = perf_counter()
-    try:
-        sparql_result = sparql.query().convert()
-    except URLError as e:
-        logger.error(f"No connection to sparql endpoint: {settings.SPARQL_ENDPOINT}!")
-        raise e
 
-    if len(sparql_result) == 0:
+async def get_data(request, path, data_format, content_type, query):
+    """
+    Uses the sparql_query and sparql_endpoint to get the rdf_data (defined in setting.py).
+    The rdf formats (xml, ttl, jsonld, ...) are sent as returned by the sparql endpoint,
+    big results are streamed through. Complete results get an ETag, so clients can revalidate them.
+    Graphs are only left out if the request asks for it (see selection.py).
+    """
+    resource_uri = get_resource_uri(path)
+    shown = selection.from_request(request)
+
+    # we don't use format() to avoid escaping all the curly braces in sparql queries,
+    # $resource is replaced with str.replace() below
+    result = await sparql.fetch_stream(resource_uri,
+                                       shown.apply(query.replace("$resource", resource_uri)),
+                                       data_format)
+    if isinstance(result, bytes) and sparql.is_empty(result, data_format):
+        logger.warning(f"No data for {resource_uri}")
+        raise Http404
+    # a streamed result isn't known before it is sent, so it can't have an ETag
+    if not isinstance(result, bytes):
+        response = StreamingHttpResponse(result, content_type=content_type)
+        # the format is negotiated and the hidden graphs may be chosen with a cookie
+        patch_vary_headers(response, ["Accept", "Cookie"])
+        return response
+
+    # the statements may come in another order, the same data only gets the same weak ETag
+    etag = conditional.etag(content_type.encode("utf-8"), conditional.canonical(result, data_format),
+                            weak=data_format in (sparql.NTRIPLES, sparql.NQUADS))
+    last_modified = conditional.last_modified()
+    response = conditional.not_modified(request, etag, last_modified) or HttpResponse(result, content_type=content_type)
+    patch_vary_headers(response, ["Accept", "Cookie"])
+    return conditional.set_validators(response, etag, last_modified)
+
+
+async def get_html(request, path, query):
+    """
+    creates the html page of a resource. it is answered with 304 (before parsing anything)
+    if the client has the current version already. the rendered graph sections are
+    cached in settings.FRAGMENT_CACHE, keyed by the ETag of the page. hidden graphs and
+    labels in other languages than the chosen ones are left out (see selection.py).
+    """
+    resource_uri = get_resource_uri(path)
+    shown = selection.for_page(request)
+    data, back_link_counts = await query_plan.fetch(resource_uri, query, shown)
+    if not back_link_counts and all(sparql.is_empty(part, settings.HTML_RESULT_FORMAT) for part in data):
         logger.warning(f"No data for {resource_uri}")
         raise Http404
 
-    query_time = perf_counter() - start
-    if query_time > settings.SLOW_LOG_THRESHOLD:
-        slow_logger.info(f"uri: {resource_uri} time: {query_time}")
-
-    # if content_type is not json, send
-    if content_type == "application/rdf+xml" or content_type == "text/turtle" or content_type == "application/json":
-        return HttpResponse(sparql_result, content_type=content_type)
-
-    graphs = [
-        Graph(graph=graph, sparql_result=sparql_result, resource_uri=resource_uri)
-        for graph in sparql_result.contexts()
-        if not isinstance(graph.identifier, BNode)
-    ]
-    graphs.sort(key=lambda graph: graph.info.labels)
+    counts = repr(sorted(back_link_counts.items())) if back_link_counts else ""
+    etag = conditional.etag(conditional.template_version().encode("utf-8"),
+                            conditional.dataset_version().encode("utf-8"),
+                            resource_uri.encode("utf-8"),
+                            shown.key().encode("utf-8"),
+                            counts.encode("utf-8"),
+                            *(conditional.canonical(part, settings.HTML_RESULT_FORMAT) for part in data))
+    last_modified = conditional.last_modified()
+    response = conditional.not_modified(request, etag, last_modified)
+    if response is None:
+        response = await render_page(request, resource_uri, etag, data, back_link_counts,
+                                     query_plan.label_free(query), shown)
+    # the format is negotiated and the hidden graphs and languages may be chosen with cookies
+    patch_vary_headers(response, ["Accept", "Cookie"])
+    return conditional.set_validators(response, etag, last_modified)
 
-    context = {}
-    context["resource_label"] = Info(resource_uri, sparql_result)
-    context["resource_uri"] = resource_uri
-    context["URI_data"] = graphs
-    context["nsfw_graphs"] = settings.NSFW_GRAPHS
 
-    return context
+# text in front of each graph section in main.html, used when the page is streamed
+GRAPH_SEPARATOR = "\n  <hr>\n  "
 
 
-def get_cluster(request, path):
+async def render_page(request, resource_uri, etag, data, back_link_counts, fetch_labels, shown):
+    """
+    renders main.html. the graph sections are taken from settings.FRAGMENT_CACHE if all of
+    them are cached, otherwise they are rendered and cached. if settings.STREAM_HTML is set
+    the page is streamed: the head of the page is sent right away and each graph section
+    as soon as it is rendered.
+    """
+    cache = caches[settings.FRAGMENT_CACHE] if settings.FRAGMENT_CACHE is not None else None
+    page_key = make_key("page", resource_uri, etag)
+    if cache is not None:
+        page = await cache.aget(page_key)
+        if page is not None:
+            fragment_keys = [make_key("fragment", resource_uri, graph, etag) for graph in page["graphs"]]
+            fragments = await cache.aget_many(fragment_keys)
+            if len(fragments) == len(fragment_keys):
+                timing.count("cache_hit.fragments")
+                return render(request, "jvmg/main.html", {
+                    "resource_label": page["resource_label"],
+                    "resource_uri": resource_uri,
+                    "graph_fragments": [mark_safe(fragments[key]) for key in fragment_keys],
+                    "hidden_graphs": sorted(shown.hidden_graphs),
+                    "label_languages": settings.LABEL_LANGUAGES,
+                })
+
+        timing.count("cache_miss.fragments")
+
+    context = {
+        "resource_uri": resource_uri,
+        "hidden_graphs": sorted(shown.hidden_graphs),
+        "label_languages": settings.LABEL_LANGUAGES,
+    }
+
+    async def store(fragments):
+        if cache is not None:
+            await cache.aset_many({
+                make_key("fragment", resource_uri, graph, etag): fragment for graph, fragment in fragments
+            })
+            await cache.aset(page_key, {
+                "resource_label": context["resource_label"],
+                "graphs": [graph for graph, _ in fragments],
+            })
+
+    if settings.STREAM_HTML:
+        async def stream():
+            # the head doesn't depend on the sparql result, it is sent before parsing it
+            yield render_to_string("jvmg/main_head.html", context, request)
+            context["resource_label"], graphs = await build_graphs(resource_uri, data, back_link_counts, fetch_labels, shown)
+            yield render_to_string("jvmg/main_title.html", context, request)
+            fragments = []
+            for graph, fragment in render_graphs(graphs):
+                fragments.append((graph, fragment))
+                yield GRAPH_SEPARATOR + fragment + "\n"
+            yield "\n" + render_to_string("jvmg/main_foot.html", context, request)
+            await store(fragments)
+
+        return StreamingHttpResponse(stream(), content_type="text/html; charset=utf-8")
+
+    context["resource_label"], graphs = await build_graphs(resource_uri, data, back_link_counts, fetch_labels, shown)
+    fragments = list(render_graphs(graphs))
+    await store(fragments)
+    context["graph_fragments"] = [mark_safe(fragment) for _, fragment in fragments]
+    return render(request, "jvmg/main.html", context)
+
+
+def render_graphs(graphs):
+    """yields the uri and the rendered html section of each graph, each view model is built right before it is rendered"""
+    graphs = iter(graphs)
+    while True:
+        with timing.span("models"):
+            graph = next(graphs, None)
+        if graph is None:
+            return
+        with timing.span("render"):
+            fragment = render_graph(graph)
+        yield graph.uri, fragment
+
+
+def render_graph(graph):
+    """renders the html section of a graph, with the fast renderer if settings.FAST_GRAPH_RENDERER is set"""
+    if settings.FAST_GRAPH_RENDERER:
+        return fast_render.graph_html(graph)
+    return render_to_string("jvmg/graph.html", {"graph": graph})
+
+
+async def build_graphs(resource_uri, data, back_link_counts, fetch_labels, shown):
+    """
+    parses the sparql results and returns the Info of the resource and a generator of the
+    Graph view models, in the order they are shown. each Graph is only built when the
+    generator gets to it. if fetch_labels is set, the labels of all URIs which have none
+    in the results are looked up (see labels.py). the graphs hidden by shown are left out.
+    """
+    counts_by_graph: dict[Node, dict[Node, int]] = {}
+    if back_link_counts is not None:
+        for (graph, predicate), count in back_link_counts.items():
+            counts_by_graph.setdefault(graph, {})[predicate] = count
+
+    index = sparql.parse_index(data, settings.HTML_RESULT_FORMAT)
+    if fetch_labels:
+        index.add_labels(await labels.fetch(
+            (uri for uri in index.uris() - index.labels.keys() if not label_snapshot.known(uri)), shown
+        ))
+    infos = Infos(index, shown)
+    # the default graph (labels, ...) isn't shown, nor are the hidden graphs if the query has no $graph_filter
+    contexts = [graph for graph in index.contexts() if not isinstance(graph, BNode) and shown.shows_graph(graph)]
+    contexts.sort(key=lambda graph: infos.graph(graph).labels)
+    graphs = (
+        Graph.build(graph,
+                    infos,
+                    resource_uri,
+                    back_link_counts=None if back_link_counts is None else counts_by_graph.get(graph, {}))
+        for graph in contexts
+    )
+
+    return infos(resource_uri), graphs
+
+
+async def get_cluster(request, path):
     """returns a matched rdf cluster"""
-    return main(request, f"jvmg/{path}", query=settings.QUERY_CLUSTER)
+    return await main(request, f"jvmg/{path}", query=settings.QUERY_CLUSTER)
 
 
 def get_label_for(uri, res):
@@ -254,11 +466,9 @@ def get_label_for(uri, res):
         return label
 
 
-def search(request):
+async def search(request):
     context = {}
     if "search" in request.GET:
-        es = elasticsearch.Elasticsearch(settings.ELASTICSEARCH)
-
         checked = []
         search_type = "match"
         print(request.GET)
@@ -270,18 +480,13 @@ def search(request):
                 continue
             checked.extend(request.GET.getlist(key))
 
-        facets = {"type": {"terms": {"field": "type", "size": 10000}},
-                  "graph": {"terms": {"field": "graph", "size": 10000}}}
-
-        facet_res = es.search(index=settings.SEARCH_INDEX,
-                              query={search_type: {"label": request.GET["search"]}},
-                              aggregations=facets,
-                              size=0)
+        # the checkboxes show the facets of the unfiltered search
+        facets = await elastic.facets(request.GET["search"], search_type, {})
 
         context = {
             "search": request.GET["search"],
-            "total": facet_res["hits"]["total"]["value"],
-            "aggs": facet_res["aggregations"],
+            "total": facets["total"],
+            "facets": facets["facets"],
             "checked": checked,
             "search_type": search_type
         }
@@ -289,132 +494,138 @@ def search(request):
 
 
 @csrf_exempt
-def get_search_page(request):
+async def get_search_page(request):
+    """
+    returns one page of search results as json. the first page also contains the
+    facets for the checked filters, later pages only the hits.
+    pages are requested either by "page" number or, for deep pagination, by "cursor":
+    null for the first page, afterwards the "cursor" of the previous response.
+    """
     if request.method != "POST":
         return JsonResponse({"error": "invalid request"}, status=404)
     else:
         body = json.loads(request.body)
-        es = elasticsearch.Elasticsearch(settings.ELASTICSEARCH)
-
-        search_filter = []
-        search_type = body["search_type"]
-        for key, items in body["checkboxes"].items():
-            search_filter.append({"terms": {key: items}})
-
-        if search_filter:
-            query = {"bool":
-                     {"must":
-                      [
-                          {search_type: {"label": body["search"]}}
-                      ],
-                      "filter": [{"bool": {"must": search_filter}}]
-                      }}
+        if "cursor" in body:
+            try:
+                result = await elastic.cursor_page(body["search"], body["search_type"], body["checkboxes"], body["cursor"])
+            except elastic.InvalidCursor:
+                return JsonResponse({"error": "invalid cursor"}, status=400)
+            except NotFoundError:
+                return JsonResponse({"error": "cursor expired"}, status=410)
         else:
-            query = {"bool":
-                     {"must":
-                      [
-                          {search_type: {"label": body["search"]}}
-                      ]}}
-
-        facets = {"type": {"terms": {"field": "type", "size": 10000}},
-                  "graph": {"terms": {"field": "graph", "size": 10000}}}
-
-        search_res = es.search(query=query,
-                               index=settings.SEARCH_INDEX,
-                               highlight={"fields": {"label" : { "pre_tags" : ["<mark>"], "post_tags" : ["</mark>"] }}},
-                               from_=settings.ELASTICSEARCH_PAGE_SIZE * int(body["page"]),
-                               size=settings.ELASTICSEARCH_PAGE_SIZE,
-                               aggregations=facets)
-
-        if search_res["hits"]["total"]["value"] == 0:
+            result = await elastic.page(body["search"], body["search_type"], body["checkboxes"], int(body["page"]))
+
+        if result["total"] == 0:
             return JsonResponse({"error": "no data found"}, status=404)
 
-        hits = []
-        for entry in search_res["hits"]["hits"]:
-            for key in entry["_source"]:
-                if key in entry["highlight"]:
-                    entry["_source"][key] = entry["highlight"][key]
+        del result["total"]
+        return JsonResponse(result)
 
-            hits.append(entry["_source"])
 
-        facets = {}
-        for key in search_res["aggregations"]:
-            if key not in facets:
-                facets[key] = {}
+async def get_back_links(request):
+    """
+    returns a page of back-links of a resource (for one graph and predicate) as json.
+    used by the resource page to load more back-links than the first page. it only
+    contains URIs, blank nodes are all on the resource page (see back_links.py).
+    """
+    try:
+        uris = [request.GET["resource"], request.GET["graph"], request.GET["predicate"]]
+        offset = int(request.GET.get("offset", 0))
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "invalid request"}, status=400)
+
+    if offset < 0 or not all(back_links.is_valid_uri(uri) for uri in uris):
+        return JsonResponse({"error": "invalid request"}, status=400)
+    resource_uri, graph, predicate = map(URIRef, uris)
+
+    page = await back_links.fetch_page(resource_uri, graph, predicate, offset)
+    infos = Infos(sparql.parse_index([page], settings.HTML_RESULT_FORMAT), selection.for_page(request))
+    subjects = infos.index.subjects(graph, object=resource_uri, predicate=predicate)
+    items = sorted((infos(subject) for subject in subjects if not isinstance(subject, BNode)),
+                   key=lambda item: item.sort_key)
+
+    if len(subjects) < settings.BACK_LINK_PAGE_SIZE:
+        next_offset = None
+    else:
+        next_offset = offset + len(subjects)
 
-            for item in search_res["aggregations"][key]["buckets"]:
-                if item["key"] not in facets[key]:
-                    facets[key][item["key"]] = {}
+    return JsonResponse({
+        "items": [
+            {"uri": item.uri, "labels": [{"label": label.text, "lang": label.language or None} for label in item.labels]}
+            for item in items
+        ],
+        "next_offset": next_offset
+    })
 
-                facets[key][item["key"]] = item["doc_count"]
 
-        return JsonResponse({
-            "hits": hits,
-            "facets": facets
-        })
+@csrf_exempt
+async def get_resources(request):
+    """
+    batch lookup of many resources, like GET /<path> for each of them but with one query
+    per settings.BATCH_CHUNK_SIZE resources (see batch.py). the request is a json object
+    {"resources": [path, ...], "format": "nquads" or "json-ld" (default)}, the response
+    {"resources": {uri: {"status": 200, "data": ...}}}. data is a string of n-quads or a
+    json-ld document. resources without triples get status 404, invalid paths status 400.
+    graphs are only left out if the request asks for it, like for GET (see selection.py).
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "invalid request"}, status=404)
+    try:
+        body = json.loads(request.body)
+        paths = body["resources"]
+        data_format = body.get("format", "json-ld")
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "invalid request"}, status=400)
+    if (not isinstance(paths, list) or not all(isinstance(path, str) for path in paths)
+            or data_format not in ("nquads", "json-ld")):
+        return JsonResponse({"error": "invalid request"}, status=400)
+    if len(paths) > settings.BATCH_MAX_RESOURCES:
+        return JsonResponse({"error": f"at most {settings.BATCH_MAX_RESOURCES} resources per request"}, status=400)
+
+    uris = list(dict.fromkeys(settings.DATASET_BASE + path for path in paths))
+    valid = [uri for uri in uris if back_links.is_valid_uri(uri)]
+    lines = await batch.fetch(valid, selection.from_request(request))
+
+    resources = {}
+    for uri in uris:
+        if uri not in lines:
+            resources[uri] = {"status": 400}
+        elif not lines[uri]:
+            resources[uri] = {"status": 404}
+        elif data_format == "nquads":
+            resources[uri] = {"status": 200, "data": "\n".join(lines[uri]) + "\n"}
+        else:
+            resources[uri] = {"status": 200, "data": batch.to_jsonld(lines[uri])}
+    return JsonResponse({"resources": resources})
 
 
-def uri_crosstab(request):
+async def uri_crosstab(request):
     """
     gathers data about an URI to create a crosstab.
     """
-    resource_uri = URIRef(request.GET["uri"])
-    query = f"""PREFIX label: <http://www.w3.org/2000/01/rdf-schema#label>
-    SELECT ?value ?v_label ?property ?p_label (count(?value) as ?count)
-    WHERE {{
-      ?entity ?anything <{resource_uri}> .
-      ?entity ?property ?value.
-      OPTIONAL {{?value label: ?v_label.}} .
-      OPTIONAL {{?property label: ?p_label.}} .
-    }} GROUP BY ?value ?v_label ?property ?p_label
-    ORDER BY DESC(?count)
-    """
-    sparql = SPARQLWrapper(settings.SPARQL_ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    result = sparql.query().convert()
-
-    trait_count = []
-    for entry in result["results"]["bindings"]:
-        try:
-            property_label = entry["p_label"]["value"]
-        except Exception as e:
-            property_label = entry["property"]["value"]
-
-        try:
-            value_label = entry["v_label"]["value"]
-        except Exception as e:
-            value_label = entry["value"]["value"]
-
-        trait_count.append({"count": int(entry["count"]["value"]),
-                            "value_label": value_label,
-                            "property": rewrite_url(entry["property"]["value"]),
-                            "property_label": property_label,
-                            "value": rewrite_url(entry["value"]["value"])})
+    resource_uri = request.GET.get("uri", "")
+    if not back_links.is_valid_uri(resource_uri):
+        return HttpResponse("invalid uri", status=400)
+
+    table = [
+        {**row, "property": rewrite_url(row["property"]), "value": rewrite_url(row["value"])}
+        for row in await crosstab.crosstab(resource_uri)
+    ]
 
     context = {}
-    context["table"] = trait_count
+    context["table"] = table
     context["resource_label"] = resource_uri
     return render(request, "jvmg/count_table.html", context)
 
 
-def overview(request):
-    sparql = SPARQLWrapper(settings.SPARQL_ENDPOINT)
-    sparql.setQuery(settings.QUERY_OVERVIEW)
-    sparql.setReturnFormat(CSV)
-    result = sparql.query().convert()
-    data = list(DictReader(StringIO(result.decode("utf-8"))))
-    group_by_graph = {}
-    for item in data:
-        if not item["graph_label"]:
-            item["graph_label"] = "<no graph found>"
-        if item["graph"] not in group_by_graph:
-            group_by_graph[item["graph"]] = []
-        group_by_graph[item["graph"]].append(item)
-        item["order"] = int(item["order"])
-        item["count"] = int(item["count"])
-
-    for item in group_by_graph.values():
-        item.sort(key=lambda i: i["order"])
-
-    return render(request, "jvmg/overview.html", context={"sources": group_by_graph.values()})
+async def overview(request):
+    """serves the overview from its snapshot, it is only built here if there is none yet"""
+    snapshot = overview_snapshot.load()
+    if snapshot is None:
+        snapshot = await overview_snapshot.build_once()
+    return render(request, "jvmg/overview.html", context={"sources": snapshot["sources"]})
+
+
+async def metrics(request):
+    """the metrics of this worker process in the Prometheus text format, see timing.py"""
+    return HttpResponse(timing.expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
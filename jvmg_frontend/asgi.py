@@ -13,4 +13,25 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jvmg_frontend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from jvmg import overview_snapshot  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """
+    the django application. the overview and label snapshots are refreshed in the background
+    of the server (not of management commands or tests importing this module): the refresher is
+    started by the lifespan startup of the server, or by the first request if it has no lifespan.
+    """
+    if scope["type"] != "lifespan":
+        overview_snapshot.start_refresher()
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            overview_snapshot.start_refresher()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
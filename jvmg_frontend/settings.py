@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'jvmg.timing.TimingMiddleware',
+    'jvmg.stale.StaleMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +85,64 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # results of the sparql endpoint, kept on disk (shared by all workers of the host, across
+    # restarts, see jvmg/result_store.py). TIMEOUT is the time-to-live in seconds, results of an
+    # older version of the dataset (see jvmg/overview_snapshot.py) are dropped before. beyond
+    # MAX_ENTRIES results or MAX_BYTES (compressed) the least recently read are evicted
+    'sparql': {
+        'BACKEND': 'jvmg.result_store.ResultStore',
+        'LOCATION': os.path.join(BASE_DIR, 'result_store', 'sparql.sqlite3'),
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': 1024 * 1024 * 1024,
+            'MMAP_SIZE': 256 * 1024 * 1024,
+            'DATASET_VERSION': 'jvmg.conditional.dataset_version',
+        },
+    },
+    # rendered graph sections of resource pages, keyed by the ETag of the page
+    'fragments': {
+        'BACKEND': 'jvmg.result_store.ResultStore',
+        'LOCATION': os.path.join(BASE_DIR, 'result_store', 'fragments.sqlite3'),
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 200000,
+            'MAX_BYTES': 512 * 1024 * 1024,
+            'MMAP_SIZE': 256 * 1024 * 1024,
+            'DATASET_VERSION': 'jvmg.conditional.dataset_version',
+        },
+    },
+    # facets (hits per type and graph) of searches, they only need to live while
+    # the user scrolls through the results
+    'search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    # last known good results of the sparql endpoint, served while it is unavailable.
+    # they are kept on disk (shared by all workers, across restarts) and never expire
+    'stale': {
+        'BACKEND': 'jvmg.result_store.ResultStore',
+        'LOCATION': os.path.join(BASE_DIR, 'result_store', 'stale.sqlite3'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': 1024 * 1024 * 1024,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -123,8 +183,43 @@ STATIC_URL = '/static/'
 # STATIC_ROOT = '/opt/static/'
 
 # project specific
-SLOW_LOG_THRESHOLD = 1.0 # threshold for slow log: how long (in seconds) a query can take until it is logged into the slow log 
+SLOW_LOG_THRESHOLD = 1.0 # threshold for slow log: how long (in seconds) a request can take until it is logged into the slow log
+SERVER_TIMING = True # send the durations of the stages of each request in the Server-Timing header
+METRICS_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # histogram buckets (in seconds) of /metrics
 SPARQL_ENDPOINT = "http://localhost:3030/jvmg/sparql"
+# replicas of the sparql endpoint with the same data, queries are spread over them (see jvmg/endpoints.py)
+SPARQL_ENDPOINTS = [SPARQL_ENDPOINT]
+SPARQL_ROUTING = "least_outstanding" # or "latency": lowest average latency times the number of running queries
+# kinds of queries (see SPARQL_QUERY_TIMEOUTS) which are only sent to some of the endpoints,
+# e.g. {"crosstab": ["http://replica-2:3030/jvmg/sparql"], "overview": ["http://replica-2:3030/jvmg/sparql"]}
+SPARQL_PINNED = {}
+SPARQL_HEALTH_CHECK_INTERVAL = 10.0 # seconds between two health checks of every endpoint, None disables them
+SPARQL_HEALTH_CHECK_TIMEOUT = 2.0 # seconds a health check may take
+SPARQL_HEALTH_CHECK_QUERY = "ASK {}"
+SPARQL_CACHE = "sparql" # cache (see CACHES) for sparql results, None disables caching
+SPARQL_CACHE_MAX_BYTES = 5 * 1024 * 1024 # results bigger than this (in bytes) are not cached, but streamed
+SPARQL_STREAM_CHUNK_SIZE = 64 * 1024 # chunk size (in bytes) of streamed rdf results
+FRAGMENT_CACHE = "fragments" # cache (see CACHES) for rendered graph sections of resource pages, None disables caching
+FAST_GRAPH_RENDERER = True # render graph sections with jvmg/fast_render.py instead of the graph.html include chain
+STREAM_HTML = True # send the head of resource pages right away and each graph section as soon as it is rendered
+HTML_RESULT_FORMAT = "nquads" # format of the sparql results html pages are built from: "nquads" or "json-ld"
+SPARQL_POOL_SIZE = 20 # max. number of (keep-alive) connections to each sparql endpoint per worker
+SPARQL_TIMEOUT = 60.0 # timeout (in seconds) for reading the response of the sparql endpoint
+SPARQL_CONNECT_TIMEOUT = 5.0 # timeout (in seconds) for connecting to the sparql endpoint
+# max. time (in seconds) a query may take until its result is read completely (for streamed
+# results: until streaming starts), by kind of query. slower queries fail
+SPARQL_QUERY_TIMEOUTS = {
+    "default": 15.0, # resource pages and rdf data
+    "labels": 10.0,
+    "crosstab": 30.0,
+    "batch": 30.0,
+    "overview": 120.0,
+    "label_snapshot": 120.0,
+}
+SPARQL_BREAKER_FAILURES = 5 # failed (or slow) queries in a row after which queries aren't sent to the endpoint anymore
+SPARQL_BREAKER_SLOW = 0.5 # queries taking longer than this fraction of their timeout count as failed
+SPARQL_BREAKER_RESET = 30.0 # seconds until a query is sent to the endpoint again to test if it recovered
+STALE_CACHE = "stale" # cache (see CACHES) for the last known good results, None disables serving stale results
 DATASET_BASE = "http://mediagraph.link/"
 #WEB_BASE = "http://mediagraph.link/"
 WEB_BASE = "http://127.0.0.1:8003/"
@@ -133,7 +228,13 @@ GRAPH_LABEL_URIS = ["http://mediagraph.link/jvmg/ont/shortLabel"]
 
 # graphs which should not be displayed by default
 NSFW_GRAPHS = ["http://mediagraph.link/graph/vndb_nsfw"]
+# languages offered by the language switcher besides those of the labels on a page
+LABEL_LANGUAGES = ["en", "ja", "ja-latn"]
 
+# in QUERY and the queries below $graph_filter is replaced with a FILTER on ?graph which
+# leaves out the graphs the user hid (see jvmg/selection.py), or with nothing. it is outside
+# of the GRAPH ?graph { } blocks, ?graph isn't bound inside of them. $other_graph_filter
+# is the same FILTER on ?other_graph
 QUERY = """
 PREFIX label: <http://www.w3.org/2000/01/rdf-schema#label>
 PREFIX graph_label: <http://mediagraph.link/jvmg/ont/shortLabel>
@@ -163,6 +264,7 @@ CONSTRUCT {
     OPTIONAL { ?graph graph_label: ?graph_label}
     OPTIONAL { ?o label: ?o_label}
     OPTIONAL { ?p label: ?p_label}
+    $graph_filter
   }
   UNION
   {
@@ -172,10 +274,141 @@ CONSTRUCT {
     }
     OPTIONAL { ?s label: ?s_label}
     OPTIONAL { ?p label: ?p_label}
+    $graph_filter
   }
 }
 """
 
+BATCH_CHUNK_SIZE = 100 # max. number of resources per query of the batch lookup (QUERY once per resource), the chunks of a request run concurrently
+BATCH_MAX_RESOURCES = 1000 # max. number of resources per batch lookup request
+
+# Back-links (triples with the resource as object) are loaded page by page on html pages,
+# BACK_LINK_PAGE_SIZE is the number of back-links per graph and predicate shown at first.
+# Set it to None to load all back-links at once with QUERY.
+BACK_LINK_PAGE_SIZE = 100
+
+# QUERY without the back-links, used instead of QUERY if back-links are paginated
+QUERY_FORWARD = """
+PREFIX label: <http://www.w3.org/2000/01/rdf-schema#label>
+PREFIX graph_label: <http://mediagraph.link/jvmg/ont/shortLabel>
+
+CONSTRUCT {
+  Graph ?graph {
+    ?s ?p ?o .
+    ?o ?p_blank ?o_blank .
+    ?graph graph_label: ?graph_label .
+    ?p_blank label: ?p_blank_label .
+    ?o_blank label: ?o_blank_label .
+  }
+  ?s label: ?s_label .
+  ?p label: ?p_label .
+  ?o label: ?o_label .
+
+} where {
+  GRAPH ?graph {
+    ?s ?p ?o . filter(?s = <$resource>)
+    OPTIONAL { ?o ?p_blank ?o_blank filter isBlank(?o)
+      OPTIONAL { ?p_blank label: ?p_blank_label }
+      OPTIONAL { ?o_blank label: ?o_blank_label }
+    }
+  }
+  OPTIONAL { ?graph graph_label: ?graph_label}
+  OPTIONAL { ?s label: ?s_label}
+  OPTIONAL { ?o label: ?o_label}
+  OPTIONAL { ?p label: ?p_label}
+  $graph_filter
+}
+"""
+
+# QUERY split into independent parts without labels, which are sent to the sparql endpoint concurrently,
+# so a page takes as long as its slowest part instead of all of them. the labels of all URIs of the
+# result are fetched afterwards with QUERY_LABELS. they are used instead of QUERY (QUERY_FORWARD) for
+# html pages, "back_links" is left out if back-links are paginated.
+# set QUERY_PLAN = None to use QUERY (e.g. after changing it).
+QUERY_PLAN = {
+    # triples of the resource
+    "forward": """
+CONSTRUCT {
+  Graph ?graph { ?s ?p ?o . }
+} where {
+  GRAPH ?graph { ?s ?p ?o . filter(?s = <$resource>) }
+  $graph_filter
+}
+""",
+    # triples of blank nodes linked by the resource
+    "blank_nodes": """
+CONSTRUCT {
+  Graph ?graph { ?o ?p_blank ?o_blank . }
+} where {
+  GRAPH ?graph {
+    <$resource> ?p ?o . filter isBlank(?o)
+    ?o ?p_blank ?o_blank .
+  }
+  $graph_filter
+}
+""",
+    # triples with the resource as object
+    "back_links": """
+CONSTRUCT {
+  Graph ?graph { ?s ?p ?o . }
+} where {
+  GRAPH ?graph { ?s ?p ?o . filter(?o = <$resource>) }
+  $graph_filter
+}
+""",
+}
+
+# number of back-links (?count) per ?graph and ?predicate, blank nodes aren't paginated (see jvmg/back_links.py)
+QUERY_BACK_LINK_COUNTS = """
+SELECT ?graph ?predicate (COUNT(?s) AS ?count) WHERE {
+  GRAPH ?graph { ?s ?predicate <$resource> . filter(!isBlank(?s)) }
+  $graph_filter
+} GROUP BY ?graph ?predicate
+"""
+
+# blank nodes linking to the resource, fetched at once (like QUERY does) next to the paginated back-links
+QUERY_BACK_LINK_BLANK_NODES = """
+PREFIX label: <http://www.w3.org/2000/01/rdf-schema#label>
+PREFIX graph_label: <http://mediagraph.link/jvmg/ont/shortLabel>
+
+CONSTRUCT {
+  Graph ?graph {
+    ?s ?p ?o .
+    ?graph graph_label: ?graph_label .
+  }
+  ?p label: ?p_label .
+} where {
+  GRAPH ?graph { ?s ?p ?o . filter(?o = <$resource> && isBlank(?s)) }
+  OPTIONAL { ?graph graph_label: ?graph_label}
+  OPTIONAL { ?p label: ?p_label}
+  $graph_filter
+}
+"""
+
+# one page of back-links for a graph and predicate, $limit and $offset are replaced as well
+QUERY_BACK_LINK_PAGE = """
+PREFIX label: <http://www.w3.org/2000/01/rdf-schema#label>
+PREFIX graph_label: <http://mediagraph.link/jvmg/ont/shortLabel>
+
+CONSTRUCT {
+  Graph <$graph> {
+    ?s <$predicate> <$resource> .
+  }
+  ?s label: ?s_label .
+  <$predicate> label: ?p_label .
+  <$graph> graph_label: ?graph_label .
+} where {
+  {
+    SELECT ?s WHERE {
+      GRAPH <$graph> { ?s <$predicate> <$resource> . filter(!isBlank(?s)) }
+    } ORDER BY ?s LIMIT $limit OFFSET $offset
+  }
+  OPTIONAL { ?s label: ?s_label}
+  OPTIONAL { <$predicate> label: ?p_label}
+  OPTIONAL { <$graph> graph_label: ?graph_label}
+}
+"""
+
 QUERY_CLUSTER = """
 PREFIX label: <http://www.w3.org/2000/01/rdf-schema#label>
 PREFIX graph_label: <http://mediagraph.link/jvmg/ont/shortLabel>
@@ -214,17 +447,68 @@ CONSTRUCT {
         OPTIONAL { ?other_graph graph_label: ?other_graph_label}
         OPTIONAL { ?p_other label: ?p_other_label}
         OPTIONAL { ?o_other label: ?o_other_label}
+        $other_graph_filter
       }
     }
+    $graph_filter
   } UNION {
     GRAPH ?graph {?s ?p ?o . filter(?o = <$resource>)}
     OPTIONAL { ?graph graph_label: ?graph_label}
     OPTIONAL { ?s label: ?s_label}
     OPTIONAL { ?p label: ?p_label}
+    $graph_filter
   }
 }
 """
 
+# QUERY_CLUSTER split into independent parts without labels, like QUERY_PLAN.
+# set QUERY_CLUSTER_PLAN = None to use QUERY_CLUSTER.
+QUERY_CLUSTER_PLAN = {
+    # triples of the cluster
+    "forward": """
+CONSTRUCT {
+  Graph ?graph { ?s ?p ?o . }
+} where {
+  GRAPH ?graph { ?s ?p ?o . filter(?s = <$resource>) }
+  $graph_filter
+}
+""",
+    # triples of the members of the cluster, shown as triples of the cluster
+    "members": """
+PREFIX has_member: <http://mediagraph.link/jvmg/ont/hasMember>
+
+CONSTRUCT {
+  Graph ?graph { <$resource> ?p_other ?o_other . }
+} where {
+  <$resource> has_member: ?o .
+  GRAPH ?graph { ?o ?p_other ?o_other . }
+  $graph_filter
+}
+""",
+    # triples of blank nodes linked by the members
+    "member_blank_nodes": """
+PREFIX has_member: <http://mediagraph.link/jvmg/ont/hasMember>
+
+CONSTRUCT {
+  Graph ?graph { ?o_other ?p_blank ?o_blank . }
+} where {
+  <$resource> has_member: ?o .
+  GRAPH ?graph { ?o ?p_other ?o_other . filter isBlank(?o_other) }
+  ?o_other ?p_blank ?o_blank .
+  $graph_filter
+}
+""",
+    # triples with the cluster as object
+    "back_links": """
+CONSTRUCT {
+  Graph ?graph { ?s ?p ?o . }
+} where {
+  GRAPH ?graph { ?s ?p ?o . filter(?o = <$resource>) }
+  $graph_filter
+}
+""",
+}
+
 QUERY_OVERVIEW = """
 PREFIX jvmg: <http://mediagraph.link/jvmg/ont/> 
 
@@ -238,9 +522,87 @@ SELECT ?type ?label ?order ?count ?graph ?graph_label WHERE {
 }
 """
 
+# labels of many URIs at once, $uris is replaced with a list of <uri>s,
+# $predicates with the <uri>s of LABEL_URIS and GRAPH_LABEL_URIS and
+# $language_filter with a FILTER on the languages of ?label the user chose (or nothing).
+# labels which are only in hidden graphs are left out
+QUERY_LABELS = """
+SELECT DISTINCT ?uri ?predicate ?label WHERE {
+  VALUES ?uri { $uris }
+  VALUES ?predicate { $predicates }
+  ?uri ?predicate ?label .
+  FILTER(NOT EXISTS { GRAPH ?graph { ?uri ?predicate ?label } }
+         || EXISTS { GRAPH ?graph { ?uri ?predicate ?label } $graph_filter })
+  $language_filter
+}
+"""
+LABEL_BATCH_SIZE = 500 # max. number of URIs per QUERY_LABELS query
+LABEL_CACHE_SIZE = 100000 # max. number of URIs whose labels are kept in memory per worker
+LABEL_CACHE_TIMEOUT = 3600 # seconds labels are kept in memory
+
+# labels of all predicates and graphs, loaded by every worker at startup, $predicates is replaced
+# with the <uri>s of LABEL_URIS and GRAPH_LABEL_URIS
+QUERY_LABEL_SNAPSHOT = """
+SELECT ?uri ?predicate ?label WHERE {
+  {
+    { SELECT DISTINCT ?uri WHERE { GRAPH ?graph { ?s ?uri ?o } } }
+    UNION
+    { SELECT DISTINCT ?uri WHERE { GRAPH ?uri { ?s ?p ?o } } }
+  }
+  VALUES ?predicate { $predicates }
+  OPTIONAL { ?uri ?predicate ?label }
+}
+"""
+LABEL_SNAPSHOT = os.path.join(BASE_DIR, "label_snapshot.json") # result of QUERY_LABEL_SNAPSHOT
+
+# number of (property, value) pairs of the entities linking to $resource, labels are fetched with QUERY_LABELS
+QUERY_CROSSTAB = """
+SELECT ?property ?value (COUNT(?entity) AS ?count) WHERE {
+  $properties
+  ?entity ?anything <$resource> .
+  ?entity ?property ?value .
+} GROUP BY ?property ?value
+ORDER BY DESC(?count)
+LIMIT $limit
+"""
+CROSSTAB_TOP_K = 50 # max. number of values shown per property
+CROSSTAB_MAX_ROWS = 100000 # max. number of (property, value) pairs fetched by QUERY_CROSSTAB
+CROSSTAB_PROPERTIES = None # list of property URIs to restrict the crosstab to, None shows all properties
+CROSSTAB_CACHE = "sparql" # cache (see CACHES) for crosstabs, None disables caching
+
+# checksum of the dataset, the overview snapshot is rebuilt when the result of this query changes
+QUERY_OVERVIEW_TOKEN = """
+SELECT ?graph (COUNT(*) AS ?count) WHERE {
+  GRAPH ?graph { ?s ?p ?o }
+} GROUP BY ?graph
+"""
+OVERVIEW_SNAPSHOT = os.path.join(BASE_DIR, "overview_snapshot.json") # materialized result of QUERY_OVERVIEW
+OVERVIEW_REFRESH_INTERVAL = 3600 # seconds between checks of the dataset token by the background refresher, None disables it
+# cache (see CACHES) shared by the workers of a host, only one of them checks the token per interval. None: every
+# worker checks. its entries must not depend on the dataset version, a rebuilt snapshot would let the next worker check
+OVERVIEW_REFRESH_CACHE = "stale"
+
 ELASTICSEARCH = "http://localhost:9200"
+ELASTICSEARCH_POOL_SIZE = 10 # max. number of connections to elasticsearch per worker
+ELASTICSEARCH_TIMEOUT = 10.0 # timeout (in seconds) for elasticsearch requests
 SEARCH_INDEX = "default"
 ELASTICSEARCH_PAGE_SIZE = 20
+SEARCH_FACET_CACHE = "search" # cache (see CACHES) for the facets of searches, None disables caching
+SEARCH_PIT_KEEP_ALIVE = "5m" # how long a point in time for paging through search results is kept between two pages
+
+# requests measured by manage.py benchmark_views: name -> (method, path, parameters),
+# POST parameters are sent as JSON. replace the resources with typical ones of your dataset
+BENCHMARK_SCENARIOS = {
+    "item": ("GET", "/vn/1", {}),
+    "character": ("GET", "/char/1", {}),
+    "hub_tag": ("GET", "/tag/drama", {}),
+    "cluster": ("GET", "/jvmg/cluster/1", {}),
+    "search": ("GET", "/applications/search", {"search": "sakura"}),
+    "search_page": ("POST", "/applications/get_search_page",
+                    {"search": "sakura", "search_type": "match", "checkboxes": {}, "page": 0}),
+    "crosstab": ("GET", "/applications/crosstab", {"uri": "http://mediagraph.link/tag/drama"}),
+    "overview": ("GET", "/overview", {}),
+}
 
 LOGGING = {
     'version': 1,
@@ -252,6 +614,9 @@ LOGGING = {
         'simple': {
             'format': '%(levelname)s %(asctime)s %(message)s'
         },
+        'json': {
+            'format': '%(message)s'
+        },
     },
     'handlers': {
         'file': {
@@ -264,7 +629,13 @@ LOGGING = {
             'level': 'INFO',
             'class': 'logging.FileHandler',
             'filename': 'slow.log',
-            'formatter': 'verbose'
+            'formatter': 'json'
+        },
+        'timing': {
+            'level': 'INFO',
+            'class': 'logging.FileHandler',
+            'filename': 'timing.log',
+            'formatter': 'json'
         },
     },
     'loggers': {
@@ -278,5 +649,10 @@ LOGGING = {
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
             'propagate': True,
         },
+        'timing': {
+            'handlers': ['timing'],
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
     },
 }
@@ -13,4 +13,16 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jvmg_frontend.settings')
 
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+
+from jvmg import overview_snapshot  # noqa: E402
+
+
+def application(environ, start_response):
+    """
+    the django application. the overview and label snapshots are refreshed in the background
+    of the server (not of management commands or tests importing this module), the refresher
+    is started by the first request.
+    """
+    overview_snapshot.start_refresher()
+    return django_application(environ, start_response)